@@ -1,17 +1,45 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.forms.models import BaseModelFormSet
 
-from .models import User, Room, Course, Timetable, Attendance
-from .ai_scheduler import generate_timetable
+from .models import (User, Room, Course, Enrolment, Timetable, Term, Holiday, SessionOccurrence, Attendance, ScheduleJob,
+                     Scenario)
+from .jobs import submit_generation
+from .validation import load_validator, resolve_edits, validate_timetable
 
 # Register your models here.
 
 
 # Custom Action for Timetable Generation
 def generate_timetable_action(modeladmin, request, queryset):
-    generate_timetable()
-    modeladmin.message_user(request, "Timetable has been generated successfully.")
+    job, created = submit_generation()
+    if not created:
+        modeladmin.message_user(request, "Timetable generation is already running (job %s)." % job.id, level=messages.WARNING)
+        return
+    modeladmin.message_user(request, "Timetable generation has been queued as job %s." % job.id)
 generate_timetable_action.short_description = "Generate AI Timetable"
 
+
+# Re-place only the sessions touched by an admin edit, as a job so it never
+# publishes alongside a running generation
+def reschedule_after_edit(modeladmin, request, **changes):
+    job, created = submit_generation(affected={key: list(ids) for key, ids in changes.items()})
+    if not created:
+        modeladmin.message_user(
+            request,
+            "Timetable generation is in progress (job %s); run an incremental generation once it finishes "
+            "to re-place the sessions this edit touched." % job.id,
+            level=messages.WARNING,
+        )
+    elif job.status == 'done' and job.unscheduled:
+        modeladmin.message_user(
+            request,
+            "These courses no longer fit the timetable and need a room: %s" % ", ".join(job.unscheduled),
+            level=messages.WARNING,
+        )
+    elif job.status != 'done':
+        modeladmin.message_user(request, "The sessions this edit touched are being re-placed (job %s)." % job.id)
+
 # User Admin
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -20,6 +48,11 @@ class UserAdmin(admin.ModelAdmin):
     search_fields = ('reg_no', 'name')  # Search by reg_no or name
     ordering = ('reg_no',)  # Sort by registration number
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if obj.role == 'lecturer' and change and 'available_days' in form.changed_data:
+            reschedule_after_edit(self, request, lecturers=[obj.id])
+
     # Prevent adding users via admin if you want strict control
     # def has_add_permission(self, request):
     #     return False
@@ -31,31 +64,147 @@ class RoomAdmin(admin.ModelAdmin):
     search_fields = ('name',)
     ordering = ('name',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'capacity' in form.changed_data:
+            reschedule_after_edit(self, request, rooms=[obj.id])
+
+    def delete_model(self, request, obj):
+        # Sessions in the room lose it (SET_NULL) and are picked up as roomless
+        super().delete_model(request, obj)
+        reschedule_after_edit(self, request)
+
 # Course Admin
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
-    list_display = ('code', 'name', 'lecturer', 'room')
+    list_display = ('code', 'name', 'lecturer', 'room', 'session_minutes')
     list_filter = ('lecturer',)
     search_fields = ('code', 'name')
     autocomplete_fields = ('lecturer', 'room')  # Searchable dropdowns for foreign keys
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change or {'lecturer', 'room', 'students', 'session_minutes'} & set(form.changed_data):
+            reschedule_after_edit(self, request, courses=[obj.id])
+
+# Enrolment Admin
+@admin.register(Enrolment)
+class EnrolmentAdmin(admin.ModelAdmin):
+    list_display = ('user', 'course')
+    list_filter = ('course',)
+    search_fields = ('user__reg_no', 'user__name', 'course__code')
+    autocomplete_fields = ('user', 'course')
+
+# Hard-constraint checks of Timetable edits (see api.validation), all the
+# valid forms of a submission in one pass; each conflict goes to the form
+# of its session
+def check_timetable_forms(forms):
+    if not forms:
+        return
+    records = []
+    for form in forms:
+        data, instance = form.cleaned_data, form.instance
+        course = data.get('course')
+        room = data['room'] if 'room' in data else instance.room
+        records.append({
+            'timetable_id': instance.pk,
+            'course_id': course.id if course is not None else instance.course_id,
+            'day': data.get('day', instance.day),
+            'start_time': data.get('start_time', instance.start_time),
+            'end_time': data.get('end_time', instance.end_time),
+            'room_id': room.id if room is not None else None,
+        })
+    validator = load_validator()
+    for conflict in validator.check(resolve_edits(validator, records)):
+        # Timetable.clean already reports a room taken by a session outside the batch
+        if conflict.kind == 'room_clash' and conflict.other_edit is None:
+            continue
+        forms[conflict.edit].add_error(None, conflict.message)
+
+class TimetableAdminForm(forms.ModelForm):
+    class Meta:
+        model = Timetable
+        fields = '__all__'
+
+    def clean(self):
+        data = super().clean()
+        if not self.errors:
+            check_timetable_forms([self])
+        return data
+
+class TimetableChangeListFormSet(BaseModelFormSet):
+    # Rows edited on the change list are checked together, against each other
+    # and the rest of the timetable, rather than one by one
+    def clean(self):
+        super().clean()
+        check_timetable_forms([form for form in self.forms if form.has_changed() and not form.errors])
+
+# Report every conflict of the live timetable
+def check_timetable_action(modeladmin, request, queryset):
+    conflicts = validate_timetable()
+    if not conflicts:
+        modeladmin.message_user(request, "The timetable has no conflicts.")
+        return
+    shown = "; ".join(conflict.message for conflict in conflicts[:10])
+    more = " (and %d more)" % (len(conflicts) - 10) if len(conflicts) > 10 else ""
+    modeladmin.message_user(request, "%d conflicts: %s%s" % (len(conflicts), shown, more), level=messages.WARNING)
+check_timetable_action.short_description = "Check the timetable for conflicts"
+
 # Timetable Admin
 @admin.register(Timetable)
 class TimetableAdmin(admin.ModelAdmin):
+    form = TimetableAdminForm
     list_display = ('course', 'day', 'start_time', 'end_time', 'room', 'is_canceled')
+    list_editable = ('day', 'start_time', 'end_time', 'room')
     list_filter = ('day', 'is_canceled', 'room')
     search_fields = ('course__code', 'course__name')
-    ordering = ('day', 'start_time')
-    actions = [generate_timetable_action]  # Add custom action to generate timetable
+    ordering = ('week_start',)
+    actions = [generate_timetable_action, check_timetable_action]  # Custom actions: generate the timetable, check it
+
+    def get_changelist_formset(self, request, **kwargs):
+        return super().get_changelist_formset(request, formset=TimetableChangeListFormSet, **kwargs)
 
     # Prevent manual timetable edits if AI handles it
     # def has_change_permission(self, request, obj=None):
     #     return False
 
+# Term Calendar Admin
+@admin.register(Term)
+class TermAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start', 'end')
+    ordering = ('-start',)
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ('name', 'start', 'end')
+    ordering = ('-start',)
+
+@admin.register(SessionOccurrence)
+class SessionOccurrenceAdmin(admin.ModelAdmin):
+    list_display = ('timetable', 'date', 'is_canceled')
+    list_filter = ('is_canceled',)
+    search_fields = ('timetable__course__code',)
+    ordering = ('-date',)
+
 # Attendance Admin
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
-    list_display = ('user', 'timetable', 'attended', 'timestamp')
+    list_display = ('user', 'timetable', 'occurrence', 'attended', 'timestamp')
     list_filter = ('attended', 'timetable__day')
     search_fields = ('user__reg_no', 'user__name', 'timetable__course__code')
-    ordering = ('-timestamp',)  # Most recent first
\ No newline at end of file
+    ordering = ('-timestamp',)  # Most recent first
+
+# Timetable Generation Job Admin
+@admin.register(ScheduleJob)
+class ScheduleJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'incremental', 'progress', 'placed', 'total', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+    readonly_fields = [field.name for field in ScheduleJob._meta.fields]
+
+# What-if Scenario Admin
+@admin.register(Scenario)
+class ScenarioAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'mode', 'base_version', 'created_at', 'promoted_at')
+    ordering = ('-created_at',)
+    readonly_fields = [field.name for field in Scenario._meta.fields]
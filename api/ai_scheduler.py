@@ -1,37 +1,317 @@
-from .models import Course, Room, Timetable
-import random
-from datetime import time
-
-DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
-TIMESLOTS = [(time(9, 0), time(12, 0)), (time(13, 0), time(16, 0))]  # 3-hour slots
-
-def generate_timetable():
-    courses = Course.objects.all()
-    rooms = Room.objects.all()
-
-    # Clear existing timetable
-    Timetable.objects.all().delete()
-
-    for course in courses:
-        allocated = False
-        while not allocated:
-            day = random.choice(DAYS)
-            timeslot = random.choice(TIMESLOTS)
-            room = random.choice(rooms)
-
-            # Check for clashes
-            clash = Timetable.objects.filter(
-                day=day, start_time=timeslot[0], room=room
-            ).exists()
-
-            if not clash:
-                Timetable.objects.create(
-                    course=course,
-                    day=day,
-                    start_time=timeslot[0],
-                    end_time=timeslot[1],
-                    room=room
-                )
-                allocated = True
-
-    return True
\ No newline at end of file
+import itertools
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .metrics import observe_solution
+from .models import Course, Enrolment, Room, Timetable, User
+from .objectives import Evaluator, Weights
+from .slots import WEEK, CELL_MINUTES, MINUTES_PER_DAY, IntervalIndex, SlotGrid, day_and_time, week_minute
+from .solver import CourseSpec, Problem, RoomSpec, reschedule, solve, violations
+from .changes import record_changes
+from .timetable_cache import invalidate_timetable
+from .validation import check_published
+
+logger = logging.getLogger(__name__)
+
+
+def day_slots(slots, days):
+    # Bitmask of the slots, given as (start, end) week minutes, that start on one of the given days
+    wanted = {WEEK.index(day) for day in days if day in WEEK}
+    mask = 0
+    for i, (start, _) in enumerate(slots):
+        if start // MINUTES_PER_DAY in wanted:
+            mask |= 1 << i
+    return mask
+
+
+def load_problem():
+    # One query per table; everything after this works on plain tuples
+    rooms = [RoomSpec(*row) for row in Room.objects.values_list('id', 'capacity')]
+    lecturers = list(
+        User.objects.filter(role='lecturer').exclude(available_days='', preferred_days='', max_hours_per_week=None)
+        .only('id', 'available_days', 'preferred_days', 'max_hours_per_week')
+    )
+    rows = list(Course.objects.order_by('id').values_list('id', 'code', 'lecturer_id', 'students', 'room_id', 'session_minutes'))
+    course_index = {row[0]: c for c, row in enumerate(rows)}
+
+    # Slots of every session length in use; a slot's mask covers the grid
+    # cells it spans, so sessions of different lengths clash where they overlap
+    grid = SlotGrid()
+    slots, by_length = [], {}
+    for minutes in sorted({row[5] for row in rows}):
+        lengths = grid.slots(minutes)
+        by_length[minutes] = ((1 << len(lengths)) - 1) << len(slots)
+        slots += lengths
+    all_slots = (1 << len(slots)) - 1
+    availability = {
+        lecturer.id: day_slots(slots, lecturer.get_available_days()) or all_slots for lecturer in lecturers
+    }
+    preferred = {lecturer.id: day_slots(slots, lecturer.get_preferred_days()) or None for lecturer in lecturers}
+    limits = {lecturer.id: lecturer.max_hours_per_week * 60 for lecturer in lecturers if lecturer.max_hours_per_week}
+
+    # Students sharing the same set of courses form one clash group
+    enrolled = Counter()
+    groups = Counter()  # group -> students in it
+    student, taken = None, []
+    for user_id, course_id in itertools.chain(
+        Enrolment.objects.order_by('user_id').values_list('user_id', 'course_id').iterator(chunk_size=5000),
+        [(None, None)],
+    ):
+        if user_id != student:
+            if len(taken) > 1:
+                groups[tuple(sorted(taken))] += 1
+            student, taken = user_id, []
+        if course_id is not None:
+            enrolled[course_id] += 1
+            taken.append(course_index[course_id])
+
+    courses = [
+        CourseSpec(course_id, code, lecturer_id, max(students, enrolled[course_id]), room_id,
+                   by_length[minutes] & availability.get(lecturer_id, all_slots), preferred.get(lecturer_id))
+        for course_id, code, lecturer_id, students, room_id, minutes in rows
+    ]
+    groups = sorted(groups.items())
+    return Problem(
+        courses, rooms, [grid.mask(start, end) for start, end in slots], [group for group, _ in groups],
+        slot_times=slots, lecturer_limits=limits, group_sizes=[size for _, size in groups],
+    )
+
+
+def load_timetable(problem):
+    # Live sessions in solver terms: course index -> (slot, room index), the
+    # row id holding each course's session, and surplus rows of courses that
+    # have more than one session. A session overlapping an earlier one in
+    # the same room or with the same lecturer is left out of current, so it
+    # is re-placed like one that lost its room.
+    slot_index = {interval: i for i, interval in enumerate(problem.slot_times)}
+    course_index = {course.id: c for c, course in enumerate(problem.courses)}
+    taken = defaultdict(IntervalIndex)  # ('room', id) or ('lecturer', id) -> live sessions
+    current, rows, extra = {}, {}, []
+    for row_id, course_id, week_start, week_end, room_id in Timetable.objects.order_by('id').values_list(
+        'id', 'course_id', 'week_start', 'week_end', 'room_id'
+    ):
+        c = course_index[course_id]
+        if c in rows:
+            extra.append(row_id)
+            continue
+        rows[c] = row_id
+        slot = slot_index.get((week_start, week_end))
+        r = problem.room_index.get(room_id)
+        if slot is None or r is None:
+            continue
+        resources = [('room', room_id), ('lecturer', problem.courses[c].lecturer_id)]
+        if any(taken[resource].overlapping(week_start, week_end) for resource in resources):
+            continue
+        for resource in resources:
+            taken[resource].add(week_start, week_end, c)
+        current[c] = (slot, r)
+    return current, rows, extra
+
+
+def publish(solution, current, rows, delete=()):
+    # Write only what changed. Rows keep their ids (and so their attendance)
+    # when a session moves; new sessions are inserted in bulk. Rows of courses
+    # left unplaced lose their room, as another session may now hold it, and
+    # so do rows to delete that have attendance or occurrences: deleting
+    # would cascade to that history.
+    problem = solution.problem
+    delete = set(delete)
+    moved, created = [], []
+    parked = [
+        Timetable(id=row_id, room=None)
+        for c, row_id in rows.items()
+        if c not in solution.assignment and row_id not in delete and current.get(c) is not None
+    ]
+    for c, (slot, r) in sorted(solution.assignment.items()):
+        if current.get(c) == (slot, r):
+            continue
+        week_start, week_end = problem.slot_times[slot]
+        day, start_time = day_and_time(week_start)
+        fields = dict(day=day, start_time=start_time, end_time=day_and_time(week_end)[1],
+                      week_start=week_start, week_end=week_end, room_id=problem.rooms[r].id)
+        if c in rows:
+            moved.append(Timetable(id=rows[c], **fields))
+        else:
+            created.append(Timetable(course_id=problem.courses[c].id, **fields))
+        solution.changed.append(problem.courses[c].id)
+
+    with transaction.atomic():
+        if delete:
+            kept = Timetable.objects.filter(id__in=delete).filter(
+                Q(attendance__isnull=False) | Q(occurrences__isnull=False)
+            ).distinct().values_list('id', 'room_id')
+            for row_id, room_id in kept:
+                delete.discard(row_id)
+                if room_id is not None:
+                    parked.append(Timetable(id=row_id, room=None))
+        if delete:
+            # Deletions reach the change feed through the post_delete signal
+            Timetable.objects.filter(id__in=delete).delete()
+        saved = {t.id: 'updated' for t in parked}
+        if moved or parked:
+            # Park moved rows outside the (room, day, start_time) constraint
+            # first, so two sessions can swap places within one update.
+            parked += [Timetable(id=t.id, room=None) for t in moved]
+            Timetable.objects.bulk_update(parked, ['room'], batch_size=500)
+        if moved:
+            Timetable.objects.bulk_update(
+                moved, ['day', 'start_time', 'end_time', 'week_start', 'week_end', 'room'], batch_size=500
+            )
+            saved.update((t.id, 'updated') for t in moved)
+        Timetable.objects.bulk_create(created, batch_size=1000)
+        invalidate_timetable()
+        if any(t.id is None for t in created):  # Backends that do not return inserted ids
+            created = Timetable.objects.filter(course_id__in=[t.course_id for t in created]).only('id')
+        saved.update((t.id, 'created') for t in created)
+        record_changes(saved)
+        # The output check: the written sessions against the whole timetable,
+        # rows the search did not model (a course's surplus sessions) included
+        written = {t.id for t in moved} | {t.id for t in created}
+        if written:
+            solution.conflicts = check_published(problem, written)
+    solution.stats['conflicts'] = len(solution.conflicts)
+    for conflict in solution.conflicts:
+        logger.warning("Published session %s: %s", conflict.timetable_id, conflict.message)
+    return solution
+
+
+def scheduler_weights():
+    # Soft-objective weights from settings, None when SCHEDULER_WEIGHTS is unset
+    weights = getattr(settings, 'SCHEDULER_WEIGHTS', None)
+    return None if weights is None else Weights(**weights)
+
+
+def _budget(backend, time_limit, workers):
+    backend = backend or getattr(settings, 'SCHEDULER_BACKEND', 'auto')
+    if time_limit is None:
+        time_limit = getattr(settings, 'SCHEDULER_TIME_LIMIT', None)
+    if workers is None:
+        workers = getattr(settings, 'SCHEDULER_WORKERS', None) or os.cpu_count()
+    return backend, time_limit, workers
+
+
+def generate_timetable(backend=None, time_limit=None, workers=None, incremental=False, progress=None, starts=None,
+                       seed=None):
+    """
+    Build the week's timetable and write it to the Timetable table.
+
+    Sessions that land where they already were are left untouched and moved
+    sessions keep their row, so attendance survives regeneration; rows of
+    courses that could not be placed are kept without a room, and a course's
+    surplus rows are deleted unless they have attendance, in which case they
+    lose their room too. With ``incremental=True``
+    every still-valid session is kept as is, only invalid or missing ones are
+    re-placed, and nothing is deleted. ``progress`` is handed to the solver,
+    see ``api.solver.solve``.
+
+    A full generation runs ``starts`` seeded searches (SCHEDULER_STARTS)
+    from ``seed`` (SCHEDULER_SEED) and keeps the best, see
+    ``api.solver.multistart``; in this process unless
+    SCHEDULER_START_WORKERS opts in to a process pool.
+    """
+    backend, time_limit, workers = _budget(backend, time_limit, workers)
+    if starts is None:
+        starts = getattr(settings, 'SCHEDULER_STARTS', 1)
+    if seed is None:
+        seed = getattr(settings, 'SCHEDULER_SEED', 0)
+    started = time.monotonic()
+    problem = load_problem()
+    current, rows, extra = load_timetable(problem)
+    loaded = time.monotonic()
+
+    if incremental:
+        solution = reschedule(problem, current, set(range(len(problem.courses))), time_limit, progress)
+        return _observed(publish(solution, current, rows), 'incremental', started, loaded)
+
+    solution = solve(
+        problem, backend=backend, time_limit=time_limit, workers=workers, progress=progress, weights=scheduler_weights(),
+        starts=starts, seed=seed, start_workers=getattr(settings, 'SCHEDULER_START_WORKERS', None),
+    )
+    # A course keeps a single weekly session
+    return _observed(publish(solution, current, rows, extra), 'full', started, loaded)
+
+
+def _observed(solution, mode, started, loaded):
+    # Add the database side of the run to the solver's stats and record it
+    solution.stats['load_s'] = loaded - started
+    solution.stats['total_s'] = time.monotonic() - started
+    observe_solution(solution, mode)
+    return solution
+
+
+def reschedule_affected(courses=(), rooms=(), lecturers=(), time_limit=None):
+    """
+    Re-place the sessions touched by a change to the given course, room or
+    lecturer ids, leaving the rest of the timetable as it is.
+
+    Sessions without a room (their room was deleted) and courses without a
+    session are always re-placed. Courses that cannot be placed keep their
+    row, without a room, and are reported in ``unscheduled``.
+    """
+    if time_limit is None:
+        time_limit = getattr(settings, 'SCHEDULER_TIME_LIMIT', None)
+    started = time.monotonic()
+    problem = load_problem()
+    current, rows, _ = load_timetable(problem)
+    loaded = time.monotonic()
+
+    courses, rooms, lecturers = set(courses), set(rooms), set(lecturers)
+    affected = set()
+    for c, course in enumerate(problem.courses):
+        placed = current.get(c)
+        if (
+            placed is None
+            or course.id in courses
+            or course.lecturer_id in lecturers
+            or problem.rooms[placed[1]].id in rooms
+        ):
+            affected.add(c)
+
+    solution = reschedule(problem, current, affected, time_limit)
+    return _observed(publish(solution, current, rows), 'affected', started, loaded)
+
+
+def evaluate_timetable(moves=(), weights=None):
+    """
+    Score the live timetable on the soft objectives, and the timetable it
+    would become after ``moves``: ``(timetable_id, day, start_time, room_id)``
+    tuples, where a None room keeps the session's own. Moves are applied one
+    at a time to an ``Evaluator``, so each costs only the components it
+    touches. Hard-constraint breaches of the result are listed, not refused.
+
+    Raises ValueError for a move naming an unknown session or room, or a
+    start that is not a slot of the session's length.
+    """
+    problem = load_problem()
+    current, rows, _ = load_timetable(problem)
+    evaluator = Evaluator(problem, current, weights)
+    result = {'weights': evaluator.weights._asdict(), 'current': evaluator.breakdown()}
+    if moves:
+        course_of = {row_id: c for c, row_id in rows.items()}
+        slot_index = {interval: i for i, interval in enumerate(problem.slot_times)}
+        minutes = dict(Course.objects.values_list('id', 'session_minutes'))
+        for timetable_id, day, start_time, room_id in moves:
+            c = course_of.get(timetable_id)
+            if c is None:
+                raise ValueError(f"No session {timetable_id}")
+            length = -(-minutes[problem.courses[c].id] // CELL_MINUTES) * CELL_MINUTES
+            start = week_minute(day, start_time)
+            slot = slot_index.get((start, start + length))
+            if slot is None:
+                raise ValueError(f"{day} {start_time:%H:%M} is not a slot for session {timetable_id}")
+            r = problem.room_index.get(room_id) if room_id is not None else current.get(c, (None, None))[1]
+            if r is None:
+                raise ValueError(f"Session {timetable_id} needs a room" if room_id is None else f"No room {room_id}")
+            evaluator.move(c, (slot, r))
+        result['proposed'] = evaluator.breakdown()
+        result['delta'] = round(result['proposed']['total'] - result['current']['total'], 4)
+    result['violations'] = [
+        {'course': problem.courses[c].code, 'error': reason} for c, reason in violations(problem, evaluator.assignment)
+    ]
+    return result
@@ -0,0 +1,268 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, ExpressionWrapper, F, FloatField, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import (Attendance, Course, Enrolment, Holiday, SessionAttendanceStats, SessionOccurrence,
+                     StudentAttendanceStats, Term, Timetable)
+from .occurrences import TermCalendar
+from .slots import MINUTES_PER_DAY
+
+# Rollup rows are recomputed from Attendance for exactly the sessions and
+# (student, course) pairs a batch of check-ins touched, so they stay correct
+# under retries and concurrent batches, and the cost of an update depends on
+# the size of one course rather than of the whole table.
+#
+# A check-in counts once per occurrence attended, and rates divide by the
+# occurrences held so far (see held_occurrences), which grow week by week;
+# so those are counted when rates are read, not stored.
+
+
+def held_occurrences(course_ids, today=None):
+    """
+    The occurrences of the courses' live sessions held up to ``today``, by
+    course id: ``(timetable_id, date)`` in the order they were held, weeks
+    canceled on their own left out. Before any term has started each weekly
+    session is held once, dated None, as check-ins then count once per class.
+    """
+    today = today or timezone.localdate()
+    held = {course_id: [] for course_id in course_ids}
+    sessions = sorted(
+        Timetable.objects.filter(course_id__in=held, is_canceled=False).order_by()
+        .values_list('id', 'course_id', 'week_start'),
+        key=lambda session: (session[2], session[0]),
+    )
+    terms = list(Term.objects.filter(start__lte=today).values_list('start', 'end'))
+    if not terms:
+        for timetable_id, course_id, _ in sessions:
+            held[course_id].append((timetable_id, None))
+        return held
+    first = min(start for start, _ in terms)
+    calendar = TermCalendar(terms, Holiday.objects.filter(start__lte=today, end__gte=first).values_list('start', 'end', 'name'))
+    days = defaultdict(list)  # Weekday -> teaching dates
+    for day in calendar.teaching_days(first, today):
+        days[day.weekday()].append(day)
+    canceled = set(SessionOccurrence.objects.filter(
+        timetable_id__in=[timetable_id for timetable_id, _, _ in sessions], date__range=(first, today), is_canceled=True,
+    ).values_list('timetable_id', 'date'))
+    dated = defaultdict(list)
+    for timetable_id, course_id, week_start in sessions:
+        dated[course_id] += [
+            (day, week_start, timetable_id) for day in days[week_start // MINUTES_PER_DAY]
+            if (timetable_id, day) not in canceled
+        ]
+    for course_id, occurrences in dated.items():
+        held[course_id] = [(timetable_id, day) for day, _, timetable_id in sorted(occurrences)]
+    return held
+
+
+def refresh_rollups(pairs, course_of):
+    """
+    Recompute the rollups affected by the ``(timetable_id, user_id)``
+    check-ins; ``course_of`` maps their timetable ids to course ids. Call it
+    inside the transaction that recorded them.
+    """
+    if not course_of:
+        return
+    counts = dict(
+        Attendance.objects.filter(timetable_id__in=course_of, attended=True)
+        .order_by().values('timetable_id').annotate(n=Count('id')).values_list('timetable_id', 'n')
+    )
+    keys = {(u, course_of[t]) for t, u in pairs if t in course_of}
+    SessionAttendanceStats.objects.bulk_create(
+        [SessionAttendanceStats(timetable_id=t, course_id=c, attended=counts.get(t, 0)) for t, c in course_of.items()],
+        update_conflicts=True, unique_fields=['timetable'], update_fields=['attended'],
+    )
+    _write_student_stats(keys)
+
+
+def rebuild_rollups(batch_size=5000):
+    """Recompute every rollup from scratch; returns ``(sessions, students)`` rows written."""
+    with transaction.atomic():
+        SessionAttendanceStats.objects.all().delete()
+        StudentAttendanceStats.objects.all().delete()
+
+        counts = (
+            Attendance.objects.filter(attended=True).order_by()
+            .values('timetable_id').annotate(n=Count('id'))
+            .values_list('timetable_id', 'timetable__course_id', 'n')
+        )
+        sessions = SessionAttendanceStats.objects.bulk_create(
+            [SessionAttendanceStats(timetable_id=t, course_id=c, attended=n) for t, c, n in counts.iterator()],
+            batch_size=batch_size,
+        )
+
+        # Every enrolled student gets a row, so students who never checked in still raise alerts
+        keys = set(Enrolment.objects.values_list('user_id', 'course_id').iterator(chunk_size=batch_size))
+        keys.update(
+            Attendance.objects.filter(attended=True).order_by()
+            .values_list('user_id', 'timetable__course_id').distinct().iterator(chunk_size=batch_size)
+        )
+        keys = sorted(keys)
+        students = 0
+        for start in range(0, len(keys), batch_size):
+            students += _write_student_stats(keys[start:start + batch_size])
+    return len(sessions), students
+
+
+def streaks(ranks):
+    """``(current, best)`` runs of consecutive session ranks; current ends at the last one attended."""
+    run = best = 0
+    previous = None
+    for rank in sorted(ranks):
+        run = run + 1 if previous == rank - 1 else 1
+        best = max(best, run)
+        previous = rank
+    return run, best
+
+
+def _write_student_stats(keys):
+    # Upsert the StudentAttendanceStats rows of the given (user_id, course_id) pairs
+    if not keys:
+        return 0
+    user_ids = {u for u, _ in keys}
+    course_ids = {c for _, c in keys}
+    # Position of every held occurrence within its course's run of them
+    ranks = {
+        occurrence: rank
+        for occurrences in held_occurrences(course_ids).values() for rank, occurrence in enumerate(occurrences)
+    }
+    attended = {key: set() for key in keys}  # Ranks of the held occurrences attended
+    last = {}
+    for user_id, timetable_id, course_id, day, timestamp in Attendance.objects.filter(
+        user_id__in=user_ids, timetable__course_id__in=course_ids, attended=True
+    ).values_list('user_id', 'timetable_id', 'timetable__course_id', 'occurrence__date', 'timestamp'):
+        key = (user_id, course_id)
+        if key not in attended:
+            continue
+        rank = ranks.get((timetable_id, day))
+        if rank is not None:
+            attended[key].add(rank)
+        if key not in last or timestamp > last[key]:
+            last[key] = timestamp
+
+    rows = []
+    for (user_id, course_id), held in attended.items():
+        current, best = streaks(held)
+        rows.append(StudentAttendanceStats(
+            user_id=user_id, course_id=course_id, attended=len(held),
+            current_streak=current, best_streak=best, last_checkin=last.get((user_id, course_id)),
+        ))
+    StudentAttendanceStats.objects.bulk_create(
+        rows, batch_size=500, update_conflicts=True, unique_fields=['user', 'course'],
+        update_fields=['attended', 'current_streak', 'best_streak', 'last_checkin'],
+    )
+    return len(rows)
+
+
+def _rate(attended, possible):
+    return round(attended / possible, 4) if possible else None
+
+
+def _held_counts(course_ids):
+    return {course_id: len(occurrences) for course_id, occurrences in held_occurrences(course_ids).items()}
+
+
+def _held_per_session(course_id):
+    held = defaultdict(int)
+    for timetable_id, _ in held_occurrences([course_id])[course_id]:
+        held[timetable_id] += 1
+    return held
+
+
+def course_stats(course):
+    """Attendance of a course overall and per session; ``course`` is a Course."""
+    enrolled = max(course.students, Enrolment.objects.filter(course_id=course.id).count())
+    held = _held_per_session(course.id)
+    sessions = [
+        {
+            'timetable_id': row_id, 'day': day, 'start_time': start_time.isoformat(), 'held': held[row_id],
+            'attended': attended or 0, 'rate': _rate(attended or 0, enrolled * held[row_id]),
+        }
+        for row_id, day, start_time, attended in Timetable.objects.filter(course_id=course.id, is_canceled=False)
+        .order_by('id').values_list('id', 'day', 'start_time', 'attendance_stats__attended')
+    ]
+    attended = sum(session['attended'] for session in sessions)
+    return {
+        'course_id': course.id,
+        'course': f"{course.code} - {course.name}",
+        'enrolled': enrolled,
+        'sessions': sessions,
+        'attended': attended,
+        'rate': _rate(attended, enrolled * sum(held.values())),
+    }
+
+
+def session_stats(timetable):
+    """Attendance of one session; ``timetable`` is a Timetable."""
+    enrolled = max(timetable.course.students, Enrolment.objects.filter(course_id=timetable.course_id).count())
+    attended = SessionAttendanceStats.objects.filter(timetable_id=timetable.id).values_list('attended', flat=True).first() or 0
+    held = _held_per_session(timetable.course_id)[timetable.id]
+    return {
+        'timetable_id': timetable.id,
+        'course_id': timetable.course_id,
+        'enrolled': enrolled,
+        'held': held,
+        'attended': attended,
+        'rate': _rate(attended, enrolled * held),
+    }
+
+
+def student_stats(user_id):
+    """A student's attendance rate and streaks in each of their courses; ``sessions`` are the occurrences held."""
+    rows = list(
+        StudentAttendanceStats.objects.filter(user_id=user_id).order_by('course_id')
+        .values_list('course_id', 'course__code', 'course__name', 'attended', 'current_streak', 'best_streak',
+                     'last_checkin')
+    )
+    held = _held_counts([row[0] for row in rows])
+    courses = [
+        {
+            'course_id': course_id,
+            'course': f"{code} - {name}",
+            'sessions': held[course_id],
+            'attended': attended,
+            'rate': _rate(attended, held[course_id]),
+            'current_streak': current_streak,
+            'best_streak': best_streak,
+            'last_checkin': last_checkin.isoformat() if last_checkin else None,
+        }
+        for course_id, code, name, attended, current_streak, best_streak, last_checkin in rows
+    ]
+    sessions = sum(course['sessions'] for course in courses)
+    attended = sum(course['attended'] for course in courses)
+    return {'user_id': user_id, 'sessions': sessions, 'attended': attended, 'rate': _rate(attended, sessions),
+            'courses': courses}
+
+
+def low_attendance(threshold, lecturer_id=None, course_id=None, limit=500):
+    """Students whose attendance rate in a course is below ``threshold``, worst first."""
+    courses = Course.objects.all()
+    if lecturer_id is not None:
+        courses = courses.filter(lecturer_id=lecturer_id)
+    if course_id is not None:
+        courses = courses.filter(id=course_id)
+    # Courses grouped by the occurrences held so far, which the query takes as constants
+    by_held = defaultdict(list)
+    for course, held in _held_counts(list(courses.values_list('id', flat=True))).items():
+        if held:
+            by_held[held].append(course)
+    if not by_held:
+        return []
+    alerts = StudentAttendanceStats.objects.filter(course_id__in=[c for ids in by_held.values() for c in ids]).annotate(
+        sessions=Case(*[When(course_id__in=ids, then=Value(held)) for held, ids in by_held.items()],
+                      output_field=IntegerField()),
+    ).alias(
+        expected=ExpressionWrapper(F('sessions') * Value(threshold), output_field=FloatField()),
+        ratio=ExpressionWrapper(F('attended') * 1.0 / F('sessions'), output_field=FloatField()),
+    ).filter(attended__lt=F('expected')).order_by('ratio', 'user_id', 'course_id')
+    return [
+        {
+            'user_id': user_id, 'reg_no': reg_no, 'course_id': course,
+            'sessions': sessions, 'attended': attended, 'rate': _rate(attended, sessions),
+        }
+        for user_id, reg_no, course, sessions, attended in alerts.values_list(
+            'user_id', 'user__reg_no', 'course_id', 'sessions', 'attended'
+        )[:limit]
+    ]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .attendance import checkin_buffer, record_checkins
+from .auth import asession_user
+from .changes import PAGE_SIZE, achanges_since, alatest_seq, broker
+from .models import ScheduleJob
+from .routing import replica_reads
+from .serializers import ScheduleJobSerializer
+from .timetable_cache import acurrent_version, atimetable_document, timetable_etag
+
+# Async twins of the endpoints mobile clients hit most: the timetable, the
+# check-in tap and the job poll. DRF's APIView cannot run async handlers, so
+# these are plain Django views; under an ASGI server (uvicorn/daphne on
+# smartdaro.asgi) they wait on the database without holding a thread each.
+# Responses match the DRF views. The change stream only exists here: it is
+# open for minutes and would tie up a WSGI worker for all of them.
+
+
+def not_authenticated():
+    return JsonResponse({"error": "Not authenticated"}, status=401)
+
+
+@require_GET
+async def timetable(request):
+    user = await asession_user(request)
+    if user is None:
+        return not_authenticated()
+    user_id, role = user
+
+    with replica_reads(request):
+        version = await acurrent_version()
+        etag = timetable_etag(version, role, user_id)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(await atimetable_document(version, role, user_id), content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@csrf_exempt  # Like the DRF views, which exempt themselves
+@require_POST
+async def attendance(request, timetable_id):
+    user = await asession_user(request)
+    if user is None:
+        return not_authenticated()
+    user_id = user.id
+
+    if settings.ATTENDANCE_BUFFER_ENABLED:
+        checkin_buffer.add(timetable_id, user_id)
+        return JsonResponse({"message": "Attendance queued"}, status=202)
+
+    # The insert and rollup refresh share a transaction, which the async ORM
+    # cannot open; run them on the shared sync thread
+    accepted, _ = await sync_to_async(record_checkins)([(timetable_id, user_id)])
+    if not accepted:
+        return JsonResponse({"error": "Timetable not found"}, status=404)
+    return JsonResponse({"message": "Attendance marked"})
+
+
+@require_GET
+async def schedule_job(request, job_id):
+    # Like ScheduleJobView: an API user, or the staff user who started the job
+    if await asession_user(request) is None and not (await request.auser()).is_staff:
+        return not_authenticated()
+    job = await ScheduleJob.objects.filter(id=job_id).afirst()
+    if job is None:
+        return JsonResponse({"error": "Job not found"}, status=404)
+    return JsonResponse(ScheduleJobSerializer(job).data)
+
+
+@require_GET
+async def timetable_changes(request):
+    # Server-sent events of the caller's timetable changes: one event per
+    # change, named after its action, with the change as data and its seq as
+    # id. Starts after ?since=, a reconnecting client's Last-Event-ID, or now
+    user = await asession_user(request)
+    if user is None:
+        return not_authenticated()
+    user_id, role = user
+    since = request.GET.get('since') or request.headers.get('Last-Event-ID')
+    try:
+        since = int(since) if since else await alatest_seq()
+    except ValueError:
+        return JsonResponse({"error": "since must be an integer"}, status=400)
+
+    async def events(seq):
+        waiter = broker.subscribe()
+        loop = asyncio.get_running_loop()
+        closes = loop.time() + settings.TIMETABLE_STREAM_SECONDS
+        try:
+            yield f'retry: 3000\nid: {seq}\n\n'
+            while True:
+                latest = await alatest_seq()
+                changes = await achanges_since(role, user_id, seq)
+                for change in changes:
+                    yield f"id: {change['seq']}\nevent: {change['action']}\ndata: {json.dumps(change)}\n\n"
+                if len(changes) == PAGE_SIZE:
+                    seq = changes[-1]['seq']
+                    continue
+                seq = max(seq, latest)
+                remaining = closes - loop.time()
+                if remaining <= 0:
+                    return
+                if not await broker.wait(waiter, min(settings.TIMETABLE_STREAM_HEARTBEAT, remaining)):
+                    # Moves the client's Last-Event-ID past other users' changes too
+                    yield f'id: {seq}\n: keep-alive\n\n'
+        finally:
+            broker.unsubscribe(waiter)
+
+    response = StreamingHttpResponse(events(since), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Do not let nginx hold events back
+    return response
@@ -0,0 +1,126 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .analytics import refresh_rollups
+from .models import Attendance, Timetable, User
+from .occurrences import occurrences_on
+
+logger = logging.getLogger(__name__)
+
+
+def record_checkins(records, on=None, lecturer_id=None):
+    """
+    Mark attendance for many ``(timetable_id, user_id)`` pairs at once, on
+    date ``on`` (today by default).
+
+    Returns ``(accepted, rejected)``: the pairs that are now recorded, and the
+    pairs naming a session or user that does not exist, or with
+    ``lecturer_id``, a session of a course someone else teaches. Check-ins that were
+    already recorded, or repeat within the batch, count as accepted, so
+    clients can safely retry. Check-ins to a session held on ``on`` in the
+    term calendar are recorded against that occurrence, so each week counts
+    once; others, like every check-in when no term is set up, once per
+    session. The attendance rollups of the touched sessions and students are
+    refreshed in the same transaction.
+    """
+    pairs = list(dict.fromkeys((int(t), int(u)) for t, u in records))
+    if not pairs:
+        return [], []
+    sessions = Timetable.objects.filter(id__in={t for t, _ in pairs})
+    if lecturer_id is not None:
+        sessions = sessions.filter(course__lecturer_id=lecturer_id)
+    sessions = sessions.values_list('id', 'course_id', 'week_start')
+    timetables, week_starts = {}, {}
+    for timetable_id, course_id, week_start in sessions:
+        timetables[timetable_id] = course_id
+        week_starts[timetable_id] = week_start
+    users = set(User.objects.filter(id__in={u for _, u in pairs}).values_list('id', flat=True))
+
+    accepted, rejected = [], []
+    for pair in pairs:
+        (accepted if pair[0] in timetables and pair[1] in users else rejected).append(pair)
+
+    with transaction.atomic():
+        occurrences = occurrences_on(on or timezone.localdate(), {t: week_starts[t] for t, _ in accepted}) if accepted else {}
+        Attendance.objects.bulk_create(
+            [Attendance(timetable_id=t, user_id=u, occurrence_id=occurrences.get(t), attended=True) for t, u in accepted],
+            batch_size=500,
+            ignore_conflicts=True,
+        )
+        if accepted:
+            refresh_rollups(accepted, timetables)
+    return accepted, rejected
+
+
+class CheckinBuffer:
+    """
+    Coalesces single check-ins into batched inserts.
+
+    Taps are queued in memory and written by ``record_checkins`` once
+    ``size`` are waiting or every ``interval`` seconds, from a background
+    thread. One transaction per batch instead of per tap keeps SQLite's write
+    lock from serialising a full lecture hall. A batch that fails to write
+    goes back to the front of the queue for the next flush, and whatever is
+    queued when the process exits is written then.
+    """
+
+    def __init__(self, size=500, interval=0.5):
+        self.size = size
+        self.interval = interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, timetable_id, user_id):
+        with self.lock:
+            self.pending.append((timetable_id, user_id))
+            full = len(self.pending) >= self.size
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='checkin-buffer', daemon=True)
+                self.thread.start()
+                atexit.register(self._flush_at_exit)
+        if full:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        try:
+            _, rejected = record_checkins(batch)
+        except Exception:
+            with self.lock:
+                self.pending[:0] = batch
+            raise
+        if rejected:
+            logger.warning("Dropped %d buffered check-ins for unknown sessions or users", len(rejected))
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flushing buffered check-ins failed")
+
+    def _flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Flushing buffered check-ins at exit failed; %d lost", len(self.pending))
+
+
+checkin_buffer = CheckinBuffer(
+    size=getattr(settings, 'ATTENDANCE_BUFFER_SIZE', 500),
+    interval=getattr(settings, 'ATTENDANCE_FLUSH_INTERVAL', 0.5),
+)
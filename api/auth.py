@@ -0,0 +1,122 @@
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core import signing
+
+from .models import User
+
+SessionUser = namedtuple('SessionUser', 'id role')
+
+TOKEN_SALT = 'api.auth.token'
+FEED_TOKEN_SALT = 'api.auth.feed'
+
+# user id -> (role, monotonic expiry). Per process, so a role change or a
+# deleted user is seen by other processes within AUTH_USER_CACHE_TTL seconds;
+# this process forgets the entry at once (see signals.py).
+_roles = {}
+
+
+def issue_token(user):
+    """Signed, stateless credential for ``Authorization: Bearer <token>``."""
+    return signing.dumps({'id': user.id, 'role': user.role}, salt=TOKEN_SALT, compress=True)
+
+
+def token_user(request):
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    return load_token(token)
+
+
+def load_token(token):
+    """The ``SessionUser`` a token from ``issue_token`` was issued to, or None."""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT, max_age=settings.AUTH_TOKEN_MAX_AGE)
+    except signing.BadSignature:  # Also raised for expired tokens
+        return None
+    return SessionUser(data['id'], data['role'])
+
+
+def issue_feed_token(user):
+    """
+    Signed credential for ``?token=`` on the iCalendar feed, and nothing
+    else. Calendar URLs end up in logs and shared links, so it grants no API
+    access; it does not expire, so subscriptions keep working.
+    """
+    return signing.dumps({'id': user.id}, salt=FEED_TOKEN_SALT)
+
+
+def load_feed_token(token):
+    """The ``SessionUser`` of a token from ``issue_feed_token``, or None, also once the user is gone."""
+    try:
+        user_id = signing.loads(token, salt=FEED_TOKEN_SALT)['id']
+    except signing.BadSignature:
+        return None
+    role = cached_role(user_id)
+    return SessionUser(user_id, role) if role else None
+
+
+def cached_role(user_id):
+    hit = _roles.get(user_id)
+    if hit is not None and hit[1] > time.monotonic():
+        return hit[0]
+    return _remember(user_id, User.objects.filter(id=user_id).values_list('role', flat=True).first())
+
+
+async def acached_role(user_id):
+    hit = _roles.get(user_id)
+    if hit is not None and hit[1] > time.monotonic():
+        return hit[0]
+    return _remember(user_id, await User.objects.filter(id=user_id).values_list('role', flat=True).afirst())
+
+
+def _remember(user_id, role):
+    ttl = settings.AUTH_USER_CACHE_TTL
+    if role is not None and ttl:
+        _roles[user_id] = (role, time.monotonic() + ttl)
+    return role
+
+
+def forget_user(user_id):
+    _roles.pop(user_id, None)
+
+
+def forget_all():
+    _roles.clear()
+
+
+def session_user(request):
+    """
+    The caller as a ``SessionUser(id, role)``, or None when not logged in.
+
+    A valid bearer token is trusted as is; otherwise the session's user id is
+    looked up through the role cache, so a user deleted since logging in is
+    turned away. The result is kept on the request for later calls.
+    """
+    try:
+        return request._api_user
+    except AttributeError:
+        pass
+    user = token_user(request)
+    if user is None:
+        user_id = request.session.get('user_id')
+        role = cached_role(user_id) if user_id else None
+        user = SessionUser(user_id, role) if role else None
+    request._api_user = user
+    return user
+
+
+async def asession_user(request):
+    """``session_user`` for async views."""
+    try:
+        return request._api_user
+    except AttributeError:
+        pass
+    user = token_user(request)
+    if user is None:
+        user_id = await request.session.aget('user_id')
+        role = await acached_role(user_id) if user_id else None
+        user = SessionUser(user_id, role) if role else None
+    request._api_user = user
+    return user
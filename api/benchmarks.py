@@ -0,0 +1,196 @@
+"""
+Benchmarks of the scheduler and the API's hot paths.
+
+``run_scale`` populates a synthetic university (see ``api.synthetic``) and
+times timetable generation, the timetable endpoint, login and attendance
+ingestion on it, recording query counts and peak Python memory for each.
+``run_benchmarks`` does that for several scales, each on a fresh throwaway
+test database, and ``compare`` lists what got slower between two saved runs.
+"""
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import auth
+from .ai_scheduler import generate_timetable
+from .attendance import record_checkins
+from .hashers import TunablePBKDF2PasswordHasher
+from .models import Attendance, Timetable, User
+from .synthetic import PASSWORD, SCALES, populate
+
+REPEAT = 5
+CHECKINS = 2000  # Check-ins per ingestion batch
+
+# Differences smaller than these are noise, however large the ratio
+MIN_SECONDS = 0.005
+MIN_PEAK_KB = 64
+
+
+def measure(fn, setup=None, repeat=REPEAT):
+    """
+    Run ``fn`` ``repeat`` times, calling ``setup`` before each run; the
+    queries are counted on the first run and the peak memory taken from one
+    more, traced run (tracing slows code down, so it is not timed).
+    """
+    seconds, queries = [], None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            fn()
+            seconds.append(time.perf_counter() - started)
+        if queries is None:
+            queries = len(captured)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'runs': repeat,
+        'median_s': round(statistics.median(seconds), 6),
+        'min_s': round(min(seconds), 6),
+        'max_s': round(max(seconds), 6),
+        'queries': queries,
+        'peak_kb': round(peak / 1024),
+    }
+
+
+def run_scale(rooms, lecturers, courses, students, seed=0, tightness=0.5, repeat=REPEAT, time_limit=None,
+              checkins=CHECKINS):
+    """Populate the (empty) database with a synthetic university and benchmark it."""
+    started = time.perf_counter()
+    counts = populate(rooms, lecturers, courses, students, tightness=tightness, seed=seed)
+    results = {'populate_s': round(time.perf_counter() - started, 3), 'rows': counts, 'benchmarks': {}}
+    benchmarks = results['benchmarks']
+
+    solutions = []
+    benchmarks['generate_timetable'] = measure(
+        lambda: solutions.append(generate_timetable(time_limit=time_limit)),
+        setup=lambda: Timetable.objects.all().delete(), repeat=min(repeat, 3),
+    )
+    solution = solutions[-1]
+    results['placed'] = len(solution.assignment)
+    results['unscheduled'] = len(solution.unscheduled)
+
+    student = User.objects.filter(role='student', enrolments__isnull=False).order_by('id').first()
+    client = Client(HTTP_AUTHORIZATION=f"Bearer {auth.issue_token(student)}")
+
+    def cold():
+        caches['timetable'].clear()
+        auth.forget_all()
+
+    benchmarks['timetable_cold'] = measure(lambda: client.get('/api/timetable/'), setup=cold, repeat=repeat)
+    benchmarks['timetable_warm'] = measure(lambda: client.get('/api/timetable/'), repeat=repeat)
+    benchmarks['login'] = measure(
+        lambda: Client().post('/api/login/', {'reg_no': student.reg_no, 'password': PASSWORD},
+                              content_type='application/json'),
+        repeat=repeat,
+    )
+
+    # Every enrolled student checking in to their course's session, up to `checkins` of them
+    pairs = list(
+        Timetable.objects.filter(course__enrolments__isnull=False).order_by('id', 'course__enrolments__user_id')
+        .values_list('id', 'course__enrolments__user_id')[:checkins]
+    )
+
+    def clear():
+        Attendance.objects.all().delete()
+
+    benchmarks['attendance_batch'] = measure(lambda: record_checkins(pairs), setup=clear, repeat=repeat)
+    benchmarks['attendance_batch']['rows'] = len(pairs)
+    if pairs:
+        timetable_id, user_id = pairs[0]
+        checkin = Client(HTTP_AUTHORIZATION=f"Bearer {auth.issue_token(User.objects.get(id=user_id))}")
+        benchmarks['attendance_checkin'] = measure(
+            lambda: checkin.post(f'/api/attendance/{timetable_id}/'), setup=clear, repeat=repeat,
+        )
+    return results
+
+
+@contextmanager
+def throwaway_database(sqlite_file=None):
+    """
+    Point the default connection at a new test database for the duration;
+    SQLite's is in memory unless ``sqlite_file`` is given.
+    """
+    if sqlite_file is not None:
+        settings.DATABASES['default'].setdefault('TEST', {})['NAME'] = sqlite_file
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': connection.vendor,
+        'password_iterations': TunablePBKDF2PasswordHasher().iterations,
+        'scheduler_backend': getattr(settings, 'SCHEDULER_BACKEND', 'auto'),
+    }
+
+
+def run_benchmarks(scales, seed=0, tightness=0.5, repeat=REPEAT, time_limit=None, sqlite_file=None, log=None):
+    """Benchmark each named scale of ``SCALES`` on a throwaway database; returns the results document."""
+    document = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment(),
+        'settings': {'seed': seed, 'tightness': tightness, 'repeat': repeat, 'time_limit': time_limit},
+        'scales': {},
+    }
+    with throwaway_database(sqlite_file):
+        for name in scales:
+            if log is not None:
+                log(f"Benchmarking {name}: {SCALES[name]}")
+            call_command('flush', interactive=False, verbosity=0)
+            caches['timetable'].clear()
+            auth.forget_all()
+            document['scales'][name] = run_scale(
+                **SCALES[name], seed=seed, tightness=tightness, repeat=repeat, time_limit=time_limit,
+            )
+    return document
+
+
+def compare(baseline, current, tolerance=0.25):
+    """
+    What regressed from ``baseline`` to ``current`` (two results documents):
+    benchmarks whose median time or peak memory grew by more than
+    ``tolerance``, or that make more queries.
+    """
+    regressions = []
+    for scale, results in current['scales'].items():
+        before_results = baseline.get('scales', {}).get(scale, {}).get('benchmarks', {})
+        for name, now in results['benchmarks'].items():
+            before = before_results.get(name)
+            if before is None:
+                continue
+            label = f"{scale}/{name}"
+            if now['median_s'] > before['median_s'] * (1 + tolerance) and now['median_s'] - before['median_s'] > MIN_SECONDS:
+                regressions.append(f"{label}: {before['median_s'] * 1000:.1f}ms -> {now['median_s'] * 1000:.1f}ms")
+            if now['queries'] > before['queries']:
+                regressions.append(f"{label}: {before['queries']} -> {now['queries']} queries")
+            if now['peak_kb'] > before['peak_kb'] * (1 + tolerance) and now['peak_kb'] - before['peak_kb'] > MIN_PEAK_KB:
+                regressions.append(f"{label}: peak {before['peak_kb']}KB -> {now['peak_kb']}KB")
+    return regressions
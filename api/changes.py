@@ -0,0 +1,132 @@
+"""
+The timetable change feed.
+
+Every write to a Timetable row (a cancellation, an admin edit, a published
+generation) appends a ``TimetableChange`` holding the row as
+``/api/timetable/`` shows it. Its ``seq`` orders the log: a client loads
+its timetable once, then asks for the changes after the last seq it saw
+(``changes_since``) or keeps a server-sent event stream open, instead of
+re-fetching the whole timetable.
+
+Changes are appended in the transaction that makes them, after the
+timetable version is bumped: that update locks the version row until
+commit, so changes commit in seq order and a reader never sees a later seq
+before an earlier one.
+
+``broker`` wakes the streams of this process once a change commits; they
+then read the log. The database stays the source of truth, so streams
+served by another process still see every change, at their next heartbeat.
+"""
+import asyncio
+import threading
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Course, Enrolment, Timetable, TimetableChange
+from .timetable_cache import TIMETABLE_FIELDS, timetable_row
+
+PAGE_SIZE = 1000  # Most changes returned at once
+
+CHANGE_FIELDS = ('seq', 'timetable_id', 'action', 'session')
+
+
+class Broker:
+    """In-process fan-out: event loops waiting for the change log to grow."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = set()  # (loop, asyncio.Event) of each open stream
+
+    def subscribe(self):
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self.lock:
+            self.waiters.add(waiter)
+        return waiter
+
+    def unsubscribe(self, waiter):
+        with self.lock:
+            self.waiters.discard(waiter)
+
+    def notify(self):
+        # Called from any thread; each loop sets its own event
+        with self.lock:
+            waiters = list(self.waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # The loop closed under a stream that never unsubscribed
+                self.unsubscribe((loop, event))
+
+    async def wait(self, waiter, timeout):
+        """Until ``notify`` or ``timeout`` seconds; True if notified."""
+        event = waiter[1]
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+
+broker = Broker()
+
+
+def record_changes(saved=None, deleted=None, occurrences=None):
+    """
+    Append changes to the log: ``saved`` maps the ids of written rows to
+    their action, ``deleted`` the ids of deleted rows to their course id.
+    ``occurrences`` maps ids in ``saved`` whose change is to a single week
+    to that occurrence, added to the session as ``occurrence``.
+    Call it inside the writing transaction, after ``invalidate_timetable``.
+    """
+    entries = []
+    occurrences = occurrences or {}
+    if saved:
+        rows = Timetable.objects.filter(id__in=list(saved)).order_by('id').values_list('course_id', *TIMETABLE_FIELDS)
+        for course_id, *row in rows.iterator(chunk_size=2000):
+            session = timetable_row(*row)
+            if row[0] in occurrences:
+                session['occurrence'] = occurrences[row[0]]
+            entries.append(TimetableChange(
+                timetable_id=row[0], course_id=course_id, action=saved[row[0]], session=session,
+            ))
+    for timetable_id, course_id in sorted((deleted or {}).items()):
+        entries.append(TimetableChange(timetable_id=timetable_id, course_id=course_id, action='deleted'))
+    if entries:
+        TimetableChange.objects.bulk_create(entries, batch_size=1000)
+        transaction.on_commit(broker.notify)
+
+
+def user_changes(role, user_id):
+    # The log entries of a lecturer's taught courses, or of a student's
+    # enrolled ones. Deletions go to everyone: they carry nothing but the id,
+    # and the course (and with it the enrolments) may be what was deleted
+    if role == 'lecturer':
+        courses = Course.objects.filter(lecturer_id=user_id).values('id')
+    else:
+        courses = Enrolment.objects.filter(user_id=user_id).values('course_id')
+    return TimetableChange.objects.filter(Q(course_id__in=courses) | Q(action='deleted'))
+
+
+def change_entry(seq, timetable_id, action, session):
+    return {'seq': seq, 'timetable_id': timetable_id, 'action': action, 'session': session}
+
+
+def latest_seq():
+    return TimetableChange.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+
+async def alatest_seq():
+    return await TimetableChange.objects.order_by('-seq').values_list('seq', flat=True).afirst() or 0
+
+
+def changes_since(role, user_id, since, limit=PAGE_SIZE):
+    """A user's changes after seq ``since``, oldest first, at most ``limit``."""
+    rows = user_changes(role, user_id).filter(seq__gt=since).order_by('seq').values_list(*CHANGE_FIELDS)[:limit]
+    return [change_entry(*row) for row in rows]
+
+
+async def achanges_since(role, user_id, since, limit=PAGE_SIZE):
+    rows = user_changes(role, user_id).filter(seq__gt=since).order_by('seq').values_list(*CHANGE_FIELDS)[:limit]
+    return [change_entry(*row) async for row in rows]
@@ -0,0 +1,134 @@
+"""
+Streaming exports of the timetable and attendance for downstream systems.
+
+Every export is a generator: rows are read with ``.iterator()`` (a
+server-side cursor where the database has one) and written out a batch of
+lines at a time through ``StreamingHttpResponse``, so memory stays flat
+however many rows there are.
+"""
+import csv
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.utils import timezone
+
+from .models import Attendance
+from .slots import WEEK
+from .timetable_cache import TIMETABLE_FIELDS, timetable_row
+
+CHUNK_SIZE = 2000  # Rows per database fetch
+LINES_PER_WRITE = 500  # Lines joined into each chunk of the response
+
+FORMATS = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv; charset=utf-8'}
+ICAL_TYPE = 'text/calendar; charset=utf-8'
+
+ATTENDANCE_FIELDS = (
+    'id', 'timetable_id', 'timetable__course__code', 'user_id', 'user__reg_no', 'occurrence__date', 'attended', 'timestamp',
+)
+
+
+def _batched(lines):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= LINES_PER_WRITE:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+class _Line:
+    # csv.writer target that hands back the formatted line instead of storing it
+    def write(self, value):
+        return value
+
+
+def _jsonl(rows):
+    return _batched(json.dumps(row, separators=(',', ':')) + '\n' for row in rows)
+
+
+def _csv(header, rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(header)
+    yield from _batched(writer.writerow(row) for row in rows)
+
+
+def timetable_export(queryset, fmt):
+    """The sessions of ``queryset`` as chunks of JSON Lines or CSV, in id order."""
+    rows = (
+        timetable_row(*row)
+        for row in queryset.order_by('id').values_list(*TIMETABLE_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    )
+    if fmt == 'jsonl':
+        return _jsonl(rows)
+    header = ['id', 'course', 'day', 'start_time', 'end_time', 'week_start', 'week_end', 'room', 'is_canceled']
+    return _csv(header, ([row[name] for name in header] for row in rows))
+
+
+def attendance_export(fmt, queryset=None):
+    """Attendance records as chunks of JSON Lines or CSV, in id order."""
+    queryset = Attendance.objects.all() if queryset is None else queryset
+    rows = queryset.order_by('id').values_list(*ATTENDANCE_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    header = ['id', 'timetable_id', 'course', 'user_id', 'reg_no', 'date', 'attended', 'timestamp']
+    # The date of the occurrence attended, empty for check-ins outside any term
+    rows = ((*row[:5], row[5] and row[5].isoformat(), row[6], row[7].isoformat()) for row in rows)
+    if fmt == 'jsonl':
+        return _jsonl(dict(zip(header, row)) for row in rows)
+    return _csv(header, rows)
+
+
+def _ical_text(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ical_line(line):
+    # Lines longer than 75 octets are folded onto continuation lines starting with a space
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts, start = [], 0
+    while start < len(data):
+        end = min(start + (75 if not parts else 74), len(data))
+        while end < len(data) and data[end] & 0xC0 == 0x80:  # Do not split a UTF-8 sequence
+            end -= 1
+        parts.append(data[start:end].decode())
+        start = end
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def ical_feed(queryset, host, today=None):
+    """
+    The sessions of ``queryset`` as an iCalendar feed, one weekly recurring
+    event per session, starting from the week of ``today``. Times are
+    floating, i.e. in the campus's local time; canceled sessions are kept
+    with STATUS:CANCELLED so subscribed calendars drop them.
+    """
+    today = today or timezone.localdate()
+    monday = today - timedelta(days=today.weekday())
+    stamp = datetime.now(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+    def events():
+        rows = queryset.order_by('id').values_list(*TIMETABLE_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+        for row in rows:
+            row = timetable_row(*row)
+            day = monday + timedelta(days=WEEK.index(row['day']))
+            lines = [
+                'BEGIN:VEVENT',
+                f"UID:timetable-{row['id']}@{host}",
+                f'DTSTAMP:{stamp}',
+                f"DTSTART:{day:%Y%m%d}T{row['start_time'].replace(':', '')[:6]}",
+                f"DTEND:{day:%Y%m%d}T{row['end_time'].replace(':', '')[:6]}",
+                'RRULE:FREQ=WEEKLY',
+                f"SUMMARY:{_ical_text(row['course'])}",
+            ]
+            if row['room']:
+                lines.append(f"LOCATION:{_ical_text(row['room'])}")
+            if row['is_canceled']:
+                lines.append('STATUS:CANCELLED')
+            lines.append('END:VEVENT')
+            yield ''.join(_ical_line(line) for line in lines)
+
+    yield ''.join(_ical_line(line) for line in ('BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//smartdaro//timetable//EN'))
+    yield from _batched(events())
+    yield _ical_line('END:VCALENDAR')
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2-SHA256 with its work factor taken from
+    ``settings.PASSWORD_HASH_ITERATIONS`` (Django's default when unset).
+
+    It keeps the ``pbkdf2_sha256`` algorithm name, so existing hashes still
+    verify. A hash made with a different iteration count reports
+    ``must_update()``, and the login view's ``check_password`` setter
+    rewrites it with the configured count on the user's next login.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
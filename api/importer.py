@@ -0,0 +1,411 @@
+"""
+Bulk import of rooms, lecturers, courses, students and enrolments.
+
+Records stream in from CSV (one kind per file), JSON Lines (a ``kind`` field
+per record, or one kind per file) or the JSON document the scheduler data is
+kept in: ``{"rooms": [...], "lecturers": [...], "courses": [...],
+"students": [...]}``, with either this project's field names or the
+document's (``room_name``, ``course_code``, ``duration`` in hours, ...).
+
+Records are validated and written in chunks, so memory stays flat however
+long the file is. References to rooms, lecturers and courses are resolved
+through in-memory maps, which grow with the catalogue, not with the number of
+students. Existing rows, matched on room name, course code or reg_no, are
+updated rather than duplicated.
+"""
+import csv
+import json
+import os
+import secrets
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.db import transaction
+
+from .auth import forget_user
+from .hashers import TunablePBKDF2PasswordHasher
+from .models import Course, Enrolment, Room, StudentAttendanceStats, User
+from .slots import MAX_SESSION_MINUTES, SESSION_MINUTES, WEEK
+from .timetable_cache import invalidate_timetable
+
+# In dependency order: a chunk is only written after every earlier kind's
+# pending records, so a course can name a lecturer from further up the file.
+KINDS = ('rooms', 'lecturers', 'courses', 'students', 'enrolments')
+FORMATS = ('csv', 'jsonl', 'json')
+
+# Fields that may hold a list; every other field takes a single value
+LIST_FIELDS = ('courses', 'available_days', 'preferred_days')
+
+CHUNK_SIZE = 2000
+MAX_ERRORS = 1000  # Errors kept in the report; the rest are only counted
+POOL_THRESHOLD = 64  # Fewer passwords than this are hashed in-process
+
+
+class ImportReport:
+    def __init__(self):
+        self.created = Counter()
+        self.updated = Counter()
+        self.skipped = Counter()
+        self.errors = []  # (kind, line, message)
+
+    def error(self, kind, line, message):
+        self.skipped[kind] += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((kind, line, message))
+
+    def as_dict(self):
+        return {
+            'created': dict(self.created),
+            'updated': dict(self.updated),
+            'skipped': dict(self.skipped),
+            'errors': [{'kind': kind, 'line': line, 'error': message} for kind, line, message in self.errors],
+        }
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.json': 'json'}.get(extension)
+
+
+def read_records(stream, fmt, kind=None):
+    """Yield ``(kind, line, record)`` from a text stream; unreadable lines come back as a ``str`` record."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        try:
+            for record in reader:
+                if None in record:  # Cells past the header
+                    yield kind, reader.line_num, "More fields than the header"
+                    continue
+                yield kind, reader.line_num, record
+        except csv.Error as exc:
+            # The reader cannot go on past a malformed line; what came before is kept
+            yield kind, reader.line_num, f"Malformed CSV: {exc}"
+
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, 1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as exc:
+                yield kind, line, f"Invalid JSON: {exc}"
+                continue
+            if not isinstance(record, dict):
+                yield kind, line, "Expected a JSON object"
+                continue
+            yield record.pop('kind', kind), line, record
+    elif fmt == 'json':
+        # A whole document is parsed at once; use JSON Lines or CSV for big files
+        document = json.load(stream)
+        if not isinstance(document, dict):
+            raise ValueError(f"Expected a JSON object with a list of records per kind ({', '.join(KINDS)})")
+        for section in KINDS:
+            records = document.get(section) or []
+            if not isinstance(records, list):
+                yield section, 1, f"{section} must be a list of records"
+                continue
+            for index, record in enumerate(records, 1):
+                yield section, index, record
+    else:
+        raise ValueError(f"Unknown format {fmt!r}; expected one of {', '.join(FORMATS)}")
+
+
+def import_stream(stream, fmt, kind=None, chunk_size=CHUNK_SIZE, workers=1):
+    """
+    Import every record of ``stream``; returns an ``ImportReport``. Passwords
+    are hashed in this process unless ``workers`` asks for a process pool,
+    which only tools outside the web process should.
+    """
+    importer = Importer(chunk_size=chunk_size, workers=workers)
+    try:
+        for record_kind, line, record in read_records(stream, fmt, kind):
+            importer.feed(record_kind, line, record)
+        importer.finish()
+    finally:
+        importer.close()
+    return importer.report
+
+
+def _hash_password(password, iterations):
+    # Runs in pool workers: pure hashing, no settings or database access
+    hasher = TunablePBKDF2PasswordHasher()
+    return hasher.encode(password, hasher.salt(), iterations)
+
+
+def _first(record, *names, default=None):
+    for name in names:
+        value = record.get(name)
+        if value not in (None, ''):
+            return value
+    return default
+
+
+def _days(value):
+    # ["Monday", "Friday"] or "Monday,Friday" -> "Monday,Friday"
+    days = value if isinstance(value, (list, tuple)) else str(value or '').split(',')
+    days = [str(day).strip() for day in days if str(day).strip()]
+    unknown = [day for day in days if day not in WEEK]
+    if unknown:
+        raise ValueError(f"Unknown day(s): {', '.join(unknown)}")
+    return ','.join(days)
+
+
+def _hours(value):
+    if value in (None, ''):
+        return None
+    hours = int(value)
+    if not 0 < hours < 168:
+        raise ValueError(f"max_hours_per_week must be between 1 and 167, not {hours}")
+    return hours
+
+
+def _codes(value):
+    # Course codes as a list or "CSC 101;AI 201"
+    codes = value if isinstance(value, (list, tuple)) else str(value or '').split(';')
+    return [str(code).strip() for code in codes if str(code).strip()]
+
+
+class Importer:
+    def __init__(self, chunk_size=CHUNK_SIZE, workers=1):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.iterations = (
+            getattr(settings, 'IMPORT_PASSWORD_ITERATIONS', None) or TunablePBKDF2PasswordHasher().iterations
+        )
+        self.report = ImportReport()
+        self.pending = {kind: [] for kind in KINDS}
+        self.pool = None
+        self.changed_users = []
+        self.rooms = dict(Room.objects.values_list('name', 'id'))
+        self.courses = dict(Course.objects.values_list('code', 'id'))
+        self.lecturers = {}  # reg_no and name -> id; a name shared by two lecturers maps to None
+        for reg_no, name, lecturer_id in User.objects.filter(role='lecturer').values_list('reg_no', 'name', 'id'):
+            self._remember_lecturer(reg_no, name, lecturer_id)
+
+    def feed(self, kind, line, record):
+        if kind not in KINDS:
+            self.report.error(kind or 'unknown', line, f"Unknown kind {kind!r}")
+            return
+        if not isinstance(record, dict):
+            self.report.error(kind, line, record if isinstance(record, str) else "Expected an object")
+            return
+        nested = sorted(name for name, value in record.items() if isinstance(value, (dict, list)) and name not in LIST_FIELDS)
+        if nested:
+            self.report.error(kind, line, f"{', '.join(nested)} must be a single value, not a list or object")
+            return
+        self.pending[kind].append((line, record))
+        if len(self.pending[kind]) >= self.chunk_size:
+            self._flush_through(kind)
+
+    def finish(self):
+        self._flush_through(KINDS[-1])
+        # Bulk writes send no signals: expire cached timetables and roles here
+        if any(self.report.created[kind] or self.report.updated[kind] for kind in KINDS):
+            invalidate_timetable()
+        for user_id in self.changed_users:
+            forget_user(user_id)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def _flush_through(self, kind):
+        for earlier in KINDS[:KINDS.index(kind) + 1]:
+            chunk, self.pending[earlier] = self.pending[earlier], []
+            if chunk:
+                with transaction.atomic():
+                    getattr(self, f'_write_{earlier}')(chunk)
+
+    def _remember_lecturer(self, reg_no, name, lecturer_id):
+        self.lecturers[reg_no] = lecturer_id
+        if name != reg_no:
+            self.lecturers[name] = None if self.lecturers.get(name, lecturer_id) != lecturer_id else lecturer_id
+
+    def _hash(self, passwords):
+        if self.workers > 1 and len(passwords) >= POOL_THRESHOLD:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            return list(self.pool.map(_hash_password, passwords, [self.iterations] * len(passwords), chunksize=32))
+        return [_hash_password(password, self.iterations) for password in passwords]
+
+    def _write_rooms(self, chunk):
+        rows = {}
+        for line, record in chunk:
+            name = _first(record, 'name', 'room_name')
+            try:
+                capacity = int(_first(record, 'capacity'))
+            except (TypeError, ValueError):
+                self.report.error('rooms', line, "capacity must be a whole number")
+                continue
+            if not name:
+                self.report.error('rooms', line, "name is required")
+                continue
+            rows[str(name).strip()] = capacity
+
+        created = [Room(name=name, capacity=capacity) for name, capacity in rows.items() if name not in self.rooms]
+        updated = [Room(id=self.rooms[name], capacity=capacity) for name, capacity in rows.items() if name in self.rooms]
+        Room.objects.bulk_create(created, batch_size=500)
+        Room.objects.bulk_update(updated, ['capacity'], batch_size=500)
+        self.rooms.update(Room.objects.filter(name__in=[room.name for room in created]).values_list('name', 'id'))
+        self.report.created['rooms'] += len(created)
+        self.report.updated['rooms'] += len(updated)
+
+    def _write_lecturers(self, chunk):
+        rows = {}
+        for line, record in chunk:
+            name = _first(record, 'name')
+            reg_no = str(_first(record, 'reg_no', 'staff_id', default=name or '')).strip()
+            if not reg_no or not name:
+                self.report.error('lecturers', line, "name is required")
+                continue
+            try:
+                values = {
+                    'name': name,
+                    'available_days': _days(_first(record, 'available_days', default='')),
+                    'preferred_days': _days(_first(record, 'preferred_days', default='')),
+                    'max_hours_per_week': _hours(_first(record, 'max_hours_per_week', 'max_hours')),
+                }
+            except ValueError as exc:
+                self.report.error('lecturers', line, str(exc))
+                continue
+            rows[reg_no] = (line, values, _first(record, 'password'))
+        fields = ['name', 'available_days', 'preferred_days', 'max_hours_per_week']
+        for reg_no, lecturer_id in self._write_users('lecturers', 'lecturer', rows, fields).items():
+            self._remember_lecturer(reg_no, rows[reg_no][1]['name'], lecturer_id)
+
+    def _write_students(self, chunk):
+        rows, taking = {}, {}
+        for line, record in chunk:
+            reg_no = str(_first(record, 'reg_no', default='')).strip()
+            name = _first(record, 'name')
+            if not reg_no or not name:
+                self.report.error('students', line, "reg_no and name are required")
+                continue
+            codes = _codes(_first(record, 'courses', default=()))
+            missing = [code for code in codes if code not in self.courses]
+            if missing:
+                self.report.error('students', line, f"Unknown course(s): {', '.join(missing)}")
+                continue
+            rows[reg_no] = (line, {'name': name}, _first(record, 'password'))
+            taking[reg_no] = codes
+        ids = self._write_users('students', 'student', rows, ['name'])
+        self._enrol((ids[reg_no], self.courses[code]) for reg_no, codes in taking.items() if reg_no in ids for code in codes)
+
+    def _write_users(self, kind, role, rows, fields):
+        # Create or update users keyed by reg_no; returns {reg_no: id} of those written
+        existing = {
+            reg_no: (user_id, user_role)
+            for reg_no, user_id, user_role in User.objects.filter(reg_no__in=rows).values_list('reg_no', 'id', 'role')
+        }
+        for reg_no, (user_id, user_role) in list(existing.items()):
+            if user_role != role:
+                self.report.error(kind, rows.pop(reg_no)[0], f"{reg_no} is already a {user_role}")
+                del existing[reg_no]
+
+        with_password = [reg_no for reg_no, (_, _, password) in rows.items() if password]
+        hashed = dict(zip(with_password, self._hash([str(rows[reg_no][2]) for reg_no in with_password])))
+
+        created, updated, updated_password = [], [], []
+        for reg_no, (_, values, _) in rows.items():
+            if reg_no in existing:
+                user = User(id=existing[reg_no][0], reg_no=reg_no, role=role, password=hashed.get(reg_no, ''), **values)
+                (updated_password if reg_no in hashed else updated).append(user)
+            else:
+                # No password: cannot log in until one is set (as make_password(None), minus its slow RNG)
+                password = hashed.get(reg_no) or UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20)
+                created.append(User(reg_no=reg_no, role=role, password=password, **values))
+        User.objects.bulk_create(created, batch_size=500)
+        User.objects.bulk_update(updated, fields, batch_size=500)
+        User.objects.bulk_update(updated_password, fields + ['password'], batch_size=500)
+
+        self.report.created[kind] += len(created)
+        self.report.updated[kind] += len(updated) + len(updated_password)
+        self.changed_users += [user.id for user in updated + updated_password]
+        ids = {reg_no: user_id for reg_no, (user_id, _) in existing.items()}
+        ids.update(User.objects.filter(reg_no__in=[user.reg_no for user in created]).values_list('reg_no', 'id'))
+        return ids
+
+    def _write_courses(self, chunk):
+        rows = {}
+        for line, record in chunk:
+            code = _first(record, 'code', 'course_code')
+            name = _first(record, 'name', 'course_name')
+            lecturer = _first(record, 'lecturer', 'lecturer_reg_no')
+            if not code or not name or not lecturer:
+                self.report.error('courses', line, "code, name and lecturer are required")
+                continue
+            lecturer_id = self.lecturers.get(str(lecturer).strip())
+            if lecturer_id is None:
+                problem = "is ambiguous" if str(lecturer).strip() in self.lecturers else "not found"
+                self.report.error('courses', line, f"Lecturer {lecturer!r} {problem}")
+                continue
+            room = _first(record, 'room')
+            if room and room not in self.rooms:
+                self.report.error('courses', line, f"Room {room!r} not found")
+                continue
+            try:
+                students = int(_first(record, 'students', default=0))
+                hours = _first(record, 'duration')
+                minutes = int(_first(record, 'session_minutes', default=float(hours) * 60 if hours else SESSION_MINUTES))
+            except (TypeError, ValueError):
+                self.report.error('courses', line, "students, session_minutes and duration must be numbers")
+                continue
+            if students < 0:
+                self.report.error('courses', line, f"students must not be negative, not {students}")
+                continue
+            if not 0 < minutes <= MAX_SESSION_MINUTES:
+                # Shorter never clashes, longer fits no slot
+                self.report.error('courses', line, f"A session must last 1 to {MAX_SESSION_MINUTES} minutes, not {minutes}")
+                continue
+            rows[str(code).strip()] = dict(
+                name=name, lecturer_id=lecturer_id, students=students, session_minutes=minutes,
+                room_id=self.rooms.get(room),
+            )
+
+        created = [Course(code=code, **values) for code, values in rows.items() if code not in self.courses]
+        updated = [Course(id=self.courses[code], code=code, **values) for code, values in rows.items() if code in self.courses]
+        Course.objects.bulk_create(created, batch_size=500)
+        Course.objects.bulk_update(updated, ['name', 'lecturer', 'students', 'session_minutes', 'room'], batch_size=500)
+        self.courses.update(Course.objects.filter(code__in=[course.code for course in created]).values_list('code', 'id'))
+        self.report.created['courses'] += len(created)
+        self.report.updated['courses'] += len(updated)
+
+    def _write_enrolments(self, chunk):
+        records = []
+        for line, record in chunk:
+            reg_no = str(_first(record, 'reg_no', 'student', default='')).strip()
+            code = str(_first(record, 'course', 'course_code', default='')).strip()
+            if code not in self.courses:
+                self.report.error('enrolments', line, f"Course {code!r} not found")
+                continue
+            records.append((line, reg_no, code))
+        students = dict(
+            User.objects.filter(role='student', reg_no__in={reg_no for _, reg_no, _ in records}).values_list('reg_no', 'id')
+        )
+        pairs = []
+        for line, reg_no, code in records:
+            if reg_no not in students:
+                self.report.error('enrolments', line, f"Student {reg_no!r} not found")
+                continue
+            pairs.append((students[reg_no], self.courses[code]))
+        self._enrol(pairs)
+
+    def _enrol(self, pairs):
+        # Already-enrolled pairs are skipped; every enrolment also gets its
+        # (empty) attendance rollup, as the post_save signal would have made
+        pairs = set(pairs)
+        if not pairs:
+            return
+        pairs -= set(Enrolment.objects.filter(user_id__in={user_id for user_id, _ in pairs}).values_list('user_id', 'course_id'))
+        Enrolment.objects.bulk_create(
+            [Enrolment(user_id=user_id, course_id=course_id) for user_id, course_id in pairs],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        StudentAttendanceStats.objects.bulk_create(
+            [StudentAttendanceStats(user_id=user_id, course_id=course_id) for user_id, course_id in pairs],
+            batch_size=1000, ignore_conflicts=True,
+        )
+        self.report.created['enrolments'] += len(pairs)
@@ -0,0 +1,140 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .ai_scheduler import generate_timetable, reschedule_affected
+from .models import Course, ScheduleJob
+
+logger = logging.getLogger(__name__)
+
+# Value of ScheduleJob.active_lock while a job is queued or running
+LOCK = 'timetable'
+
+# Minimum seconds between two progress writes of a running job
+PROGRESS_INTERVAL = 0.5
+
+_executor = None
+
+
+def submit_generation(incremental=False, affected=None):
+    """
+    Queue a timetable generation job and return ``(job, created)``. With
+    ``affected``, keyword arguments of ``reschedule_affected``, the job only
+    re-places the sessions an edit touched.
+
+    Only one job can be queued or running at a time: while one is, that job is
+    returned with ``created=False`` instead of starting a second solver. How
+    the job runs depends on ``settings.SCHEDULER_JOB_RUNNER``: ``"thread"``
+    runs it on a background thread of this process, ``"worker"`` leaves it for
+    ``manage.py run_schedule_worker`` and ``"inline"`` runs it before
+    returning.
+    """
+    release_stale_jobs()
+    for _ in range(3):
+        try:
+            with transaction.atomic():
+                job = ScheduleJob.objects.create(active_lock=LOCK, incremental=incremental, affected=affected)
+            break
+        except IntegrityError:
+            existing = ScheduleJob.objects.filter(active_lock=LOCK).first()
+            if existing is not None:
+                return existing, False
+            # The active job finished between our insert and our lookup; retry
+    else:
+        raise RuntimeError("Could not queue the timetable job")
+
+    runner = getattr(settings, 'SCHEDULER_JOB_RUNNER', 'thread')
+    if runner == 'inline':
+        run_job(job.id)
+        job.refresh_from_db()
+    elif runner == 'thread':
+        transaction.on_commit(lambda: _thread_executor().submit(_run_in_thread, job.id))
+    return job, True
+
+
+def release_stale_jobs():
+    # A job whose heartbeat stopped (its process died) must not hold the lock forever
+    timeout = getattr(settings, 'SCHEDULER_JOB_TIMEOUT', 3600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return ScheduleJob.objects.filter(active_lock=LOCK, updated_at__lt=cutoff).update(
+        status='failed', error="Job stopped reporting progress", active_lock=None, finished_at=timezone.now()
+    )
+
+
+def run_job(job_id):
+    # Claim the job; another worker may have taken it already
+    now = timezone.now()
+    claimed = ScheduleJob.objects.filter(id=job_id, status='queued').update(
+        status='running', started_at=now, updated_at=now, total=Course.objects.count()
+    )
+    if not claimed:
+        return
+    job = ScheduleJob.objects.get(id=job_id)
+
+    try:
+        if job.affected is not None:
+            solution = reschedule_affected(**job.affected)
+        else:
+            solution = generate_timetable(incremental=job.incremental, progress=_ProgressReporter(job_id))
+    except Exception as exc:
+        logger.exception("Timetable job %s failed", job_id)
+        ScheduleJob.objects.filter(id=job_id).update(
+            status='failed', error=str(exc), active_lock=None,
+            finished_at=timezone.now(), updated_at=timezone.now(),
+        )
+        return
+
+    ScheduleJob.objects.filter(id=job_id).update(
+        status='done', progress=1.0, placed=len(solution.assignment), total=len(solution.problem.courses),
+        backend=solution.backend, unscheduled=solution.unscheduled, active_lock=None,
+        finished_at=timezone.now(), updated_at=timezone.now(),
+    )
+
+
+def run_worker(interval=2.0, once=False):
+    # Database-backed queue: run queued jobs oldest first
+    while True:
+        job_id = ScheduleJob.objects.filter(status='queued').order_by('id').values_list('id', flat=True).first()
+        if job_id is not None:
+            run_job(job_id)
+        if once:
+            return
+        if job_id is None:
+            time.sleep(interval)
+
+
+class _ProgressReporter:
+    # Solver progress callback that records the best solution so far on the job,
+    # throttled so a fast search does not turn into a stream of UPDATEs.
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_write = 0.0
+
+    def __call__(self, placed, fraction):
+        now = time.monotonic()
+        if fraction != 1.0 and now - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.last_write = now
+        fields = {'placed': placed, 'updated_at': timezone.now()}
+        if fraction is not None:
+            fields['progress'] = fraction
+        ScheduleJob.objects.filter(id=self.job_id).update(**fields)
+
+
+def _thread_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='timetable-job')
+    return _executor
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        connections.close_all()
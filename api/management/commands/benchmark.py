@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import REPEAT, compare, run_benchmarks
+from api.synthetic import SCALES
+
+
+class Command(BaseCommand):
+    help = (
+        "Time timetable generation, the timetable endpoint, login and attendance ingestion on synthetic "
+        "universities, each in a throwaway test database, and save the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', choices=SCALES, default=['small'])
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--tightness', type=float, default=0.5, help="0 (easy) to 1 (tight) scheduling constraints")
+        parser.add_argument('--repeat', type=int, default=REPEAT, help="Timed runs per benchmark")
+        parser.add_argument('--time-limit', type=float, default=None, help="Solver time limit in seconds")
+        parser.add_argument('--sqlite-file', help="Run on this SQLite file instead of in memory")
+        parser.add_argument('--output', help="Write the results here")
+        parser.add_argument('--compare', metavar='BASELINE', help="Results of an earlier run to check for regressions")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Slowdown allowed before it counts as a regression")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['tightness'] <= 1:
+            raise CommandError("--tightness must be between 0 and 1")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as stream:
+                baseline = json.load(stream)
+
+        document = run_benchmarks(
+            options['scales'], seed=options['seed'], tightness=options['tightness'], repeat=options['repeat'],
+            time_limit=options['time_limit'], sqlite_file=options['sqlite_file'], log=self.stderr.write,
+        )
+        for scale, results in document['scales'].items():
+            self.stdout.write(f"{scale}: {results['rows']}, populated in {results['populate_s']:.1f}s, "
+                              f"{results['placed']} placed, {results['unscheduled']} unscheduled")
+            for name, result in results['benchmarks'].items():
+                self.stdout.write(f"  {name:<20} {result['median_s'] * 1000:10.1f}ms {result['queries']:6} queries "
+                                  f"{result['peak_kb']:8}KB peak")
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(document, stream, indent=2)
+            self.stdout.write(f"Saved to {options['output']}")
+
+        if baseline is not None:
+            regressions = compare(baseline, document, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(regression)
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
+            self.stdout.write(f"No regressions against {options['compare']}")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.hashers import TunablePBKDF2PasswordHasher
+
+
+class Command(BaseCommand):
+    help = "Measure password checks per second on one core, at the configured or the given PBKDF2 iterations."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, nargs='*', help="Work factors to compare (default: the configured one)")
+        parser.add_argument('--seconds', type=float, default=2.0, help="How long to measure each work factor")
+
+    def handle(self, *args, **options):
+        hasher = TunablePBKDF2PasswordHasher()
+        for iterations in options['iterations'] or [hasher.iterations]:
+            encoded = hasher.encode('benchmark-password', hasher.salt(), iterations)
+            checks = 0
+            started = time.perf_counter()
+            while time.perf_counter() - started < options['seconds']:
+                hasher.verify('benchmark-password', encoded)
+                checks += 1
+            rate = checks / (time.perf_counter() - started)
+            self.stdout.write(f"{iterations:>9} iterations: {rate:8.1f} logins/s per core")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Course
+from api.synthetic import SCALES, populate
+
+
+class Command(BaseCommand):
+    help = "Fill the database with a seeded synthetic university: rooms, lecturers, courses, students and enrolments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small', help="Preset sizes; the options below override them")
+        for name in ('rooms', 'lecturers', 'courses', 'students'):
+            parser.add_argument(f'--{name}', type=int)
+        parser.add_argument('--courses-per-student', type=int, default=4)
+        parser.add_argument('--tightness', type=float, default=0.5, help="0 (easy) to 1 (tight) scheduling constraints")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not 0 <= options['tightness'] <= 1:
+            raise CommandError("--tightness must be between 0 and 1")
+        if Course.objects.filter(code__startswith='SYN').exists():
+            raise CommandError("This database already holds a synthetic university")
+        sizes = {name: options[name] if options[name] is not None else default for name, default in SCALES[options['scale']].items()}
+        counts = populate(**sizes, courses_per_student=options['courses_per_student'],
+                          tightness=options['tightness'], seed=options['seed'])
+        self.stdout.write(", ".join(f"{count} {name}" for name, count in counts.items()))
@@ -0,0 +1,38 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import CHUNK_SIZE, FORMATS, KINDS, detect_format, import_stream
+
+
+class Command(BaseCommand):
+    help = "Import rooms, lecturers, courses, students or enrolments from a CSV, JSON Lines or JSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--kind', choices=KINDS, help="What the records are (CSV files, JSON Lines without a kind field)")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--workers', type=int, default=None, help="Password hashing processes (default: CPU count)")
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        if fmt is None:
+            raise CommandError("Cannot tell the format from the file name; pass --format")
+        if fmt == 'csv' and not options['kind']:
+            raise CommandError("CSV files need --kind")
+
+        started = time.monotonic()
+        with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+            report = import_stream(stream, fmt, options['kind'], options['chunk_size'], options['workers'] or os.cpu_count())
+        elapsed = time.monotonic() - started
+
+        for kind in KINDS:
+            if report.created[kind] or report.updated[kind] or report.skipped[kind]:
+                self.stdout.write(
+                    f"{kind}: {report.created[kind]} created, {report.updated[kind]} updated, {report.skipped[kind]} skipped"
+                )
+        for kind, line, message in report.errors:
+            self.stderr.write(f"{kind} line {line}: {message}")
+        self.stdout.write(f"Done in {elapsed:.1f}s")
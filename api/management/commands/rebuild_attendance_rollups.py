@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the attendance rollup tables from the Attendance table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows written per INSERT")
+
+    def handle(self, *args, **options):
+        sessions, students = rebuild_rollups(batch_size=options['batch_size'])
+        self.stdout.write(f"Rebuilt {sessions} session and {students} student rollups")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Run queued timetable generation jobs (use with SCHEDULER_JOB_RUNNER = 'worker')."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Run at most one job, then exit")
+
+    def handle(self, *args, **options):
+        run_worker(interval=options['interval'], once=options['once'])
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.routing import sync_replica
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database onto every read replica (DATABASE_REPLICAS), for trying replicas locally."
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_READ_REPLICAS:
+            raise CommandError("No read replicas: set DATABASE_REPLICAS to their files, comma-separated")
+        for alias in settings.DATABASE_READ_REPLICAS:
+            try:
+                sync_replica(alias)
+            except ValueError as exc:
+                raise CommandError(f"{alias}: {exc}")
+            self.stdout.write(f"Copied the primary to {alias}")
@@ -0,0 +1,253 @@
+"""
+Request and scheduler metrics, kept in memory and served in the Prometheus
+text format.
+
+``MetricsMiddleware`` times every request and, through a database execute
+wrapper, counts its queries and their time; queries slower than
+``METRICS_SLOW_QUERY_MS`` are kept as samples. ``observe_solution`` records
+each scheduler run from the solver's ``Solution.stats``. With
+``METRICS_LOG_REQUESTS`` every request is also logged as one JSON line on
+the ``api.metrics`` logger.
+
+When ``METRICS_ENABLED`` is off the middleware removes itself at startup
+(``MiddlewareNotUsed``) and no wrapper is installed, so requests pay nothing.
+Metrics are per process: behind several workers, each scrape sees the worker
+that answered it.
+"""
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger('api.metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SOLVER_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Clients choose the method, so anything else is labelled "other" rather
+# than starting a series of its own
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'CONNECT', 'TRACE'))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels({**labels, "le": bound})} {cumulative}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Every metric of this process; all access holds ``lock``."""
+
+    def __init__(self, slow_samples=50):
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)  # (endpoint, method, status) -> count
+        self.latency = {}  # (endpoint, method) -> Histogram of seconds
+        self.queries = {}  # (endpoint, method) -> Histogram of query counts
+        self.db_seconds = defaultdict(float)  # (endpoint, method) -> total
+        self.slow_queries = defaultdict(int)  # endpoint -> count
+        self.slow_samples = deque(maxlen=slow_samples)
+        self.solver_runs = defaultdict(int)  # (mode, backend) -> count
+        self.solver_seconds = {}  # mode -> Histogram
+        self.solver_last = {}  # mode -> stats of the last run
+
+    def observe_request(self, endpoint, method, status, seconds, queries, db_seconds):
+        key = (endpoint, method)
+        with self.lock:
+            self.requests[endpoint, method, status] += 1
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.queries[key] = Histogram(QUERY_BUCKETS)
+            self.latency[key].observe(seconds)
+            self.queries[key].observe(queries)
+            self.db_seconds[key] += db_seconds
+
+    def observe_slow_query(self, endpoint, sql, seconds):
+        with self.lock:
+            self.slow_queries[endpoint] += 1
+            self.slow_samples.append({'endpoint': endpoint, 'sql': sql, 'seconds': round(seconds, 6), 'at': time.time()})
+
+    def observe_solution(self, mode, backend, stats):
+        with self.lock:
+            self.solver_runs[mode, backend] += 1
+            if mode not in self.solver_seconds:
+                self.solver_seconds[mode] = Histogram(SOLVER_BUCKETS)
+            self.solver_seconds[mode].observe(stats.get('total_s', stats.get('seconds', 0)))
+            self.solver_last[mode] = dict(stats)
+
+    def samples(self):
+        with self.lock:
+            return list(self.slow_samples)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self.lock:
+            lines = []
+
+            def family(name, kind, help_text):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+            family('smartdaro_requests_total', 'counter', 'Requests by endpoint, method and status.')
+            for (endpoint, method, status), count in sorted(self.requests.items()):
+                lines.append(f'smartdaro_requests_total{_labels({"endpoint": endpoint, "method": method, "status": status})} {count}')
+            family('smartdaro_request_seconds', 'histogram', 'Request latency.')
+            for (endpoint, method), histogram in sorted(self.latency.items()):
+                lines.extend(histogram.lines('smartdaro_request_seconds', {'endpoint': endpoint, 'method': method}))
+            family('smartdaro_request_queries', 'histogram', 'Database queries per request.')
+            for (endpoint, method), histogram in sorted(self.queries.items()):
+                lines.extend(histogram.lines('smartdaro_request_queries', {'endpoint': endpoint, 'method': method}))
+            family('smartdaro_request_db_seconds_total', 'counter', 'Time spent in database queries.')
+            for (endpoint, method), seconds in sorted(self.db_seconds.items()):
+                lines.append(f'smartdaro_request_db_seconds_total{_labels({"endpoint": endpoint, "method": method})} {_number(seconds)}')
+            family('smartdaro_slow_queries_total', 'counter', 'Queries slower than METRICS_SLOW_QUERY_MS.')
+            for endpoint, count in sorted(self.slow_queries.items()):
+                lines.append(f'smartdaro_slow_queries_total{_labels({"endpoint": endpoint})} {count}')
+
+            family('smartdaro_solver_runs_total', 'counter', 'Scheduler runs by mode and backend.')
+            for (mode, backend), count in sorted(self.solver_runs.items()):
+                lines.append(f'smartdaro_solver_runs_total{_labels({"mode": mode, "backend": backend})} {count}')
+            family('smartdaro_solver_seconds', 'histogram', 'Scheduler run time, loading and publishing included.')
+            for mode, histogram in sorted(self.solver_seconds.items()):
+                lines.extend(histogram.lines('smartdaro_solver_seconds', {'mode': mode}))
+            family('smartdaro_solver_last', 'gauge', 'Model size and search figures of the last run of each mode.')
+            for mode, stats in sorted(self.solver_last.items()):
+                for stat, value in sorted(stats.items()):
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        lines.append(f'smartdaro_solver_last{_labels({"mode": mode, "stat": stat})} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class _RequestStats:
+    __slots__ = ('queries', 'db_seconds', 'slow')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.slow = []  # (sql, seconds), reported once the endpoint is known
+
+
+# The request being measured; contextvars follow it into sync_to_async threads
+_current = ContextVar('api_metrics_request', default=None)
+
+
+def _time_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_seconds += seconds
+        if seconds * 1000 >= settings.METRICS_SLOW_QUERY_MS:
+            stats.slow.append((sql, seconds))
+
+
+def _install_wrapper(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+class MetricsMiddleware:
+    """Latency, query count and DB time of every request, by endpoint."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        connection_created.connect(_install_wrapper, dispatch_uid='api.metrics')
+        for connection in connections.all(initialized_only=True):
+            _install_wrapper(connection)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        stats = _RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        stats = _RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, stats, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, stats, seconds):
+        # The URL pattern, not the path, so ids do not multiply the series
+        match = request.resolver_match
+        endpoint = match.route if match is not None else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        registry.observe_request(endpoint, method, response.status_code, seconds, stats.queries, stats.db_seconds)
+        for sql, query_seconds in stats.slow:
+            registry.observe_slow_query(endpoint, sql, query_seconds)
+            logger.warning(json.dumps({'event': 'slow_query', 'endpoint': endpoint, 'seconds': round(query_seconds, 6), 'sql': sql}))
+        if settings.METRICS_LOG_REQUESTS:
+            logger.info(json.dumps({
+                'event': 'request', 'endpoint': endpoint, 'method': method, 'status': response.status_code,
+                'seconds': round(seconds, 6), 'queries': stats.queries, 'db_seconds': round(stats.db_seconds, 6),
+            }))
+
+
+def observe_solution(solution, mode):
+    """Record a scheduler run; ``mode`` is "full", "incremental" or "affected"."""
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        return
+    registry.observe_solution(mode, solution.backend, solution.stats)
+    if settings.METRICS_LOG_REQUESTS:
+        logger.info(json.dumps({'event': 'solve', 'mode': mode, 'backend': solution.backend, **solution.stats}))
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_enrolment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SessionAttendanceStats',
+            fields=[
+                ('timetable', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='attendance_stats', serialize=False, to='api.timetable')),
+                ('attended', models.IntegerField(default=0)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='session_stats', to='api.course')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StudentAttendanceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attended', models.IntegerField(default=0)),
+                ('current_streak', models.IntegerField(default=0)),
+                ('best_streak', models.IntegerField(default=0)),
+                ('last_checkin', models.DateTimeField(blank=True, null=True)),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_stats', to='api.course')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attendance_stats', to='api.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['course', 'attended'], name='api_student_course__204402_idx')],
+                'unique_together': {('user', 'course')},
+            },
+        ),
+    ]
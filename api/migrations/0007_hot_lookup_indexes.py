@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_attendance_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['user', 'timestamp'], name='api_attenda_user_id_36313a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['-timestamp'], name='api_attenda_timesta_a36998_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='schedulejob',
+            index=models.Index(fields=['status', 'id'], name='api_schedul_status_423c33_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(fields=['day', 'start_time'], name='api_timetab_day_51e56b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['role', 'reg_no'], name='api_user_role_d19e6b_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+from api.slots import WEEK, week_minute
+
+
+def fill_week_minutes(apps, schema_editor):
+    Timetable = apps.get_model('api', 'Timetable')
+    rows = []
+    for row in Timetable.objects.only('id', 'day', 'start_time', 'end_time').iterator(chunk_size=2000):
+        if row.day in WEEK:
+            row.week_start = week_minute(row.day, row.start_time)
+            row.week_end = week_minute(row.day, row.end_time)
+            rows.append(row)
+    Timetable.objects.bulk_update(rows, ['week_start', 'week_end'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='timetable',
+            name='api_timetab_day_51e56b_idx',
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='session_minutes',
+            field=models.PositiveSmallIntegerField(default=180),
+        ),
+        migrations.AddField(
+            model_name='timetable',
+            name='week_end',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='timetable',
+            name='week_start',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='timetable',
+            name='day',
+            field=models.CharField(choices=[('Monday', 'Monday'), ('Tuesday', 'Tuesday'), ('Wednesday', 'Wednesday'), ('Thursday', 'Thursday'), ('Friday', 'Friday'), ('Saturday', 'Saturday'), ('Sunday', 'Sunday')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(fields=['week_start', 'week_end'], name='api_timetab_week_st_8bcc8b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='timetable',
+            index=models.Index(fields=['room', 'week_start'], name='api_timetab_room_id_242aa0_idx'),
+        ),
+        migrations.RunPython(fill_week_minutes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_week_minute_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='max_hours_per_week',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='preferred_days',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_lecturer_preferences'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scenario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('changes', models.JSONField(default=list)),
+                ('mode', models.CharField(choices=[('evaluate', 'Evaluate'), ('reschedule', 'Reschedule'), ('full', 'Full')], default='reschedule', max_length=10)),
+                ('base_version', models.BigIntegerField()),
+                ('sessions', models.JSONField(default=list)),
+                ('report', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('promoted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_scenario'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimetableChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timetable_id', models.IntegerField()),
+                ('course_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('canceled', 'Canceled'), ('deleted', 'Deleted')], max_length=10)),
+                ('session', models.JSONField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['course_id', 'seq'], name='api_timetab_course__b10dc1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_timetable_change'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Term',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='attendance',
+            unique_together=set(),
+        ),
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('start', models.DateField()),
+                ('end', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['start', 'end'], name='api_holiday_start_48b121_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SessionOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('is_canceled', models.BooleanField(default=False)),
+                ('timetable', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='api.timetable')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attendance',
+            name='occurrence',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attendance', to='api.sessionoccurrence'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('occurrence', 'user'), name='attendance_once_per_occurrence'),
+        ),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(condition=models.Q(('occurrence__isnull', True)), fields=('timetable', 'user'), name='attendance_once_per_class'),
+        ),
+        migrations.AddIndex(
+            model_name='term',
+            index=models.Index(fields=['start', 'end'], name='api_term_start_361069_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='sessionoccurrence',
+            unique_together={('timetable', 'date')},
+        ),
+    ]
@@ -1,7 +1,13 @@
+from django.core.exceptions import ValidationError
 from django.db import models
 
+from .slots import SESSION_MINUTES, WEEK, week_minute
+
 # Create your models here.
 
+# Day Choices
+DAY_CHOICES = tuple((day, day) for day in WEEK)
+
 # User Role Choices
 USER_ROLES = (
     ('student', 'Student'),
@@ -22,6 +28,8 @@ class Course(models.Model):
     name = models.CharField(max_length=100)
     lecturer = models.ForeignKey('User', on_delete=models.CASCADE, limit_choices_to={'role': 'lecturer'})
     room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True)
+    students = models.PositiveIntegerField(default=0)  # Expected class size, checked against room capacity
+    session_minutes = models.PositiveSmallIntegerField(default=SESSION_MINUTES)  # Length of the weekly session
 
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -32,34 +40,263 @@ class User(models.Model):
     name = models.CharField(max_length=100)
     role = models.CharField(max_length=10, choices=USER_ROLES)
     password = models.CharField(max_length=128)  # Store hashed password
+    available_days = models.CharField(max_length=100, blank=True)  # Comma-separated days a lecturer can teach, blank for any day
+    # Soft limits for the scheduler's objectives (see api.objectives)
+    preferred_days = models.CharField(max_length=100, blank=True)  # Comma-separated days a lecturer would rather teach
+    max_hours_per_week = models.PositiveSmallIntegerField(null=True, blank=True)  # Teaching hours before overload
+
+    def get_available_days(self):
+        return [day.strip() for day in self.available_days.split(',') if day.strip()]
+
+    def get_preferred_days(self):
+        return [day.strip() for day in self.preferred_days.split(',') if day.strip()]
+
+    class Meta:
+        indexes = [models.Index(fields=['role', 'reg_no'])]  # The scheduler's lecturer list, admin role filter
 
     def __str__(self):
         return f"{self.name} ({self.reg_no})"
 
+# Enrolment Model (Student takes Course)
+class Enrolment(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enrolments', limit_choices_to={'role': 'student'})
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='enrolments')
+
+    class Meta:
+        unique_together = ('user', 'course')  # Its index also serves per-student lookups
+
+    def __str__(self):
+        return f"{self.user.reg_no} in {self.course.code}"
+
 # Timetable Model
 class Timetable(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
-    day = models.CharField(max_length=10)
+    day = models.CharField(max_length=10, choices=DAY_CHOICES)
     start_time = models.TimeField()  
     end_time = models.TimeField()  
     room = models.ForeignKey(Room, on_delete=models.SET_NULL, null=True)
     is_canceled = models.BooleanField(default=False)
+    # The same span as minutes since Monday 00:00 (see api.slots), kept in
+    # step with day/start_time/end_time on save; clash checks compare these
+    week_start = models.PositiveIntegerField(default=0, editable=False)
+    week_end = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         unique_together = ('room', 'day', 'start_time')  # Prevent clashes
+        indexes = [
+            models.Index(fields=['week_start', 'week_end']),  # Slot lookups across rooms, week ordering
+            models.Index(fields=['room', 'week_start']),  # Overlap checks within a room
+        ]
 
     def __str__(self):
         return f"{self.course.code} on {self.day} at {self.start_time}"
 
+    def clean(self):
+        if self.day not in WEEK or self.start_time is None or self.end_time is None:
+            return
+        start, end = week_minute(self.day, self.start_time), week_minute(self.day, self.end_time)
+        if end <= start:
+            raise ValidationError({'end_time': "A session must end after it starts."})
+        if self.room_id is not None:
+            clash = (
+                Timetable.objects.filter(room_id=self.room_id, week_start__lt=end, week_end__gt=start)
+                .exclude(pk=self.pk).select_related('course').first()
+            )
+            if clash is not None:
+                raise ValidationError(f"{self.room} is already taken by {clash}.")
+
+    def save(self, *args, **kwargs):
+        self.week_start = week_minute(self.day, self.start_time)
+        self.week_end = week_minute(self.day, self.end_time)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'week_start', 'week_end'}
+        super().save(*args, **kwargs)
+
+# Term Calendar
+# Timetable rows are weekly patterns; terms and holidays say which dates they
+# are held on (see api.occurrences). A dated occurrence only gets a row once
+# something refers to it: a cancellation of that one week, or a check-in.
+class Term(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    start = models.DateField()
+    end = models.DateField()  # Last day of teaching, inclusive
+
+    class Meta:
+        indexes = [models.Index(fields=['start', 'end'])]  # Terms overlapping a date range
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.start is not None and self.end is not None and self.end < self.start:
+            raise ValidationError({'end': "A term must end on or after its first day."})
+
+class Holiday(models.Model):
+    name = models.CharField(max_length=100)
+    start = models.DateField()
+    end = models.DateField()  # Inclusive; the same as start for a single day
+
+    class Meta:
+        indexes = [models.Index(fields=['start', 'end'])]  # Holidays overlapping a date range
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        if self.start is not None and self.end is not None and self.end < self.start:
+            raise ValidationError({'end': "A holiday must end on or after its first day."})
+
+class SessionOccurrence(models.Model):
+    timetable = models.ForeignKey(Timetable, on_delete=models.CASCADE, related_name='occurrences')
+    date = models.DateField()
+    is_canceled = models.BooleanField(default=False)  # This week only; Timetable.is_canceled is every week
+
+    class Meta:
+        unique_together = ('timetable', 'date')  # Its index also serves date-range lookups per session
+
+    def __str__(self):
+        return f"{self.timetable} on {self.date}"
+
 # Attendance Model
 class Attendance(models.Model):
     timetable = models.ForeignKey(Timetable, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The week attended, when a term was running; None for check-ins made outside one
+    occurrence = models.ForeignKey(SessionOccurrence, on_delete=models.CASCADE, null=True, blank=True, related_name='attendance')
     attended = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('timetable', 'user')  # One attendance per user per class
+        # One attendance per user per occurrence, or per class outside any term
+        constraints = [
+            models.UniqueConstraint(fields=['occurrence', 'user'], name='attendance_once_per_occurrence'),
+            models.UniqueConstraint(
+                fields=['timetable', 'user'], condition=models.Q(occurrence__isnull=True), name='attendance_once_per_class',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'timestamp']),  # A student's history, newest or oldest first
+            models.Index(fields=['-timestamp']),  # Recent check-ins across all classes
+        ]
+
+    def __str__(self):
+        return f"{self.user.name} - {self.timetable}"
+
+# Timetable Generation Job
+JOB_STATUSES = (
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
+class ScheduleJob(models.Model):
+    status = models.CharField(max_length=10, choices=JOB_STATUSES, default='queued')
+    incremental = models.BooleanField(default=False)
+    # Course, room and lecturer ids of an edit whose sessions alone are
+    # re-placed (see reschedule_affected); None for a generation
+    affected = models.JSONField(null=True, blank=True)
+    # Set while the job is queued or running; unique, so only one solver runs at a time
+    active_lock = models.CharField(max_length=20, null=True, blank=True, unique=True)
+    progress = models.FloatField(default=0)  # Fraction of the search done, 0 to 1
+    placed = models.IntegerField(default=0)  # Courses placed in the best solution so far
+    total = models.IntegerField(default=0)
+    backend = models.CharField(max_length=20, blank=True)
+    unscheduled = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Heartbeat while running
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]  # Workers poll for the oldest queued job
+
+    def __str__(self):
+        return f"Timetable job {self.id} ({self.status})"
+
+
+# Timetable Version
+# Single row, bumped in the same transaction as every timetable change so
+# cached documents and ETags can be keyed on it across processes.
+class TimetableVersion(models.Model):
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Timetable version {self.version}"
+
+
+# Timetable Change Log
+# One row per write to a Timetable row, in commit order (see api.changes);
+# clients catch up by asking for the changes after the last seq they saw
+CHANGE_ACTIONS = (
+    ('created', 'Created'),
+    ('updated', 'Updated'),
+    ('canceled', 'Canceled'),
+    ('deleted', 'Deleted'),
+)
+
+class TimetableChange(models.Model):
+    seq = models.BigAutoField(primary_key=True)
+    timetable_id = models.IntegerField()  # Not a foreign key: deleted sessions stay in the log
+    course_id = models.IntegerField()
+    action = models.CharField(max_length=10, choices=CHANGE_ACTIONS)
+    session = models.JSONField(null=True)  # The row as /api/timetable/ shows it, None once deleted
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['course_id', 'seq'])]  # A user's changes since a seq
+
+    def __str__(self):
+        return f"Change {self.seq}: session {self.timetable_id} {self.action}"
+
+
+# What-if Scenario
+# Changes to the scheduler's data tried on an in-memory copy of the timetable
+# (see api.scenarios), with the sessions that came out, until promoted
+SCENARIO_MODES = (
+    ('evaluate', 'Evaluate'),
+    ('reschedule', 'Reschedule'),
+    ('full', 'Full'),
+)
+
+class Scenario(models.Model):
+    name = models.CharField(max_length=100)
+    changes = models.JSONField(default=list)
+    mode = models.CharField(max_length=10, choices=SCENARIO_MODES, default='reschedule')
+    base_version = models.BigIntegerField()  # Timetable version the sessions were solved against
+    sessions = models.JSONField(default=list)  # [course_id, week_start, week_end, room_id] of every placed course
+    report = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    promoted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Scenario {self.name}"
+
+
+# Attendance Rollups
+# Kept up to date by api.analytics as check-ins arrive, and rebuilt with
+# `manage.py rebuild_attendance_rollups`; dashboards read these instead of
+# scanning Attendance.
+class SessionAttendanceStats(models.Model):
+    timetable = models.OneToOneField(Timetable, on_delete=models.CASCADE, primary_key=True, related_name='attendance_stats')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='session_stats')
+    attended = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.timetable}: {self.attended} attended"
+
+class StudentAttendanceStats(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attendance_stats')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='student_stats')
+    attended = models.IntegerField(default=0)
+    current_streak = models.IntegerField(default=0)  # Run of consecutive sessions up to the latest one attended
+    best_streak = models.IntegerField(default=0)
+    last_checkin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('user', 'course')
+        indexes = [models.Index(fields=['course', 'attended'])]  # Low-attendance alerts per course
 
     def __str__(self):
-        return f"{self.user.name} - {self.timetable}"
\ No newline at end of file
+        return f"{self.user.reg_no} in {self.course.code}: {self.attended} attended"
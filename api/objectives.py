@@ -0,0 +1,159 @@
+"""
+Soft objectives of a timetable, and an evaluator that scores moves by delta.
+
+The solver's hard constraints (no clashes, rooms big enough, lecturers
+available) decide what is feasible; among feasible timetables these are the
+costs to minimise:
+
+- ``wasted_seats``: empty seats in the rooms sessions are given.
+- ``overload``: hours a lecturer teaches beyond their weekly maximum.
+- ``balance``: the sum over lecturers and days of squared teaching hours,
+  smallest when each lecturer's hours are spread over their days.
+- ``preferred_days``: hours taught outside a lecturer's preferred days.
+- ``student_gaps``: idle hours between sessions in a student's day, counted
+  once per student.
+
+The score is their weighted sum. Each term is kept as a sum of small
+components (one course, one lecturer, one lecturer-day, one student group on
+one day), so moving a session only recomputes the few components it touches.
+
+Like the solver, this module does not import Django.
+"""
+from collections import defaultdict, namedtuple
+
+from .slots import CELL_MINUTES, MINUTES_PER_DAY
+
+Weights = namedtuple(
+    'Weights', 'wasted_seats overload balance preferred_days student_gaps', defaults=(1.0, 50.0, 1.0, 5.0, 2.0),
+)
+OBJECTIVES = Weights._fields
+
+_ZERO = (0.0,) * len(OBJECTIVES)
+_WASTED, _OVERLOAD, _BALANCE, _PREFERRED, _GAPS = range(len(OBJECTIVES))
+
+
+class Evaluator:
+    """
+    The objective values of an assignment (course index -> (slot, room
+    index)) of ``problem``, updated move by move.
+
+    ``delta`` prices a move without making it; ``move`` makes it. Neither
+    checks hard constraints.
+    """
+
+    def __init__(self, problem, assignment=(), weights=None):
+        self.problem = problem
+        self.weights = Weights(*weights) if weights is not None else Weights()
+        # Problems built without slot times (tests, mostly) get one cell-sized hour per cell
+        self.slot_times = problem.slot_times or [
+            (cells[0] * CELL_MINUTES, (cells[-1] + 1) * CELL_MINUTES) for cells in problem.slot_cells
+        ]
+        self.assignment = {}
+        self.lecturer_minutes = defaultdict(int)  # lecturer id -> minutes a week
+        self.day_minutes = defaultdict(int)  # (lecturer id, day) -> minutes
+        self.group_day = defaultdict(list)  # (group, day) -> [(start, end)] of its sessions
+        self.values = {}  # component key -> raw costs, one per objective
+        self.totals = [0.0] * len(OBJECTIVES)
+        for c, placement in dict(assignment).items():
+            self.move(c, placement)
+
+    def total(self):
+        return sum(weight * value for weight, value in zip(self.weights, self.totals))
+
+    def breakdown(self):
+        """Each objective's raw value and weighted cost, and the total."""
+        terms = {
+            name: {'value': round(value, 4), 'weighted': round(weight * value, 4)}
+            for name, weight, value in zip(OBJECTIVES, self.weights, self.totals)
+        }
+        return {'objectives': terms, 'total': round(self.total(), 4)}
+
+    def delta(self, c, placement):
+        """Change of the total if course ``c`` moved to ``placement`` (None: unplaced)."""
+        old = self.assignment.get(c)
+        keys = self._touched(c, old, placement)
+        before = sum(self._weighted(self.values.get(key, _ZERO)) for key in keys)
+        self._set(c, placement)
+        after = sum(self._weighted(self._value(key)) for key in keys)
+        self._set(c, old)
+        return after - before
+
+    def move(self, c, placement):
+        """Move course ``c`` to ``placement`` (None: unplaced); returns the change of the total."""
+        old = self.assignment.get(c)
+        keys = self._touched(c, old, placement)
+        self._set(c, placement)
+        change = 0.0
+        for key in keys:
+            before = self.values.pop(key, _ZERO)
+            after = self._value(key)
+            if after != _ZERO:
+                self.values[key] = after
+            for i, (a, b) in enumerate(zip(after, before)):
+                self.totals[i] += a - b
+            change += self._weighted(after) - self._weighted(before)
+        return change
+
+    def _weighted(self, values):
+        return sum(weight * value for weight, value in zip(self.weights, values))
+
+    def _day(self, slot):
+        return self.slot_times[slot][0] // MINUTES_PER_DAY
+
+    def _touched(self, c, *placements):
+        lecturer = self.problem.courses[c].lecturer_id
+        keys = {('course', c), ('lecturer', lecturer)}
+        for placement in placements:
+            if placement is not None:
+                day = self._day(placement[0])
+                keys.add(('day', lecturer, day))
+                keys.update(('group', g, day) for g in self.problem.course_groups[c])
+        return keys
+
+    def _set(self, c, placement):
+        old = self.assignment.pop(c, None)
+        if old is not None:
+            self._count(c, old, -1)
+        if placement is not None:
+            self.assignment[c] = placement
+            self._count(c, placement, 1)
+
+    def _count(self, c, placement, sign):
+        start, end = self.slot_times[placement[0]]
+        day = start // MINUTES_PER_DAY
+        lecturer = self.problem.courses[c].lecturer_id
+        self.lecturer_minutes[lecturer] += sign * (end - start)
+        self.day_minutes[lecturer, day] += sign * (end - start)
+        for g in self.problem.course_groups[c]:
+            if sign > 0:
+                self.group_day[g, day].append((start, end))
+            else:
+                self.group_day[g, day].remove((start, end))
+
+    def _value(self, key):
+        # Raw costs of one component in the current state
+        values = [0.0] * len(OBJECTIVES)
+        kind = key[0]
+        if kind == 'course':
+            placement = self.assignment.get(key[1])
+            if placement is None:
+                return _ZERO
+            slot, r = placement
+            course = self.problem.courses[key[1]]
+            values[_WASTED] = max(self.problem.capacities[r] - course.size, 0)
+            if course.preferred is not None and not course.preferred >> slot & 1:
+                start, end = self.slot_times[slot]
+                values[_PREFERRED] = (end - start) / 60
+        elif kind == 'lecturer':
+            limit = self.problem.lecturer_limits.get(key[1])
+            if limit is not None:
+                values[_OVERLOAD] = max(self.lecturer_minutes[key[1]] - limit, 0) / 60
+        elif kind == 'day':
+            values[_BALANCE] = (self.day_minutes[key[1], key[2]] / 60) ** 2
+        else:
+            sessions = self.group_day[key[1], key[2]]
+            if len(sessions) > 1:
+                span = max(end for _, end in sessions) - min(start for start, _ in sessions)
+                idle = span - sum(end - start for start, end in sessions)
+                values[_GAPS] = max(idle, 0) / 60 * self.problem.group_sizes[key[1]]
+        return tuple(values)
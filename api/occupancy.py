@@ -0,0 +1,97 @@
+"""
+Which rooms are free when: an in-memory occupancy index of the timetable.
+
+The week is cut at every session's start and end into elementary intervals,
+each holding a bitset of the rooms busy throughout it, with rooms numbered
+smallest first. A query ORs the bitsets of the intervals it covers, masks
+off the rooms that are too small (one bisect, as capacities are sorted) and
+reads the free rooms off the remaining bits, best fit first: microseconds,
+however many rooms there are.
+
+The index is built from one query per table and rebuilt on the first lookup
+after the timetable version changes, which every session and room write
+bumps. Canceled sessions keep their room, as they do in ``Timetable.clean``.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from .models import Room, Timetable
+from .timetable_cache import current_version
+
+RoomInfo = namedtuple('RoomInfo', 'id name capacity')
+
+
+class OccupancyIndex:
+    def __init__(self, rooms, sessions, version=None):
+        """``rooms``: ``(id, name, capacity)``; ``sessions``: ``(room_id, week_start, week_end)``."""
+        self.version = version
+        self.rooms = sorted((RoomInfo(*room) for room in rooms), key=lambda room: (room.capacity, room.id))
+        self.capacities = [room.capacity for room in self.rooms]
+        self.position = {room.id: i for i, room in enumerate(self.rooms)}
+        self.all_rooms = (1 << len(self.rooms)) - 1
+        sessions = [(room_id, start, end) for room_id, start, end in sessions if room_id in self.position and start < end]
+        self.bounds = sorted({minute for _, start, end in sessions for minute in (start, end)})
+        self.busy = [0] * max(len(self.bounds) - 1, 0)  # busy[i]: rooms busy in [bounds[i], bounds[i + 1])
+        for room_id, start, end in sessions:
+            bit = 1 << self.position[room_id]
+            for i in range(bisect_left(self.bounds, start), bisect_left(self.bounds, end)):
+                self.busy[i] |= bit
+
+    def busy_during(self, start, end):
+        """Bitset of the rooms busy at any point of ``[start, end)``."""
+        busy = 0
+        for i in range(max(bisect_right(self.bounds, start) - 1, 0), min(bisect_left(self.bounds, end), len(self.busy))):
+            busy |= self.busy[i]
+        return busy
+
+    def free_rooms(self, spans, min_capacity=0, limit=None):
+        """
+        Rooms of at least ``min_capacity`` seats free throughout every
+        ``(start, end)`` of ``spans``, smallest first, at most ``limit``.
+        """
+        busy = 0
+        for start, end in spans:
+            busy |= self.busy_during(start, end)
+        first = bisect_left(self.capacities, min_capacity)
+        free = self.all_rooms >> first << first & ~busy
+        found = []
+        while free and (limit is None or len(found) < limit):
+            low = free & -free
+            found.append(self.rooms[low.bit_length() - 1])
+            free ^= low
+        return found
+
+    def count_free(self, spans, min_capacity=0):
+        busy = 0
+        for start, end in spans:
+            busy |= self.busy_during(start, end)
+        first = bisect_left(self.capacities, min_capacity)
+        return bin(self.all_rooms >> first << first & ~busy).count('1')
+
+
+def build_index(version=None):
+    rooms = Room.objects.values_list('id', 'name', 'capacity')
+    sessions = Timetable.objects.filter(room__isnull=False).values_list('room_id', 'week_start', 'week_end')
+    return OccupancyIndex(rooms, sessions.iterator(chunk_size=5000), version)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def occupancy():
+    """The index of the current timetable version, rebuilt when it changes."""
+    global _index
+    version = current_version()
+    with _index_lock:
+        if _index is None or _index.version != version:
+            _index = build_index(version)
+        return _index
+
+
+def clear_occupancy():
+    # For tests and tools that rewind the database, and with it the version
+    global _index
+    with _index_lock:
+        _index = None
@@ -0,0 +1,163 @@
+"""
+Dated occurrences of the weekly timetable, expanded in memory.
+
+A Timetable row is a weekly pattern. Terms say which dates teaching runs on
+and holidays which of them are skipped; a session is held on every such date
+that falls on its day. Nothing is stored per date until it has to be: a
+``SessionOccurrence`` row is created when a single week is canceled or
+checked in to, and a date-range query expands the patterns over the range and
+overlays the few rows stored for it.
+"""
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.db import transaction
+
+from .changes import record_changes
+from .models import Holiday, SessionOccurrence, Term
+from .slots import MINUTES_PER_DAY
+from .timetable_cache import TIMETABLE_FIELDS, invalidate_timetable, timetable_row, user_timetable
+
+MAX_DAYS = 366  # Longest date range expanded at once
+
+
+class TermCalendar:
+    """Which dates are teaching days, from ``(start, end)`` terms and ``(start, end, name)`` holidays; ends inclusive."""
+
+    def __init__(self, terms, holidays):
+        self.terms = []  # Overlapping terms merged, sorted by start
+        for start, end in sorted(terms):
+            if self.terms and start <= self.terms[-1][1] + timedelta(days=1):
+                self.terms[-1] = (self.terms[-1][0], max(end, self.terms[-1][1]))
+            else:
+                self.terms.append((start, end))
+        self.term_starts = [start for start, _ in self.terms]
+        self.holidays = sorted(holidays)
+
+    def in_term(self, day):
+        i = bisect_right(self.term_starts, day) - 1
+        return i >= 0 and day <= self.terms[i][1]
+
+    def holidays_between(self, start, end):
+        return [holiday for holiday in self.holidays if holiday[0] <= end and holiday[1] >= start]
+
+    def holiday(self, day):
+        """Name of the holiday ``day`` falls in, or None."""
+        holidays = self.holidays_between(day, day)
+        return holidays[0][2] if holidays else None
+
+    def teaching_days(self, start, end):
+        """Dates from ``start`` to ``end`` inclusive inside a term and outside every holiday."""
+        off = set()
+        for first, last, _ in self.holidays_between(start, end):
+            day = max(first, start)
+            while day <= min(last, end):
+                off.add(day)
+                day += timedelta(days=1)
+        day = start
+        while day <= end:
+            if day not in off and self.in_term(day):
+                yield day
+            day += timedelta(days=1)
+
+    def holds(self, week_start, day):
+        """Whether a session starting ``week_start`` minutes into the week is held on ``day``."""
+        return (
+            day.weekday() == week_start // MINUTES_PER_DAY and self.in_term(day) and self.holiday(day) is None
+        )
+
+
+def load_calendar(start, end):
+    """The calendar from ``start`` to ``end``: the terms and holidays overlapping them."""
+    terms = list(Term.objects.filter(start__lte=end, end__gte=start).values_list('start', 'end'))
+    if not terms:  # Nothing is held, so holidays do not matter
+        return TermCalendar([], [])
+    return TermCalendar(terms, Holiday.objects.filter(start__lte=end, end__gte=start).values_list('start', 'end', 'name'))
+
+
+def expand(sessions, start, end, calendar, overrides=None):
+    """
+    Occurrences from ``start`` to ``end`` of ``sessions`` (rows shaped like
+    ``timetable_row``), by date then time. ``overrides`` maps
+    ``(timetable_id, date)`` to the cancellation of that one week.
+    """
+    overrides = overrides or {}
+    by_weekday = {}
+    for session in sorted(sessions, key=lambda session: (session['week_start'], session['id'])):
+        by_weekday.setdefault(session['week_start'] // MINUTES_PER_DAY, []).append(session)
+    occurrences = []
+    for day in calendar.teaching_days(start, end):
+        for session in by_weekday.get(day.weekday(), ()):
+            canceled = session['is_canceled'] or overrides.get((session['id'], day), False)
+            occurrences.append({
+                'date': day.isoformat(),
+                'timetable_id': session['id'],
+                'course': session['course'],
+                'start_time': session['start_time'],
+                'end_time': session['end_time'],
+                'room': session['room'],
+                'is_canceled': canceled,
+            })
+    return occurrences
+
+
+def user_occurrences(role, user_id, start, end):
+    """A user's occurrences from ``start`` to ``end`` inclusive, and the holidays between."""
+    if end < start:
+        raise ValueError("end must not be before start")
+    if (end - start).days >= MAX_DAYS:
+        raise ValueError(f"A date range spans at most {MAX_DAYS} days")
+    calendar = load_calendar(start, end)
+    sessions = user_timetable(role, user_id)
+    rows = [timetable_row(*row) for row in sessions.order_by('id').values_list(*TIMETABLE_FIELDS)]
+    overrides = dict(
+        ((timetable_id, day), canceled) for timetable_id, day, canceled in SessionOccurrence.objects.filter(
+            timetable_id__in=[row['id'] for row in rows], date__range=(start, end),
+        ).values_list('timetable_id', 'date', 'is_canceled')
+    )
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'occurrences': expand(rows, start, end, calendar, overrides),
+        'holidays': [
+            {'name': name, 'start': first.isoformat(), 'end': last.isoformat()}
+            for first, last, name in calendar.holidays_between(start, end)
+        ],
+    }
+
+
+def cancel_occurrence(timetable, day, calendar=None):
+    """
+    Cancel ``timetable`` on ``day`` only; ValueError if it is not held that
+    day. Like any timetable write it bumps the version and reaches the change
+    feed, as an update of the session carrying the canceled occurrence.
+    """
+    calendar = calendar or load_calendar(day, day)
+    if not calendar.holds(timetable.week_start, day):
+        raise ValueError(f"{timetable} is not held on {day.isoformat()}")
+    with transaction.atomic():
+        occurrence, _ = SessionOccurrence.objects.update_or_create(
+            timetable_id=timetable.id, date=day, defaults={'is_canceled': True},
+        )
+        invalidate_timetable()
+        record_changes(
+            saved={timetable.id: 'updated'},
+            occurrences={timetable.id: {'date': day.isoformat(), 'is_canceled': True}},
+        )
+    return occurrence
+
+
+def occurrences_on(day, week_starts, calendar=None):
+    """
+    Occurrence ids of the sessions held on ``day``, by timetable id, creating
+    the rows that do not exist yet; ``week_starts`` maps timetable ids to
+    their ``week_start``. Sessions not held that day are left out.
+    """
+    calendar = calendar or load_calendar(day, day)
+    held = [t for t, week_start in week_starts.items() if calendar.holds(week_start, day)]
+    if not held:
+        return {}
+    SessionOccurrence.objects.bulk_create(
+        [SessionOccurrence(timetable_id=t, date=day) for t in held], batch_size=500, ignore_conflicts=True,
+    )
+    return dict(SessionOccurrence.objects.filter(timetable_id__in=held, date=day).values_list('timetable_id', 'id'))
@@ -0,0 +1,186 @@
+"""
+Read replicas for the read-heavy endpoints.
+
+Every write goes to the primary ("default"). Reads go there too, unless the
+view asks for a replica: ``ReplicaReadsMixin`` on the DRF views of the
+timetable, its exports and feed, and attendance analytics, ``replica_reads``
+in the async timetable view. Such a request reads from one replica of
+``DATABASE_READ_REPLICAS`` picked at random, after authentication, which
+stays on the primary so a session saved a moment ago is found.
+
+Replicas lag the primary, so users must see their own writes:
+``ReplicaPinMiddleware`` notes every request that wrote (the router is asked
+where each write goes) and pins its user to the primary for
+``DATABASE_REPLICA_PIN_SECONDS``. The pins live in the default cache, shared
+across processes when that cache is. Writes made off the request path, such
+as buffered check-ins, pin nobody.
+
+Without replicas the middleware removes itself at startup and views read
+from the primary as before.
+"""
+import random
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .auth import token_user
+
+PIN_KEY = 'api.routing.pin:{}'
+
+# The alias the current request reads from, None for the primary; contextvars
+# follow it into sync_to_async threads
+_read_alias = ContextVar('api_routing_read_alias', default=None)
+# [wrote] of the request being served, None off the request path
+_wrote = ContextVar('api_routing_wrote', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_READ_REPLICAS', ())
+
+
+def read_db():
+    """The alias the current request reads from, for querysets evaluated after the view returns."""
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        wrote = _wrote.get()
+        if wrote is not None:
+            wrote[0] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Replicas hold the same rows as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replicas()  # Replicas are copies of the migrated primary
+
+
+def _pin_owner(request):
+    # Who the request's writes pin: the API user (token or session), else
+    # the Django staff user. Only reads what is already on the request, or
+    # the session, so it never queries a replica
+    user = getattr(request, '_api_user', None) or token_user(request)
+    if user is not None:
+        return f'user:{user.id}'
+    session = getattr(request, 'session', None)
+    user_id = session.get('user_id') if session is not None else None
+    if user_id is not None:
+        return f'user:{user_id}'
+    staff = getattr(request, 'user', None)
+    if staff is not None and staff.is_authenticated:
+        return f'staff:{staff.pk}'
+    return None
+
+
+def pin(request):
+    owner = _pin_owner(request)
+    if owner is not None:
+        cache.set(PIN_KEY.format(owner), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def replica_for(request):
+    """A replica alias for the reads of ``request``, or None: no replicas, or the caller wrote recently."""
+    aliases = replicas()
+    if not aliases:
+        return None
+    owner = _pin_owner(request)
+    if owner is not None and cache.get(PIN_KEY.format(owner)):
+        return None
+    return random.choice(aliases)
+
+
+@contextmanager
+def replica_reads(request):
+    """Reads inside the block go to a replica, unless ``request``'s user is pinned to the primary."""
+    token = _read_alias.set(replica_for(request))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaReadsMixin:
+    """
+    For read-only DRF views: the handler reads from a replica, after
+    authentication and permission checks have read from the primary.
+    Querysets a streamed response evaluates later must be bound with
+    ``.using(read_db())``.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._replica_token = _read_alias.set(replica_for(request))
+
+    def dispatch(self, request, *args, **kwargs):
+        self._replica_token = None
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                _read_alias.reset(self._replica_token)
+
+
+class ReplicaPinMiddleware:
+    """Pins the user of every request that wrote to the primary."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        wrote = [False]
+        token = _wrote.set(wrote)
+        try:
+            response = self.get_response(request)
+        finally:
+            _wrote.reset(token)
+        if wrote[0]:
+            pin(request)
+        return response
+
+    async def __acall__(self, request):
+        wrote = [False]
+        token = _wrote.set(wrote)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _wrote.reset(token)
+        if wrote[0]:
+            await sync_to_async(pin)(request)  # May load the session or the staff user
+        return response
+
+
+def sync_replica(alias, source=DEFAULT_DB_ALIAS):
+    """
+    Copy the ``source`` SQLite database onto the file of replica ``alias``
+    with SQLite's online backup, page by page under a lock, so readers of
+    the replica see the old copy or the new one and never half of each.
+    """
+    connection = connections[source]
+    if connection.vendor != 'sqlite' or connections[alias].vendor != 'sqlite':
+        raise ValueError("Only SQLite databases can be copied")
+    connection.ensure_connection()
+    target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+    try:
+        connection.connection.backup(target)
+    finally:
+        target.close()
@@ -0,0 +1,314 @@
+"""
+What-if scheduling: try changes on an in-memory copy of the timetable.
+
+A scenario is a list of changes to what the scheduler reads, such as closing
+rooms, growing a course or handing courses to a new lecturer, applied to a
+``Snapshot`` of the live data rather than to the tables. The snapshot is
+loaded once per timetable version and shared, so evaluating many scenarios
+costs one database load; edits to what it holds (sessions, courses, rooms,
+enrolments, lecturers) all bump the version. Each run returns a report of what would move
+against the live timetable, and the resulting sessions can later be promoted
+to the live tables in one transaction, unless the timetable changed since.
+
+Changes (``op`` and its fields):
+
+- ``close_rooms``: ``rooms``, ids of rooms no session may use.
+- ``resize_course``: ``course`` id and its new expected ``students``.
+- ``assign_lecturer``: ``courses`` ids and the existing ``lecturer`` id.
+- ``add_lecturer``: a new lecturer's ``reg_no`` and ``name``, the
+  ``courses`` they take over and optionally ``available_days``,
+  ``preferred_days`` and ``max_hours_per_week``.
+- ``lecturer_days``: a ``lecturer`` id and their new ``available_days``.
+"""
+import secrets
+import threading
+from collections import namedtuple
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.db import transaction
+from django.utils import timezone
+
+from .ai_scheduler import _budget, day_slots, load_problem, load_timetable, publish, scheduler_weights
+from .jobs import LOCK
+from .models import Course, Room, ScheduleJob, Scenario, User
+from .objectives import Evaluator
+from .slots import WEEK, SlotGrid, day_and_time
+from .solver import Problem, Solution, reschedule, solve, violations
+from .timetable_cache import current_version
+
+CHANGES = ('close_rooms', 'resize_course', 'assign_lecturer', 'add_lecturer', 'lecturer_days')
+MODES = ('evaluate', 'reschedule', 'full')
+
+LecturerSpec = namedtuple('LecturerSpec', 'available preferred max_hours')
+
+
+class StaleScenario(Exception):
+    """The live timetable changed since the scenario was solved."""
+
+
+class Snapshot:
+    """The scheduler's view of the live data at one timetable version."""
+
+    def __init__(self, version):
+        self.version = version
+        self.problem = load_problem()
+        current, self.rows, _ = load_timetable(self.problem)
+        # Live sessions by room id, since scenarios renumber the rooms they keep
+        self.live = {c: (slot, self.problem.rooms[r].id) for c, (slot, r) in current.items()}
+        self.course_index = {course.id: c for c, course in enumerate(self.problem.courses)}
+        self.room_names = dict(Room.objects.values_list('id', 'name'))
+        self.lecturers = {
+            lecturer_id: LecturerSpec(_days(available), _days(preferred), max_hours)
+            for lecturer_id, available, preferred, max_hours in User.objects.filter(role='lecturer').values_list(
+                'id', 'available_days', 'preferred_days', 'max_hours_per_week'
+            )
+        }
+        # Slots of each course's session length, before lecturer availability
+        grid = SlotGrid()
+        slot_index = {interval: i for i, interval in enumerate(self.problem.slot_times)}
+        by_length = {}
+        self.length_masks = {}  # course id -> mask
+        for course_id, minutes in Course.objects.values_list('id', 'session_minutes'):
+            if minutes not in by_length:
+                by_length[minutes] = sum(1 << slot_index[interval] for interval in grid.slots(minutes))
+            self.length_masks[course_id] = by_length[minutes]
+
+    def describe(self, c, placement):
+        # A course's session as the API shows it, None when unplaced
+        if placement is None:
+            return None
+        slot, room_id = placement
+        week_start, week_end = self.problem.slot_times[slot]
+        day, start_time = day_and_time(week_start)
+        return {
+            'day': day, 'start_time': start_time.isoformat(), 'end_time': day_and_time(week_end)[1].isoformat(),
+            'room': self.room_names.get(room_id),
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def snapshot():
+    """The snapshot of the current timetable version, loaded when it changes."""
+    global _snapshot
+    version = current_version()
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = Snapshot(version)
+        return _snapshot
+
+
+def clear_snapshot():
+    # For tests and tools that rewind the database, and with it the version
+    global _snapshot
+    with _snapshot_lock:
+        _snapshot = None
+
+
+def _days(value):
+    return [day.strip() for day in value.split(',') if day.strip()] if value else []
+
+
+def _course(snap, course_id):
+    c = snap.course_index.get(course_id)
+    if c is None:
+        raise ValueError(f"No course {course_id}")
+    return c
+
+
+def _day_list(days):
+    if not isinstance(days, list) or any(day not in WEEK for day in days):
+        raise ValueError("Days must be a list of weekday names")
+    return days
+
+
+def scenario_problem(snap, changes):
+    """
+    The snapshot's problem with ``changes`` applied, and the live sessions
+    that survive them as course index -> (slot, room index). New lecturers
+    get negative ids. Raises ValueError for a malformed or unknown change.
+    """
+    base = snap.problem
+    courses = list(base.courses)
+    lecturers = dict(snap.lecturers)
+    lecturer_of = {}  # course index -> its lecturer under the scenario
+    touched = set()  # lecturers whose availability changed
+    closed = set()
+    for change in changes:
+        op = change.get('op') if isinstance(change, dict) else None
+        try:
+            if op == 'close_rooms':
+                unknown = set(change['rooms']) - set(snap.room_names)
+                if unknown:
+                    raise ValueError(f"No room {min(unknown)}")
+                closed.update(change['rooms'])
+            elif op == 'resize_course':
+                c = _course(snap, change['course'])
+                courses[c] = courses[c]._replace(size=int(change['students']))
+            elif op == 'assign_lecturer':
+                if change['lecturer'] not in snap.lecturers:
+                    raise ValueError(f"No lecturer {change['lecturer']}")
+                lecturer_of.update((_course(snap, course_id), change['lecturer']) for course_id in change['courses'])
+            elif op == 'add_lecturer':
+                if not change['reg_no'] or not change['name']:
+                    raise ValueError("A new lecturer needs a reg_no and a name")
+                lecturer_id = -1 - sum(1 for key in lecturers if key < 0)
+                max_hours = change.get('max_hours_per_week')
+                lecturers[lecturer_id] = LecturerSpec(
+                    _day_list(change.get('available_days', [])), _day_list(change.get('preferred_days', [])),
+                    None if max_hours is None else int(max_hours),
+                )
+                lecturer_of.update((_course(snap, course_id), lecturer_id) for course_id in change['courses'])
+            elif op == 'lecturer_days':
+                if change['lecturer'] not in snap.lecturers:
+                    raise ValueError(f"No lecturer {change['lecturer']}")
+                lecturers[change['lecturer']] = lecturers[change['lecturer']]._replace(
+                    available=_day_list(change['available_days'])
+                )
+                touched.add(change['lecturer'])
+            else:
+                raise ValueError(f"Unknown change {op!r}, expected one of {', '.join(CHANGES)}")
+        except (KeyError, TypeError) as exc:
+            raise ValueError(f"Malformed {op} change: {exc}")
+
+    for c, course in enumerate(courses):
+        lecturer_id = lecturer_of.get(c, course.lecturer_id)
+        if c in lecturer_of or lecturer_id in touched:
+            spec = lecturers[lecturer_id]
+            length = snap.length_masks.get(course.id, course.slots)
+            courses[c] = course._replace(
+                lecturer_id=lecturer_id,
+                slots=length & (day_slots(base.slot_times, spec.available) or length),
+                preferred=day_slots(base.slot_times, spec.preferred) or None,
+            )
+    limits = {lecturer_id: spec.max_hours * 60 for lecturer_id, spec in lecturers.items() if spec.max_hours}
+    problem = Problem(
+        courses, [room for room in base.rooms if room.id not in closed], base.slot_masks, base.groups,
+        slot_times=base.slot_times, lecturer_limits=limits, group_sizes=base.group_sizes,
+    )
+    current = {
+        c: (slot, problem.room_index[room_id]) for c, (slot, room_id) in snap.live.items() if room_id in problem.room_index
+    }
+    return problem, current
+
+
+def run_scenario(changes, mode='reschedule', time_limit=None):
+    """
+    Apply ``changes`` to the snapshot and place the sessions in memory:
+    ``"evaluate"`` keeps the live sessions as they are, ``"reschedule"``
+    re-places only those the changes break, ``"full"`` solves from scratch
+    like ``generate_timetable``. Returns ``(report, sessions, version)``:
+    the report of what differs from the live timetable, the placed sessions
+    as ``[course_id, week_start, week_end, room_id]`` lists and the
+    timetable version they were solved against.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {', '.join(MODES)}")
+    snap = snapshot()
+    problem, current = scenario_problem(snap, changes)
+    broken = violations(problem, current)
+    if mode == 'evaluate':
+        assignment = current
+    elif mode == 'reschedule':
+        affected = {c for c, _ in broken} | {c for c in range(len(problem.courses)) if c not in current}
+        assignment = reschedule(problem, current, affected, _budget(None, time_limit, None)[1]).assignment
+    else:
+        backend, time_limit, workers = _budget(None, time_limit, None)
+        assignment = solve(problem, backend, time_limit, workers, weights=scheduler_weights()).assignment
+
+    weights = scheduler_weights()
+    moved = []
+    for c, course in enumerate(problem.courses):
+        before = snap.live.get(c)
+        after = assignment.get(c)
+        after = None if after is None else (after[0], problem.rooms[after[1]].id)
+        if before != after:
+            moved.append({'course': course.code, 'from': snap.describe(c, before), 'to': snap.describe(c, after)})
+    report = {
+        'version': snap.version,
+        'mode': mode,
+        'placed': len(assignment),
+        'unscheduled': [course.code for c, course in enumerate(problem.courses) if c not in assignment],
+        'broken': [{'course': problem.courses[c].code, 'error': reason} for c, reason in broken],
+        'changed': moved,
+        'objectives': {
+            'live': Evaluator(problem, current, weights).breakdown(),
+            'scenario': Evaluator(problem, assignment, weights).breakdown(),
+        },
+    }
+    sessions = [
+        [problem.courses[c].id, *problem.slot_times[slot], problem.rooms[r].id] for c, (slot, r) in sorted(assignment.items())
+    ]
+    return report, sessions, snap.version
+
+
+def create_scenario(name, changes, mode='reschedule', time_limit=None):
+    """Run a scenario and save it, report and sessions included."""
+    report, sessions, version = run_scenario(changes, mode, time_limit)
+    return Scenario.objects.create(
+        name=name, changes=changes, mode=mode, base_version=version, sessions=sessions, report=report,
+    )
+
+
+def promote_scenario(scenario):
+    """
+    Make a scenario live: write its data changes (course sizes and
+    lecturers, new lecturers, availability) and its sessions in one
+    transaction. Closed rooms are only left out of the timetable.
+
+    Raises StaleScenario when the timetable changed since the scenario was
+    solved or a generation job is running, and ValueError when it was
+    already promoted or its sessions no longer fit the data.
+    """
+    with transaction.atomic():
+        scenario = Scenario.objects.select_for_update().get(pk=scenario.pk)
+        if scenario.promoted_at is not None:
+            raise ValueError("The scenario was already promoted")
+        if ScheduleJob.objects.filter(active_lock=LOCK).exists():
+            raise StaleScenario("A timetable generation job is running")
+        if current_version() != scenario.base_version:
+            raise StaleScenario("The timetable changed since the scenario was solved; run it again")
+
+        for change in scenario.changes:
+            op = change['op']
+            if op == 'resize_course':
+                Course.objects.filter(id=change['course']).update(students=int(change['students']))
+            elif op == 'assign_lecturer':
+                Course.objects.filter(id__in=change['courses']).update(lecturer_id=change['lecturer'])
+            elif op == 'add_lecturer':
+                if User.objects.filter(reg_no=change['reg_no']).exists():
+                    raise ValueError(f"A user {change['reg_no']} already exists")
+                lecturer = User.objects.create(
+                    reg_no=change['reg_no'], name=change['name'], role='lecturer',
+                    password=UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20),
+                    available_days=','.join(change.get('available_days', [])),
+                    preferred_days=','.join(change.get('preferred_days', [])),
+                    max_hours_per_week=change.get('max_hours_per_week'),
+                )
+                Course.objects.filter(id__in=change['courses']).update(lecturer_id=lecturer.id)
+            elif op == 'lecturer_days':
+                User.objects.filter(id=change['lecturer']).update(available_days=','.join(change['available_days']))
+
+        # Re-read the data with the changes written, and check the sessions against it
+        problem = load_problem()
+        current, rows, extra = load_timetable(problem)
+        course_index = {course.id: c for c, course in enumerate(problem.courses)}
+        slot_index = {interval: i for i, interval in enumerate(problem.slot_times)}
+        assignment = {}
+        for course_id, week_start, week_end, room_id in scenario.sessions:
+            c, slot, r = course_index.get(course_id), slot_index.get((week_start, week_end)), problem.room_index.get(room_id)
+            if c is None or slot is None or r is None:
+                raise ValueError("The scenario's courses, rooms or slots no longer exist; run it again")
+            assignment[c] = (slot, r)
+        broken = violations(problem, assignment)
+        if broken:
+            c, reason = broken[0]
+            raise ValueError(f"{problem.courses[c].code}: {reason}; run the scenario again")
+
+        solution = Solution(problem, assignment, 'scenario')
+        publish(solution, current, rows, extra + [row_id for c, row_id in rows.items() if c not in assignment])
+        scenario.promoted_at = timezone.now()
+        scenario.save(update_fields=['promoted_at'])
+    return solution
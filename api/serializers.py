@@ -1,5 +1,9 @@
+from datetime import time
+
 from rest_framework import serializers
-from .models import User, Timetable, Attendance, Course, Room
+from .objectives import OBJECTIVES
+from .slots import WEEK, week_minute
+from .models import SCENARIO_MODES, Timetable, Attendance, ScheduleJob, Scenario
 
 class LoginSerializer(serializers.Serializer):
     reg_no = serializers.CharField()
@@ -11,11 +15,120 @@ class TimetableSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Timetable
-        fields = ['id', 'course', 'day', 'start_time', 'end_time', 'room', 'is_canceled']
+        fields = ['id', 'course', 'day', 'start_time', 'end_time', 'week_start', 'week_end', 'room', 'is_canceled']
 
 class AttendanceSerializer(serializers.ModelSerializer):
     timetable = TimetableSerializer()
 
     class Meta:
         model = Attendance
-        fields = ['id', 'timetable', 'attended', 'timestamp']
\ No newline at end of file
+        fields = ['id', 'timetable', 'attended', 'timestamp']
+
+class BulkAttendanceSerializer(serializers.Serializer):
+    # [{"timetable_id": 1, "user_id": 2}, ...]; checked by hand rather than with
+    # a nested serializer per record, which is far too slow for large batches
+    records = serializers.ListField(child=serializers.JSONField(), allow_empty=False, max_length=10000)
+    date = serializers.DateField(required=False, allow_null=True, default=None)  # Of the occurrence, today if not given
+
+    def validate_records(self, value):
+        records = []
+        for record in value:
+            try:
+                user = record.get('user_id')
+                records.append((int(record['timetable_id']), None if user is None else int(user)))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                raise serializers.ValidationError("Each record needs an integer timetable_id and an optional integer user_id")
+        return records
+
+class CancelClassSerializer(serializers.Serializer):
+    # With a date, only that week's occurrence is canceled
+    date = serializers.DateField(required=False, allow_null=True, default=None)
+
+class CalendarSerializer(serializers.Serializer):
+    # Dates of the occurrences to list, inclusive; a week from today by default
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+class MoveSerializer(serializers.Serializer):
+    timetable_id = serializers.IntegerField()
+    day = serializers.ChoiceField(choices=WEEK)
+    start_time = serializers.TimeField()
+    room_id = serializers.IntegerField(required=False, allow_null=True, default=None)
+
+class EvaluateSerializer(serializers.Serializer):
+    # Proposed moves of live sessions, and weights overriding SCHEDULER_WEIGHTS
+    moves = MoveSerializer(many=True, required=False, default=list, max_length=5000)
+    weights = serializers.DictField(child=serializers.FloatField(min_value=0), required=False, default=dict)
+
+    def validate_weights(self, value):
+        unknown = set(value) - set(OBJECTIVES)
+        if unknown:
+            raise serializers.ValidationError(f"Unknown objectives: {', '.join(sorted(unknown))}")
+        return value
+
+class EditSerializer(serializers.Serializer):
+    # A change to session timetable_id, or a new session when it is null;
+    # fields left out keep the session's value
+    timetable_id = serializers.IntegerField(required=False, allow_null=True, default=None)
+    course_id = serializers.IntegerField(required=False)
+    day = serializers.ChoiceField(choices=WEEK, required=False)
+    start_time = serializers.TimeField(required=False)
+    end_time = serializers.TimeField(required=False)
+    room_id = serializers.IntegerField(required=False, allow_null=True)
+
+class ValidateTimetableSerializer(serializers.Serializer):
+    # Proposed edits and deletions, checked together; neither checks the live timetable
+    edits = EditSerializer(many=True, required=False, default=list, max_length=5000)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list, max_length=5000)
+
+class ScheduleJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ScheduleJob
+        fields = ['id', 'status', 'incremental', 'affected', 'progress', 'placed', 'total', 'backend',
+                  'unscheduled', 'error', 'created_at', 'started_at', 'finished_at']
+
+class NewScenarioSerializer(serializers.Serializer):
+    # Changes are checked against the snapshot by api.scenarios
+    name = serializers.CharField(max_length=100)
+    changes = serializers.ListField(child=serializers.DictField(), max_length=1000)
+    mode = serializers.ChoiceField(choices=SCENARIO_MODES, default='reschedule')
+
+class ScenarioSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Scenario
+        fields = ['id', 'name', 'changes', 'mode', 'base_version', 'report', 'created_at', 'promoted_at']
+
+class FreeRoomSearchSerializer(serializers.Serializer):
+    # One span as day/start_time/end_time, or any number as
+    # slot=Thursday 14:00-17:00; rooms must be free in all of them
+    day = serializers.ChoiceField(choices=WEEK, required=False)
+    start_time = serializers.TimeField(required=False)
+    end_time = serializers.TimeField(required=False)
+    slot = serializers.ListField(child=serializers.CharField(), required=False, max_length=50)
+    capacity = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=50)
+
+    def validate(self, data):
+        spans = []
+        given = [data.get(name) is not None for name in ('day', 'start_time', 'end_time')]
+        if any(given):
+            if not all(given):
+                raise serializers.ValidationError("Give day, start_time and end_time together")
+            spans.append((data['day'], data['start_time'], data['end_time']))
+        for slot in data.get('slot', []):
+            day, _, times = slot.strip().partition(' ')
+            start, _, end = times.partition('-')
+            try:
+                if day not in WEEK:
+                    raise ValueError(day)
+                spans.append((day, time.fromisoformat(start.strip()), time.fromisoformat(end.strip())))
+            except ValueError:
+                raise serializers.ValidationError(f"Slots look like 'Thursday 14:00-17:00', not {slot!r}")
+        if not spans:
+            raise serializers.ValidationError("Give a day, start_time and end_time, or slots")
+        data['spans'] = []
+        for day, start, end in spans:
+            if end <= start:
+                raise serializers.ValidationError("A slot must end after it starts")
+            data['spans'].append((week_minute(day, start), week_minute(day, end)))
+        return data
@@ -0,0 +1,58 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import forget_user
+from .changes import record_changes
+from .models import Course, Enrolment, Room, StudentAttendanceStats, Timetable, User
+from .timetable_cache import invalidate_timetable
+
+
+# Timetable documents embed course and room names, so edits to either expire
+# them, as do enrolment changes for student documents. Bulk writes do not send
+# signals; the scheduler invalidates after publishing.
+@receiver([post_save, post_delete], sender=Enrolment)
+@receiver([post_save, post_delete], sender=Course)
+@receiver([post_save, post_delete], sender=Room)
+def timetable_changed(sender, **kwargs):
+    invalidate_timetable()
+
+
+# Session edits also go to the change feed, in one transaction with the
+# version bump so the log keeps commit order (see api.changes)
+@receiver(post_save, sender=Timetable)
+def session_saved(sender, instance, created, **kwargs):
+    action = 'created' if created else 'canceled' if instance.is_canceled else 'updated'
+    with transaction.atomic():
+        invalidate_timetable()
+        record_changes(saved={instance.id: action})
+
+
+@receiver(post_delete, sender=Timetable)
+def session_deleted(sender, instance, **kwargs):
+    with transaction.atomic():
+        invalidate_timetable()
+        record_changes(deleted={instance.id: instance.course_id})
+
+
+# Enrolled students get an (empty) attendance rollup straight away, so a
+# student who never checks in still shows up in low-attendance alerts.
+@receiver(post_save, sender=Enrolment)
+def enrolment_saved(sender, instance, created, **kwargs):
+    if created:
+        StudentAttendanceStats.objects.get_or_create(user_id=instance.user_id, course_id=instance.course_id)
+
+
+@receiver(post_delete, sender=Enrolment)
+def enrolment_deleted(sender, instance, **kwargs):
+    StudentAttendanceStats.objects.filter(user_id=instance.user_id, course_id=instance.course_id, attended=0).delete()
+
+
+# A user's role is cached for session lookups; drop it when the user changes.
+# Lecturers' days and hours feed the scheduler, so what-if snapshots and other
+# caches keyed on the timetable version expire with them
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    forget_user(instance.id)
+    if instance.role == 'lecturer':
+        invalidate_timetable()
@@ -0,0 +1,109 @@
+"""
+Week time as integers.
+
+A point in the week is its number of minutes since Monday 00:00, so a session
+is a half-open ``[start, end)`` pair of ints and two sessions overlap when
+``a_start < b_end and b_start < a_end``. The scheduler cuts the teaching week
+into fixed cells; a slot of any length is then a bitmask of the cells it
+covers, which is what ``api.solver`` works on.
+
+Like the solver, this module does not import Django.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import time
+
+WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DAYS = WEEK[:5]  # Teaching days
+TEACHING_HOURS = [(9 * 60, 12 * 60), (13 * 60, 16 * 60)]  # Minutes after midnight; a session stays within one
+CELL_MINUTES = 60
+SESSION_MINUTES = 180  # Default session length
+MAX_SESSION_MINUTES = max(last - first for first, last in TEACHING_HOURS)  # Longer sessions fit no slot
+
+MINUTES_PER_DAY = 24 * 60
+_DAY_INDEX = {day: i for i, day in enumerate(WEEK)}
+
+
+def week_minute(day, at):
+    """Minutes from Monday 00:00 to ``at`` (a ``datetime.time``) on ``day``."""
+    return _DAY_INDEX[day] * MINUTES_PER_DAY + at.hour * 60 + at.minute
+
+
+def day_and_time(minute):
+    """Inverse of ``week_minute``: ``(day, time)``."""
+    day, minute = divmod(minute, MINUTES_PER_DAY)
+    return WEEK[day], time(*divmod(minute, 60))
+
+
+def overlaps(a_start, a_end, b_start, b_end):
+    return a_start < b_end and b_start < a_end
+
+
+class SlotGrid:
+    """The teaching week cut into cells, and the slots each session length can take."""
+
+    def __init__(self, days=DAYS, hours=TEACHING_HOURS, cell=CELL_MINUTES):
+        self.days = list(days)
+        self.hours = list(hours)
+        self.cell = cell
+        starts = [
+            _DAY_INDEX[day] * MINUTES_PER_DAY + minute
+            for day in self.days for first, last in self.hours for minute in range(first, last, cell)
+        ]
+        self.cell_index = {start: i for i, start in enumerate(starts)}
+
+    def slots(self, minutes):
+        """``(start, end)`` of every cell-aligned slot of ``minutes`` (rounded up to whole cells)."""
+        length = -(-minutes // self.cell) * self.cell
+        return [
+            (_DAY_INDEX[day] * MINUTES_PER_DAY + start, _DAY_INDEX[day] * MINUTES_PER_DAY + start + length)
+            for day in self.days for first, last in self.hours for start in range(first, last - length + 1, self.cell)
+        ]
+
+    def mask(self, start, end):
+        """Bitmask of the cells covered by ``[start, end)``."""
+        mask = 0
+        for minute in range(start, end, self.cell):
+            mask |= 1 << self.cell_index[minute]
+        return mask
+
+
+class IntervalIndex:
+    """
+    Half-open ``[start, end)`` intervals, each with a key, answering "what
+    overlaps this?".
+
+    Intervals are kept sorted by start. Nothing longer than the longest one
+    can start before ``start - longest`` and still reach ``start``, so a query
+    only looks at one bisected run of the list: O(log n + k) for sessions of
+    similar length.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.items = []  # (start, end, key), parallel to starts
+        self.longest = 0
+        for start, end, key in intervals:
+            self.add(start, end, key)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, start, end, key):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.items.insert(i, (start, end, key))
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, start, end, key):
+        for i in range(bisect_left(self.starts, start), bisect_right(self.starts, start)):
+            if self.items[i] == (start, end, key):
+                del self.starts[i]
+                del self.items[i]
+                return
+        raise ValueError(f"No interval {(start, end, key)}")
+
+    def overlapping(self, start, end):
+        """Keys of the intervals that overlap ``[start, end)``, in start order."""
+        first = bisect_right(self.starts, start - self.longest)
+        last = bisect_left(self.starts, end)
+        return [key for _, item_end, key in self.items[first:last] if item_end > start]
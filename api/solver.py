@@ -0,0 +1,723 @@
+"""
+Timetable solver backends.
+
+This module knows nothing about Django: it works on a ``Problem`` made of plain
+tuples and integer bitmasks, which keeps it cheap to build, to copy and to ship
+to other processes. ``api.ai_scheduler`` loads the problem from the database
+and writes the solution back.
+
+Each candidate slot covers a set of time cells (``Problem.slot_masks``). Two
+sessions clash when they share a room, a lecturer or a student and their cell
+masks intersect, so every clash check is an integer AND.
+"""
+import itertools
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+
+from .objectives import Evaluator
+
+try:
+    from ortools.sat.python import cp_model
+except ImportError:  # OR-Tools is optional, the greedy engine covers its absence
+    cp_model = None
+
+# How many greedy placements between two progress reports
+PROGRESS_EVERY = 500
+# Most passes over all courses the soft-objective local search makes
+IMPROVE_PASSES = 5
+# How far a seeded greedy pass may reorder courses: each course's domain size
+# is scaled by a random factor in [1, 1 + ORDER_NOISE)
+ORDER_NOISE = 0.5
+
+# slots: bitmask of allowed slot indices (lecturer availability); preferred:
+# bitmask of the slots on the lecturer's preferred days, None for no preference
+CourseSpec = namedtuple('CourseSpec', 'id code lecturer_id size room_id slots preferred', defaults=(None,))
+RoomSpec = namedtuple('RoomSpec', 'id capacity')
+
+
+class Problem:
+    def __init__(self, courses, rooms, slot_masks, groups=(), slot_times=(), lecturer_limits=None, group_sizes=()):
+        self.courses = courses
+        # Student clash groups: lists of course indices that share a student
+        # and so must not overlap. course_groups maps a course to its groups.
+        self.groups = [list(group) for group in groups]
+        self.group_sizes = list(group_sizes) or [1] * len(self.groups)  # Students in each group
+        self.lecturer_limits = lecturer_limits or {}  # lecturer id -> most teaching minutes a week
+        self.course_groups = [[] for _ in courses]
+        for g, group in enumerate(self.groups):
+            for c in group:
+                self.course_groups[c].append(g)
+        # Smallest rooms first, so "lowest free room index" is also the best fit
+        self.rooms = sorted(rooms, key=lambda r: (r.capacity, r.id))
+        self.room_index = {room.id: i for i, room in enumerate(self.rooms)}
+        self.capacities = [room.capacity for room in self.rooms]
+        self.slot_masks = slot_masks
+        self.slot_times = list(slot_times)  # Optional (start, end) of each slot, for the caller
+        self.slot_cells = [bits(mask) for mask in slot_masks]
+        self.n_cells = max((mask.bit_length() for mask in slot_masks), default=0)
+
+    def fitting_rooms(self, course):
+        # Room bitset of every room large enough for the course: rooms are
+        # sorted by capacity, so that is every index from the first fit up
+        first = bisect_left(self.capacities, course.size)
+        return ((1 << len(self.rooms)) - 1) >> first << first
+
+
+class Solution:
+    def __init__(self, problem, assignment, backend, optimal=False):
+        self.problem = problem
+        self.assignment = assignment  # course index -> (slot index, room index)
+        self.backend = backend
+        self.optimal = optimal
+        self.changed = []  # course ids whose live session was created or moved when published
+        self.conflicts = []  # Hard-constraint breaches of those sessions, found when published (see api.validation)
+        # How the search went: model size, iterations, timings; see solve()
+        self.stats = {}
+
+    @property
+    def sessions(self):
+        # (course_id, slot index, room_id) for every placed course
+        rooms = self.problem.rooms
+        courses = self.problem.courses
+        return [(courses[c].id, slot, rooms[r].id) for c, (slot, r) in sorted(self.assignment.items())]
+
+    @property
+    def unscheduled(self):
+        return [course.code for i, course in enumerate(self.problem.courses) if i not in self.assignment]
+
+    @property
+    def ok(self):
+        return len(self.assignment) == len(self.problem.courses)
+
+
+def bits(mask):
+    # Indices of the set bits of mask, lowest first
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(low.bit_length() - 1)
+        mask ^= low
+    return out
+
+
+class _State:
+    """Occupancy of a partial assignment, shared by the greedy and local search."""
+
+    def __init__(self, problem):
+        self.problem = problem
+        self.room_busy = [0] * len(problem.rooms)  # room x cell bitsets
+        self.free_rooms = [(1 << len(problem.rooms)) - 1] * problem.n_cells  # cell x room bitsets
+        self.lecturer_busy = defaultdict(int)  # lecturer x cell bitsets
+        self.group_busy = [0] * len(problem.groups)  # student group x cell bitsets
+        self.occupant = {}  # (room index, cell) -> course index
+        self.cell_usage = [0] * problem.n_cells
+        self.slot_rank = range(len(problem.slot_masks))  # Tie-break between equally used slots
+        self.assignment = {}
+
+    def rooms_free_for(self, slot):
+        free = (1 << len(self.problem.rooms)) - 1
+        for cell in self.problem.slot_cells[slot]:
+            free &= self.free_rooms[cell]
+        return free
+
+    def people_free(self, c, slot):
+        # Neither the lecturer nor any student of course c is busy during slot
+        mask = self.problem.slot_masks[slot]
+        if self.lecturer_busy[self.problem.courses[c].lecturer_id] & mask:
+            return False
+        return not any(self.group_busy[g] & mask for g in self.problem.course_groups[c])
+
+    def place(self, c, slot, r):
+        course = self.problem.courses[c]
+        mask = self.problem.slot_masks[slot]
+        self.room_busy[r] |= mask
+        self.lecturer_busy[course.lecturer_id] |= mask
+        for g in self.problem.course_groups[c]:
+            self.group_busy[g] |= mask
+        for cell in self.problem.slot_cells[slot]:
+            self.free_rooms[cell] &= ~(1 << r)
+            self.occupant[r, cell] = c
+            self.cell_usage[cell] += 1
+        self.assignment[c] = (slot, r)
+
+    def remove(self, c):
+        slot, r = self.assignment.pop(c)
+        course = self.problem.courses[c]
+        mask = self.problem.slot_masks[slot]
+        self.room_busy[r] &= ~mask
+        self.lecturer_busy[course.lecturer_id] &= ~mask
+        for g in self.problem.course_groups[c]:
+            self.group_busy[g] &= ~mask
+        for cell in self.problem.slot_cells[slot]:
+            self.free_rooms[cell] |= 1 << r
+            del self.occupant[r, cell]
+            self.cell_usage[cell] -= 1
+
+    def fits(self, c, slot, r, fitting):
+        # Whether course c can take (slot, r) given everything placed so far
+        course = self.problem.courses[c]
+        return (
+            course.slots >> slot & 1
+            and fitting >> r & 1
+            and self.people_free(c, slot)
+            and not self.room_busy[r] & self.problem.slot_masks[slot]
+        )
+
+    def nearest_move(self, c, fitting, old):
+        # Closest feasible spot to the old (slot, room): same slot in another
+        # room, then the same room at another time, then anything.
+        slot, r = old
+        course = self.problem.courses[c]
+        if course.slots >> slot & 1 and self.people_free(c, slot):
+            free = self.rooms_free_for(slot) & fitting
+            if free:
+                return slot, (free & -free).bit_length() - 1
+        if fitting >> r & 1:
+            for other in sorted(bits(course.slots), key=lambda s: (self.slot_load(s), self.slot_rank[s])):
+                if self.fits(c, other, r, fitting):
+                    return other, r
+        return self.best_move(c, fitting)
+
+    def slot_load(self, slot):
+        return sum(self.cell_usage[cell] for cell in self.problem.slot_cells[slot])
+
+    def best_move(self, c, fitting):
+        # First feasible (slot, room) for course c, least used slots first
+        course = self.problem.courses[c]
+        candidates = sorted(bits(course.slots), key=lambda s: (self.slot_load(s), self.slot_rank[s]))
+        preferred = self.problem.room_index.get(course.room_id)
+        for slot in candidates:
+            if not self.people_free(c, slot):
+                continue
+            free = self.rooms_free_for(slot) & fitting
+            if not free:
+                continue
+            if preferred is not None and free >> preferred & 1:
+                return slot, preferred
+            return slot, (free & -free).bit_length() - 1
+        return None
+
+
+def greedy(problem, deadline=None, progress=None, seed=None):
+    """
+    Place courses one at a time, most constrained first, then repair.
+
+    With a ``seed`` the course order is shaken (see ``ORDER_NOISE``) and
+    equally used slots are tried in a shuffled order, so each seed explores a
+    different timetable; the same seed gives the same one.
+    """
+    started = time.monotonic()
+    state = _State(problem)
+    fitting = [problem.fitting_rooms(course) for course in problem.courses]
+    shake = [1.0] * len(problem.courses)
+    if seed is not None:
+        rng = random.Random(seed)
+        shake = [1 + ORDER_NOISE * rng.random() for _ in problem.courses]
+        state.slot_rank = rng.sample(range(len(problem.slot_masks)), len(problem.slot_masks))
+
+    # Most-constrained first: smallest slot x room domain, then the busiest
+    # lecturers, whose courses all compete for the same slots.
+    load = Counter(course.lecturer_id for course in problem.courses)
+    order = sorted(
+        range(len(problem.courses)),
+        key=lambda c: (
+            bin(problem.courses[c].slots).count('1') * bin(fitting[c]).count('1') * shake[c],
+            -load[problem.courses[c].lecturer_id],
+            problem.courses[c].id,
+        ),
+    )
+    unplaced = []
+    for done, c in enumerate(order, 1):
+        move = state.best_move(c, fitting[c])
+        if move is None:
+            unplaced.append(c)
+        else:
+            state.place(c, *move)
+        if progress is not None and done % PROGRESS_EVERY == 0:
+            progress(len(state.assignment), done / len(order))
+
+    moves = _repair(state, unplaced, fitting, deadline) if unplaced else 0
+    if progress is not None:
+        progress(len(state.assignment), 1.0)
+    solution = Solution(problem, state.assignment, 'greedy')
+    solution.stats = _stats(solution, started, iterations=len(order) + moves)
+    return solution
+
+
+def reschedule(problem, current, affected, time_limit=None, progress=None):
+    """
+    Re-place only the ``affected`` courses around the live timetable.
+
+    ``current`` maps course index -> (slot, room index) for the sessions that
+    are live now. Unaffected sessions stay exactly where they are; affected
+    ones keep their spot when it is still valid and otherwise move to the
+    nearest feasible one. The local search may move one unaffected session per
+    course it cannot otherwise place.
+    """
+    started = time.monotonic()
+    deadline = started + time_limit if time_limit is not None else None
+    state = _State(problem)
+    fitting = [problem.fitting_rooms(course) for course in problem.courses]
+    for c, (slot, r) in current.items():
+        if c not in affected:
+            state.place(c, slot, r)
+
+    order = sorted(affected, key=lambda c: (bin(problem.courses[c].slots).count('1') * bin(fitting[c]).count('1'), c))
+    unplaced = []
+    for c in order:
+        old = current.get(c)
+        if old is not None and state.fits(c, *old, fitting[c]):
+            move = old
+        elif old is not None:
+            move = state.nearest_move(c, fitting[c], old)
+        else:
+            move = state.best_move(c, fitting[c])
+        if move is None:
+            unplaced.append(c)
+        else:
+            state.place(c, *move)
+
+    moves = _repair(state, unplaced, fitting, deadline) if unplaced else 0
+    if progress is not None:
+        progress(len(state.assignment), 1.0)
+    solution = Solution(problem, state.assignment, 'incremental')
+    solution.stats = _stats(solution, started, iterations=len(order) + moves)
+    solution.stats['first_feasible_s'] = solution.stats['seconds']
+    return solution
+
+
+def _repair(state, unplaced, fitting, deadline):
+    # Local search: free a (slot, room) for each unplaced course by moving the
+    # one session blocking it somewhere else in that session's own domain.
+    # Returns the number of moves tried.
+    problem = state.problem
+    free_by_slot = None
+    tried = 0
+    for c in unplaced:
+        if deadline is not None and time.monotonic() > deadline:
+            return tried
+        if free_by_slot is None:
+            # Recomputed only after a successful move; until then every
+            # blocker found stuck stays stuck.
+            free_by_slot = [state.rooms_free_for(slot) for slot in range(len(problem.slot_masks))]
+            open_domains = {}  # (fitting rooms, slots) -> any free fitting room in those slots
+            stuck = set()
+        course = problem.courses[c]
+        placed = False
+        for slot in bits(course.slots):
+            if placed or not state.people_free(c, slot):
+                continue
+            for r in bits(fitting[c]):
+                blockers = {state.occupant.get((r, cell)) for cell in problem.slot_cells[slot]}
+                blockers.discard(None)
+                if len(blockers) != 1:
+                    continue
+                d = blockers.pop()
+                if d in stuck:
+                    continue
+                key = (fitting[d], problem.courses[d].slots)
+                if key not in open_domains:
+                    open_domains[key] = any(free_by_slot[s] & key[0] for s in bits(key[1]))
+                if not open_domains[key]:
+                    stuck.add(d)
+                    continue
+                tried += 1
+                old = state.assignment[d]
+                state.remove(d)
+                state.place(c, slot, r)  # reserve the spot before relocating d
+                move = state.best_move(d, fitting[d])
+                if move is not None:
+                    state.place(d, *move)
+                    placed = True
+                    break
+                state.remove(c)
+                state.place(d, *old)
+                stuck.add(d)
+        if placed:
+            free_by_slot = None
+    return tried
+
+
+def _stats(solution, started, **extra):
+    problem = solution.problem
+    return {
+        'courses': len(problem.courses),
+        'rooms': len(problem.rooms),
+        'slots': len(problem.slot_masks),
+        'groups': len(problem.groups),
+        'placed': len(solution.assignment),
+        'unplaced': len(problem.courses) - len(solution.assignment),
+        'seconds': time.monotonic() - started,
+        **extra,
+    }
+
+
+def improve(solution, weights=None, deadline=None, seed=None, bound=None):
+    """
+    Lower the soft objectives of ``solution`` (see ``api.objectives``) by
+    local search, keeping every placed course placed and every hard
+    constraint met.
+
+    Each pass moves every course, in index order (an order shuffled by
+    ``seed`` when given), to the spot that lowers the weighted total most:
+    one of its slots, in the smallest free room that fits (its preferred room
+    when free). Passes repeat until none helps, for at most
+    ``IMPROVE_PASSES`` passes or until ``deadline``; unless the deadline cuts
+    it short, the result only depends on the input and the seed.
+
+    ``bound()``, when given, returns a weighted total to beat: the search
+    gives up after a pass that leaves its total at or above it, and the
+    result's stats say ``pruned``.
+    """
+    started = time.monotonic()
+    problem = solution.problem
+    state = _State(problem)
+    for c, (slot, r) in solution.assignment.items():
+        state.place(c, slot, r)
+    evaluator = Evaluator(problem, solution.assignment, weights)
+    fitting = [problem.fitting_rooms(course) for course in problem.courses]
+    before = evaluator.total()
+
+    rng = random.Random(seed) if seed is not None else None
+    moves = passes = 0
+    improved, pruned = True, False
+    while improved and passes < IMPROVE_PASSES and not pruned:
+        improved = False
+        passes += 1
+        order = sorted(state.assignment)
+        if rng is not None:
+            rng.shuffle(order)
+        for c in order:
+            if deadline is not None and time.monotonic() > deadline:
+                break
+            course = problem.courses[c]
+            preferred = problem.room_index.get(course.room_id)
+            old = state.assignment[c]
+            state.remove(c)
+            best, best_delta = old, -1e-9
+            for slot in bits(course.slots):
+                if not state.people_free(c, slot):
+                    continue
+                free = state.rooms_free_for(slot) & fitting[c]
+                if not free:
+                    continue
+                r = preferred if preferred is not None and free >> preferred & 1 else (free & -free).bit_length() - 1
+                if (slot, r) == old:
+                    continue
+                delta = evaluator.delta(c, (slot, r))
+                if delta < best_delta:
+                    best, best_delta = (slot, r), delta
+            state.place(c, *best)
+            if best != old:
+                evaluator.move(c, best)
+                moves += 1
+                improved = True
+        pruned = bound is not None and evaluator.total() >= bound()
+
+    improved_solution = Solution(problem, state.assignment, solution.backend, optimal=solution.optimal)
+    improved_solution.stats = {
+        **solution.stats,
+        'objective_before': before,
+        'objective': evaluator.total(),
+        'improve_moves': moves,
+        'improve_passes': passes,
+        'improve_s': time.monotonic() - started,
+        'pruned': pruned,
+    }
+    return improved_solution
+
+
+# What each multi-start worker process runs against; set once per process by
+# _init_starts so the problem is shipped once, not with every start
+_start_context = {}
+
+
+def _init_starts(problem, weights, deadline, best_placed, best_objective):
+    _start_context.update(problem=problem, weights=weights, deadline=deadline, best_placed=best_placed,
+                          best_objective=best_objective)
+
+
+def _run_start(seed):
+    # One start of multistart(): a seeded greedy pass, then the soft-objective
+    # search unless another start has already placed more courses, given up
+    # once a pass leaves it no better than a finished start placing as many.
+    # Returns (assignment, stats), or None for a start that cannot win.
+    problem, weights, deadline = (_start_context[key] for key in ('problem', 'weights', 'deadline'))
+    best_placed, best_objective = _start_context['best_placed'], _start_context['best_objective']
+    solution = greedy(problem, deadline, seed=seed)
+    solution.stats['first_feasible_s'] = solution.stats['seconds']
+    placed = len(solution.assignment)
+    with best_placed.get_lock():  # Guards best_objective too
+        if placed < best_placed.value:
+            return None
+        if placed > best_placed.value:
+            best_placed.value = placed
+            best_objective.value = float('inf')
+    if weights is None:
+        return solution.assignment, solution.stats
+
+    def bound():
+        return best_objective.value if best_placed.value == placed else float('-inf')
+
+    solution = improve(solution, weights, deadline, seed, bound)
+    if solution.stats['pruned']:
+        return None
+    with best_placed.get_lock():
+        if placed == best_placed.value:
+            best_objective.value = min(best_objective.value, solution.stats['objective'])
+    return solution.assignment, solution.stats
+
+
+def multistart(problem, starts, weights=None, seed=0, workers=None, deadline=None, progress=None):
+    """
+    Run ``starts`` independent greedy searches, each improved on ``weights``,
+    over up to ``workers`` processes, and keep the best: the most courses
+    placed, then the lowest weighted score, then the earliest start.
+
+    The first start is the plain greedy pass and start ``i`` is seeded with
+    ``seed + i``. The workers share the most courses placed so far and the
+    lowest weighted score of a finished start placing as many: a start that
+    places fewer skips its local search, and one whose score a pass of that
+    search leaves no lower than the best is given up, so extra starts rarely
+    cost a full search each. In one process, when ``deadline`` cuts no start
+    short, the result depends only on the problem, ``starts`` and ``seed``;
+    over several, which starts are given up depends on their timing, though
+    never the number of courses placed.
+    """
+    started = time.monotonic()
+    seeds = [None] + [seed + i for i in range(1, starts)]
+    workers = max(1, min(workers or 1, starts))
+    best_placed = multiprocessing.Value('i', -1)
+    best_objective = multiprocessing.Value('d', float('inf'), lock=False)
+    results = []
+    if workers == 1:
+        _init_starts(problem, weights, deadline, best_placed, best_objective)
+        try:
+            for done, start_seed in enumerate(seeds, 1):
+                results.append(_run_start(start_seed))
+                if progress is not None:
+                    progress(best_placed.value, done / starts)
+        finally:
+            _start_context.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_starts,
+                                 initargs=(problem, weights, deadline, best_placed, best_objective)) as pool:
+            # map() yields in submission order, so results line up with seeds
+            for done, result in enumerate(pool.map(_run_start, seeds), 1):
+                results.append(result)
+                if progress is not None:
+                    progress(best_placed.value, done / starts)
+
+    def rank(i):
+        assignment, stats = results[i]
+        return -len(assignment), stats.get('objective', 0), i
+
+    winner = min((i for i, result in enumerate(results) if result is not None), key=rank)
+    assignment, stats = results[winner]
+    solution = Solution(problem, assignment, 'greedy')
+    solution.stats = {
+        **stats,
+        'seconds': time.monotonic() - started,
+        'iterations': sum(result[1]['iterations'] for result in results if result is not None),
+        'starts': starts,
+        'start_workers': workers,
+        'best_start': winner,
+        'pruned_starts': sum(result is None for result in results),
+    }
+    return solution
+
+
+def violations(problem, assignment):
+    """
+    Hard-constraint breaches of an assignment, as ``(course index, reason)``
+    in course order: each course is checked against those before it.
+    """
+    state = _State(problem)
+    found = []
+    for c, (slot, r) in sorted(assignment.items()):
+        course = problem.courses[c]
+        mask = problem.slot_masks[slot]
+        if not course.slots >> slot & 1:
+            found.append((c, "lecturer not available"))
+        if problem.capacities[r] < course.size:
+            found.append((c, "room too small"))
+        if state.room_busy[r] & mask:
+            found.append((c, "room taken"))
+        if state.lecturer_busy[course.lecturer_id] & mask:
+            found.append((c, "lecturer double-booked"))
+        if any(state.group_busy[g] & mask for g in problem.course_groups[c]):
+            found.append((c, "students double-booked"))
+        # Record the session even when it clashes, without the occupancy bookkeeping place() needs
+        state.room_busy[r] |= mask
+        state.lecturer_busy[course.lecturer_id] |= mask
+        for g in problem.course_groups[c]:
+            state.group_busy[g] |= mask
+    return found
+
+
+def cpsat(problem, time_limit=None, workers=None, hint=None, max_classes_per_course=6, progress=None):
+    """
+    Solve with OR-Tools CP-SAT, maximising the number of placed courses.
+
+    Rooms with the same capacity are interchangeable, so the model picks a
+    capacity class per course and slot rather than a concrete room, and caps
+    each class's concurrent sessions at its number of rooms. Classes that are
+    too small and slots outside the lecturer's availability are pruned before
+    the model is built, and each course only sees its
+    ``max_classes_per_course`` best-fitting classes. Concrete rooms are handed
+    out afterwards.
+    """
+    started = time.monotonic()
+    classes = sorted({room.capacity for room in problem.rooms})
+    class_size = Counter(room.capacity for room in problem.rooms)
+    hinted = {}
+    if hint is not None:
+        hinted = {c: (slot, problem.rooms[r].capacity) for c, (slot, r) in hint.assignment.items()}
+
+    model = cp_model.CpModel()
+    by_course = defaultdict(list)
+    by_class_cell = defaultdict(list)
+    by_lecturer_cell = defaultdict(list)
+    by_group_cell = defaultdict(list)
+    variables = {}
+    for c, course in enumerate(problem.courses):
+        fitting = [k for k in classes if k >= course.size][:max_classes_per_course]
+        if c in hinted and hinted[c][1] not in fitting:
+            fitting.append(hinted[c][1])
+        for slot in bits(course.slots):
+            for k in fitting:
+                var = model.new_bool_var('')
+                variables[c, slot, k] = var
+                by_course[c].append(var)
+                for cell in problem.slot_cells[slot]:
+                    by_class_cell[k, cell].append(var)
+                    by_lecturer_cell[course.lecturer_id, cell].append(var)
+                    for g in problem.course_groups[c]:
+                        by_group_cell[g, cell].append(var)
+
+    for group_vars in by_course.values():
+        model.add_at_most_one(group_vars)
+    for group_vars in itertools.chain(by_lecturer_cell.values(), by_group_cell.values()):
+        if len(group_vars) > 1:
+            model.add_at_most_one(group_vars)
+    for (k, _), group_vars in by_class_cell.items():
+        if len(group_vars) > class_size[k]:
+            model.add(cp_model.LinearExpr.Sum(group_vars) <= class_size[k])
+    model.maximize(cp_model.LinearExpr.Sum(list(variables.values())))
+
+    if hint is not None:
+        for key, var in variables.items():
+            model.add_hint(var, hinted.get(key[0]) == key[1:])
+
+    solver = cp_model.CpSolver()
+    if time_limit is not None:
+        solver.parameters.max_time_in_seconds = time_limit
+    if workers:
+        solver.parameters.num_workers = workers
+    # Symmetry detection on the interchangeable class variables costs far more
+    # than it saves on these models
+    solver.parameters.symmetry_level = 0
+    callback = _SolutionCallback(len(by_course), progress)
+    status = solver.solve(model, callback)
+    if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+        return None
+
+    # Hand out concrete rooms: within a class every room fits, and the class
+    # constraint guarantees enough of them are free in every cell.
+    chosen = [(c, slot, k) for (c, slot, k), var in variables.items() if solver.boolean_value(var)]
+    chosen.sort(key=lambda item: (problem.slot_masks[item[1]] & -problem.slot_masks[item[1]], item[0]))
+    class_rooms = defaultdict(int)
+    for i, room in enumerate(problem.rooms):
+        class_rooms[room.capacity] |= 1 << i
+    state = _State(problem)
+    for c, slot, k in chosen:
+        free = state.rooms_free_for(slot) & class_rooms[k]
+        preferred = problem.room_index.get(problem.courses[c].room_id)
+        if preferred is not None and free >> preferred & 1:
+            state.place(c, slot, preferred)
+        elif free:
+            state.place(c, slot, (free & -free).bit_length() - 1)
+    solution = Solution(problem, state.assignment, 'cpsat', optimal=status == cp_model.OPTIMAL)
+    solution.stats = _stats(
+        solution, started, iterations=solver.num_branches, variables=len(variables),
+        constraints=len(model.proto.constraints), conflicts=solver.num_conflicts,
+        first_feasible_s=None if callback.first is None else callback.first - started,
+    )
+    return solution
+
+
+class _SolutionCallback(cp_model.CpSolverSolutionCallback if cp_model else object):
+    # Reports each improving solution. The LP bound on "placed courses" is
+    # weak, so also stop as soon as every course that has a variable is
+    # placed instead of spending the budget proving it.
+    def __init__(self, placeable, progress=None):
+        super().__init__()
+        self.placeable = placeable
+        self.progress = progress
+        self.first = None  # monotonic time of the first solution
+
+    def on_solution_callback(self):
+        if self.first is None:
+            self.first = time.monotonic()
+        placed = int(self.objective_value)
+        if self.progress is not None:
+            self.progress(placed, 1.0 if placed >= self.placeable else None)
+        if placed >= self.placeable:
+            self.stop_search()
+
+
+def solve(problem, backend='auto', time_limit=None, workers=None, progress=None, weights=None, starts=1, seed=0,
+          start_workers=None):
+    """
+    Solve ``problem`` within ``time_limit`` seconds of wall-clock time.
+
+    ``backend`` is ``"greedy"``, ``"cpsat"`` or ``"auto"``. The greedy engine
+    always runs first and its result seeds CP-SAT as a hint. ``"auto"`` only
+    calls CP-SAT when OR-Tools is installed and greedy left courses unplaced.
+
+    ``progress(placed, fraction)`` is called as the search goes, with the
+    number of courses placed in the best solution so far and the fraction of
+    the work done (``None`` when the solver cannot tell).
+
+    The returned solution's ``stats`` give the model size, ``placed`` and
+    ``unplaced`` courses, ``iterations`` (greedy placements and repair moves,
+    plus CP-SAT branches), ``seconds`` and ``first_feasible_s``, the time to
+    the first clash-free assignment: the greedy pass.
+
+    With ``weights`` (an ``api.objectives.Weights``) the placed timetable is
+    then improved on the soft objectives by ``improve``, within the same time
+    limit. With ``starts`` above one, the greedy pass and that improvement
+    run as ``multistart`` searches seeded from ``seed`` over
+    ``start_workers`` processes (none: in this one), and the best seeds
+    CP-SAT. ``workers`` only sets CP-SAT's search threads.
+    """
+    started = time.monotonic()
+    deadline = started + time_limit if time_limit is not None else None
+    if backend == 'cpsat' and cp_model is None:
+        raise ImportError("The 'cpsat' backend needs OR-Tools: pip install ortools")
+
+    if starts > 1:
+        solution = multistart(problem, starts, weights, seed, start_workers, deadline, progress)
+        if backend == 'greedy' or cp_model is None or (backend == 'auto' and solution.ok):
+            return solution
+    else:
+        solution = greedy(problem, deadline, progress)
+        solution.stats['first_feasible_s'] = solution.stats['seconds']
+        if backend == 'greedy' or cp_model is None or (backend == 'auto' and solution.ok):
+            return solution if weights is None else improve(solution, weights, deadline)
+
+    remaining = None if deadline is None else max(deadline - time.monotonic(), 0.1)
+    improved = cpsat(problem, time_limit=remaining, workers=workers, hint=solution, progress=progress)
+    best = improved if improved is not None and len(improved.assignment) >= len(solution.assignment) else solution
+    cpsat_stats = improved.stats if improved is not None else {}
+    best.stats = {
+        **_stats(best, started),
+        'iterations': solution.stats['iterations'] + cpsat_stats.get('iterations', 0),
+        'first_feasible_s': solution.stats['first_feasible_s'],
+        **{f'cpsat_{key}': cpsat_stats[key] for key in ('variables', 'constraints', 'conflicts') if key in cpsat_stats},
+    }
+    return best if weights is None else improve(best, weights, deadline)
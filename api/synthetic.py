@@ -0,0 +1,113 @@
+"""
+Synthetic universities for benchmarks and load tests.
+
+``populate`` fills the models with rooms, lecturers, courses, students and
+enrolments drawn from a seeded ``random.Random``, so the same arguments give
+the same university. Students belong to programmes (blocks of courses) and
+take their courses from their programme, which keeps the number of student
+clash groups close to what a real timetable sees.
+
+``tightness`` (0 to 1) sets how hard the timetable is to place: at 0
+lecturers can teach every day and the biggest rooms are half as big again as
+the largest class; at 1 lecturers have two days each and only one room is
+sure to fit the largest class.
+"""
+import random
+
+from django.db import transaction
+
+from .analytics import rebuild_rollups
+from .hashers import TunablePBKDF2PasswordHasher
+from .models import Course, Enrolment, Room, User
+from .slots import DAYS, SESSION_MINUTES
+
+# Sizes of the preset universities benchmarks run at
+SCALES = {
+    'tiny': {'rooms': 4, 'lecturers': 6, 'courses': 12, 'students': 60},
+    'small': {'rooms': 15, 'lecturers': 25, 'courses': 60, 'students': 1000},
+    'medium': {'rooms': 40, 'lecturers': 80, 'courses': 200, 'students': 5000},
+    'large': {'rooms': 120, 'lecturers': 250, 'courses': 600, 'students': 20000},
+}
+
+PASSWORD = 'synthetic'  # Every synthetic user's password
+
+
+def populate(rooms, lecturers, courses, students, courses_per_student=4, tightness=0.5, seed=0,
+             session_minutes=(SESSION_MINUTES,), password_iterations=None):
+    """
+    Write a synthetic university to the database; returns the row counts.
+
+    Every user gets the password ``PASSWORD``, hashed once with
+    ``password_iterations`` (default: the login hasher's) and shared, so
+    populating stays fast at any size while logins cost what they do in
+    production.
+    """
+    if lecturers < 1:
+        raise ValueError("A university needs at least one lecturer")
+    with transaction.atomic():
+        return _populate(random.Random(seed), rooms, lecturers, courses, students, courses_per_student, tightness,
+                         session_minutes, password_iterations)
+
+
+def _populate(rng, rooms, lecturers, courses, students, courses_per_student, tightness, session_minutes,
+              password_iterations):
+    hasher = TunablePBKDF2PasswordHasher()
+    password = hasher.encode(PASSWORD, hasher.salt(), password_iterations or hasher.iterations)
+
+    days_each = round(len(DAYS) - (len(DAYS) - 2) * tightness)
+    lecturer_rows = User.objects.bulk_create([
+        User(reg_no=f"L{i:05}", name=f"Lecturer {i}", role='lecturer', password=password,
+             available_days=_some_days(rng, days_each))
+        for i in range(lecturers)
+    ], batch_size=1000)
+
+    # Programmes of twice a student's load, so classmates share some courses but not all
+    programme_size = min(courses, courses_per_student * 2)
+    programmes = [list(range(start, min(start + programme_size, courses))) for start in range(0, courses, programme_size)]
+    taking = [rng.sample(programme, min(courses_per_student, len(programme)))
+              for programme in (rng.choice(programmes) for _ in range(students))]
+    sizes = [0] * courses
+    for course_indices in taking:
+        for c in course_indices:
+            sizes[c] += 1
+
+    largest = max(sizes, default=0) or 1
+    headroom = 1.5 - 0.5 * tightness
+    room_rows = Room.objects.bulk_create([
+        Room(name=f"Room {i:04}", capacity=max(1, round(rng.uniform(0.3, 1.0) * largest * headroom)))
+        for i in range(rooms)
+    ], batch_size=1000)
+    # At least one room takes the largest class, so every course can be placed somewhere
+    if room_rows:
+        Room.objects.filter(id=room_rows[0].id).update(capacity=max(room_rows[0].capacity, largest))
+
+    course_rows = Course.objects.bulk_create([
+        Course(code=f"SYN{i:05}", name=f"Course {i}", lecturer=lecturer_rows[i % lecturers],
+               students=sizes[i], session_minutes=rng.choice(session_minutes))
+        for i in range(courses)
+    ], batch_size=1000)
+
+    created_students = enrolments = 0
+    for start in range(0, students, 2000):
+        batch = User.objects.bulk_create([
+            User(reg_no=f"S{i:07}", name=f"Student {i}", role='student', password=password)
+            for i in range(start, min(start + 2000, students))
+        ])
+        created_students += len(batch)
+        created = Enrolment.objects.bulk_create([
+            Enrolment(user_id=user.id, course_id=course_rows[c].id)
+            for user, i in zip(batch, range(start, students)) for c in taking[i]
+        ], batch_size=2000)
+        enrolments += len(created)
+
+    # Bulk inserts send no signals: give every enrolment its rollup row
+    rebuild_rollups()
+    return {
+        'rooms': len(room_rows), 'lecturers': len(lecturer_rows), 'courses': len(course_rows),
+        'students': created_students, 'enrolments': enrolments,
+    }
+
+
+def _some_days(rng, count):
+    chosen = set(rng.sample(DAYS, count))
+    return ','.join(day for day in DAYS if day in chosen)
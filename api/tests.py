@@ -1,3 +1,1867 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import date, time, timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import solver
+from .admin import RoomAdmin, TimetableAdmin, TimetableAdminForm
+from .analytics import low_attendance, rebuild_rollups, streaks, student_stats
+from .ai_scheduler import generate_timetable, reschedule_affected
+from .attendance import CheckinBuffer, record_checkins
+from .auth import cached_role, issue_feed_token, issue_token
+from .changes import broker
+from .benchmarks import compare, run_scale
+from .exports import _ical_line
+from .importer import import_stream
+from .jobs import run_worker, submit_generation
+from .metrics import Registry
+from .models import (Attendance, Course, Enrolment, Holiday, Room, ScheduleJob, SessionAttendanceStats, SessionOccurrence,
+                     StudentAttendanceStats, Term, Timetable, TimetableChange, User)
+from .objectives import Evaluator, Weights
+from .occupancy import OccupancyIndex, clear_occupancy
+from .occurrences import TermCalendar, cancel_occurrence, expand
+from .routing import sync_replica
+from .scenarios import StaleScenario, clear_snapshot, create_scenario, promote_scenario, run_scenario
+from .serializers import TimetableSerializer
+from .slots import DAYS, MINUTES_PER_DAY, SESSION_MINUTES, IntervalIndex, SlotGrid, day_and_time, overlaps, week_minute
+from .solver import CourseSpec, Problem, RoomSpec
+from .synthetic import populate
+from .timetable_cache import bump_version, current_version, timetable_etag
+from .validation import validate_edits, validate_timetable
+
+
+def make_lecturer(reg_no):
+    return User.objects.create(reg_no=reg_no, name=reg_no, role='lecturer', password='x')
+
+
+class SessionLoginMixin:
+    def login(self, user):
+        # Logs both clients in, so sync and async responses can be compared
+        session = self.client.session
+        session['user_id'] = user.id
+        session.save()
+        self.async_client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+
+class GenerateTimetableTests(TestCase):
+    def setUp(self):
+        self.rooms = [Room.objects.create(name=f"Room {i}", capacity=50) for i in range(3)]
+        self.lecturers = [make_lecturer(f"L{i}") for i in range(4)]
+
+    def add_courses(self, count):
+        for i in range(count):
+            Course.objects.create(code=f"C{i:03}", name=f"Course {i}", lecturer=self.lecturers[i % len(self.lecturers)])
+
+    def test_places_every_course_without_clashes(self):
+        self.add_courses(20)
+        result = generate_timetable()
+
+        self.assertTrue(result.ok)
+        rows = list(Timetable.objects.select_related('course'))
+        self.assertEqual(len(rows), 20)
+        room_slots = {(t.room_id, t.day, t.start_time) for t in rows}
+        self.assertEqual(len(room_slots), 20)
+        lecturer_slots = {(t.course.lecturer_id, t.day, t.start_time) for t in rows}
+        self.assertEqual(len(lecturer_slots), 20)
+
+    @override_settings(SCHEDULER_STARTS=3)
+    def test_starts_run_in_process_unless_a_pool_is_configured(self):
+        self.add_courses(10)
+        with mock.patch('api.solver.ProcessPoolExecutor') as pool:
+            result = generate_timetable(backend='greedy')
+        pool.assert_not_called()
+        self.assertEqual((result.stats['starts'], result.stats['start_workers']), (3, 1))
+
+    def test_reports_unschedulable_courses_instead_of_looping(self):
+        capacity = len(self.rooms) * len(SlotGrid().slots(SESSION_MINUTES))
+        self.add_courses(capacity + 5)
+        result = generate_timetable()
+
+        self.assertFalse(result.ok)
+        self.assertEqual(len(result.unscheduled), 5)
+        self.assertEqual(Timetable.objects.count(), capacity)
+
+    def test_query_count_does_not_grow_with_courses(self):
+        self.add_courses(30)
+        # load rooms, lecturers, courses, enrolments and sessions, then insert,
+        # bump the version, log the new rows and check them inside the transaction
+        with self.assertNumQueries(12):
+            generate_timetable()
+
+    def test_prefers_the_course_room(self):
+        lecturer = self.lecturers[0]
+        course = Course.objects.create(code="PREF", name="Pref", lecturer=lecturer, room=self.rooms[2])
+        generate_timetable()
+        self.assertEqual(Timetable.objects.get(course=course).room, self.rooms[2])
+
+    def test_respects_capacity_and_lecturer_availability(self):
+        big = Room.objects.create(name="Hall", capacity=300)
+        lecturer = make_lecturer("PT")
+        lecturer.available_days = "Tuesday,Thursday"
+        lecturer.save()
+        course = Course.objects.create(code="BIG", name="Big", lecturer=lecturer, students=250)
+
+        generate_timetable()
+        row = Timetable.objects.get(course=course)
+        self.assertEqual(row.room, big)
+        self.assertIn(row.day, ("Tuesday", "Thursday"))
+
+    def test_students_never_have_two_sessions_at_once(self):
+        self.add_courses(12)
+        courses = list(Course.objects.order_by('id'))
+        for s in range(6):
+            student = User.objects.create(reg_no=f"S{s}", name=f"S{s}", role='student', password='x')
+            for course in courses[s:s + 4]:
+                Enrolment.objects.create(user=student, course=course)
+
+        self.assertTrue(generate_timetable(backend='greedy').ok)
+        for student in User.objects.filter(role='student'):
+            slots = list(Timetable.objects.filter(course__enrolments__user=student).values_list('day', 'start_time'))
+            self.assertEqual(len(slots), len(set(slots)))
+
+    def test_enrolment_counts_toward_class_size(self):
+        Room.objects.create(name="Hall", capacity=80)
+        course = Course.objects.create(code="POP", name="Popular", lecturer=self.lecturers[0], students=10)
+        for s in range(60):
+            student = User.objects.create(reg_no=f"S{s}", name=f"S{s}", role='student', password='x')
+            Enrolment.objects.create(user=student, course=course)
+        generate_timetable(backend='greedy')
+        self.assertEqual(Timetable.objects.get(course=course).room.name, "Hall")
+
+    def test_course_larger_than_every_room_is_unscheduled(self):
+        Course.objects.create(code="HUGE", name="Huge", lecturer=self.lecturers[0], students=1000)
+        result = generate_timetable(backend='greedy')
+        self.assertEqual(result.unscheduled, ["HUGE"])
+
+    def test_full_run_keeps_the_history_of_unplaced_and_surplus_sessions(self):
+        course = Course.objects.create(code="C0", name="Course", lecturer=self.lecturers[0], students=10)
+        student = User.objects.create(reg_no="S0", name="S0", role='student', password='x')
+        first = Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12), room=self.rooms[0])
+        surplus = Timetable.objects.create(course=course, day="Tuesday", start_time=time(9), end_time=time(12), room=self.rooms[0])
+        bare = Timetable.objects.create(course=course, day="Wednesday", start_time=time(9), end_time=time(12), room=self.rooms[0])
+        Attendance.objects.create(timetable=first, user=student)
+        Attendance.objects.create(timetable=surplus, user=student)
+        course.students = 1000
+        course.save()
+
+        result = generate_timetable(backend='greedy')
+
+        self.assertEqual(result.unscheduled, ["C0"])
+        self.assertEqual(Attendance.objects.count(), 2)
+        self.assertEqual(dict(Timetable.objects.values_list('id', 'room_id')), {first.id: None, surplus.id: None})
+        self.assertFalse(Timetable.objects.filter(id=bare.id).exists())
+
+    def test_sessions_of_different_lengths_never_overlap(self):
+        # One room, one day: a three-hour and three one-hour sessions per lecturer
+        self.rooms[1].delete()
+        self.rooms[2].delete()
+        for lecturer in self.lecturers:
+            lecturer.available_days = "Monday"
+            lecturer.save()
+        Course.objects.create(code="LONG", name="Long", lecturer=self.lecturers[0], session_minutes=180)
+        for i in range(3):
+            Course.objects.create(code=f"S{i}", name=f"Short {i}", lecturer=self.lecturers[i + 1], session_minutes=60)
+        result = generate_timetable()
+
+        self.assertTrue(result.ok)
+        rows = sorted(Timetable.objects.values_list('week_start', 'week_end'))
+        self.assertEqual(sum(end - start for start, end in rows), 6 * 60)
+        for (_, end), (start, _) in zip(rows, rows[1:]):
+            self.assertLessEqual(end, start)
+
+    def test_overlapping_live_session_is_replaced(self):
+        course = Course.objects.create(code="C0", name="Course", lecturer=self.lecturers[0], session_minutes=60)
+        other = Course.objects.create(code="C1", name="Other", lecturer=self.lecturers[1], session_minutes=180)
+        Timetable.objects.create(course=other, day="Monday", start_time=time(9), end_time=time(12), room=self.rooms[0])
+        # Starts at a different time, so the (room, day, start_time) constraint lets it through
+        Timetable.objects.create(course=course, day="Monday", start_time=time(10), end_time=time(11), room=self.rooms[0])
+        generate_timetable(incremental=True)
+
+        sessions = {t.course_id: t for t in Timetable.objects.all()}
+        self.assertEqual((sessions[other.id].week_start, sessions[other.id].room_id), (week_minute("Monday", time(9)), self.rooms[0].id))
+        moved = sessions[course.id]
+        self.assertFalse(moved.room_id == self.rooms[0].id and overlaps(moved.week_start, moved.week_end, 9 * 60, 12 * 60))
+
+
+class SlotTests(TestCase):
+    def test_week_minutes_round_trip(self):
+        self.assertEqual(week_minute("Monday", time(0)), 0)
+        self.assertEqual(week_minute("Tuesday", time(9, 30)), 24 * 60 + 9 * 60 + 30)
+        self.assertEqual(day_and_time(week_minute("Friday", time(13, 15))), ("Friday", time(13, 15)))
+
+    def test_grid_slots_stay_within_teaching_windows(self):
+        grid = SlotGrid()
+        self.assertEqual(len(grid.slots(180)), 2 * len(DAYS))
+        self.assertEqual(len(grid.slots(60)), 6 * len(DAYS))
+        self.assertEqual(len(grid.slots(90)), 4 * len(DAYS))  # rounded up to two cells
+        long, short = grid.slots(180)[0], grid.slots(60)[1]
+        self.assertTrue(grid.mask(*long) & grid.mask(*short))
+        self.assertFalse(grid.mask(*long) & grid.mask(*grid.slots(180)[1]))
+
+    def test_interval_index_finds_overlaps(self):
+        index = IntervalIndex([(0, 60, 'a'), (60, 240, 'b'), (300, 310, 'c')])
+        self.assertEqual(index.overlapping(30, 90), ['a', 'b'])
+        self.assertEqual(index.overlapping(240, 300), [])
+        self.assertEqual(index.overlapping(200, 301), ['b', 'c'])
+        index.remove(60, 240, 'b')
+        self.assertEqual(index.overlapping(200, 301), ['c'])
+        with self.assertRaises(ValueError):
+            index.remove(60, 240, 'b')
+
+    def test_timetable_keeps_week_minutes_and_rejects_overlaps(self):
+        room = Room.objects.create(name="Room 1", capacity=50)
+        course = Course.objects.create(code="C0", name="Course", lecturer=make_lecturer("L0"))
+        session = Timetable.objects.create(course=course, day="Tuesday", start_time=time(9), end_time=time(12), room=room)
+        self.assertEqual((session.week_start, session.week_end), (week_minute("Tuesday", time(9)), week_minute("Tuesday", time(12))))
+        session.start_time = time(10)
+        session.save(update_fields=['start_time'])
+        session.refresh_from_db()
+        self.assertEqual(session.week_start, week_minute("Tuesday", time(10)))
+
+        clash = Timetable(course=course, day="Tuesday", start_time=time(11), end_time=time(13), room=room)
+        with self.assertRaises(ValidationError):
+            clash.full_clean()
+        Timetable(course=course, day="Tuesday", start_time=time(12), end_time=time(13), room=room).full_clean()
+
+
+def grid_problem(n_courses, n_rooms, n_slots, lecturers=1, size=10):
+    courses = [CourseSpec(i, f"C{i}", i % lecturers, size, None, (1 << n_slots) - 1) for i in range(n_courses)]
+    rooms = [RoomSpec(i, 50) for i in range(n_rooms)]
+    return Problem(courses, rooms, [1 << s for s in range(n_slots)])
+
+
+def assert_feasible(test, problem, solution):
+    seen_rooms, seen_lecturers = set(), set()
+    for c, (slot, r) in solution.assignment.items():
+        course = problem.courses[c]
+        test.assertTrue(course.slots >> slot & 1)
+        test.assertGreaterEqual(problem.rooms[r].capacity, course.size)
+        test.assertNotIn((r, slot), seen_rooms)
+        test.assertNotIn((course.lecturer_id, slot), seen_lecturers)
+        seen_rooms.add((r, slot))
+        seen_lecturers.add((course.lecturer_id, slot))
+
+
+class SolverTests(TestCase):
+    def test_greedy_places_most_constrained_course_first(self):
+        # C1 only fits slot 0, so it must be placed before C0 takes it
+        courses = [
+            CourseSpec(0, "C0", 0, 10, None, 0b11),
+            CourseSpec(1, "C1", 1, 10, None, 0b01),
+        ]
+        problem = Problem(courses, [RoomSpec(0, 50)], [0b01, 0b10])
+        solution = solver.greedy(problem)
+        self.assertTrue(solution.ok)
+        self.assertEqual(solution.assignment[1], (0, 0))
+
+    def test_repair_moves_blocking_session(self):
+        problem = grid_problem(2, 1, 2, lecturers=2)
+        state = solver._State(problem)
+        state.place(0, 0, 0)
+        fitting = [problem.fitting_rooms(c) for c in problem.courses]
+        problem.courses[1] = problem.courses[1]._replace(slots=0b01)
+        solver._repair(state, [1], fitting, None)
+        self.assertEqual(state.assignment, {1: (0, 0), 0: (1, 0)})
+
+    def test_shared_students_block_the_same_slot(self):
+        courses = [CourseSpec(i, f"C{i}", i, 10, None, 0b01) for i in range(3)]
+        problem = Problem(courses, [RoomSpec(i, 50) for i in range(3)], [0b01, 0b10], groups=[(0, 1)])
+        solution = solver.greedy(problem)
+        self.assertEqual(len(solution.unscheduled), 1)
+        self.assertIn(2, solution.assignment)
+
+    @skipIf(solver.cp_model is None, "OR-Tools is not installed")
+    def test_cpsat_respects_student_groups(self):
+        courses = [CourseSpec(i, f"C{i}", i, 10, None, 0b11) for i in range(4)]
+        problem = Problem(courses, [RoomSpec(i, 50) for i in range(4)], [0b01, 0b10], groups=[(0, 1), (2, 3)])
+        solution = solver.cpsat(problem, time_limit=5, workers=1)
+        self.assertTrue(solution.ok)
+        self.assertNotEqual(solution.assignment[0][0], solution.assignment[1][0])
+        self.assertNotEqual(solution.assignment[2][0], solution.assignment[3][0])
+
+    def test_greedy_is_deterministic(self):
+        problem = grid_problem(40, 3, 10, lecturers=6)
+        self.assertEqual(solver.greedy(problem).assignment, solver.greedy(problem).assignment)
+
+    def test_seeded_greedy_is_reproducible(self):
+        problem = grid_problem(40, 3, 10, lecturers=6)
+        self.assertEqual(solver.greedy(problem, seed=7).assignment, solver.greedy(problem, seed=7).assignment)
+        self.assertNotEqual(solver.greedy(problem, seed=7).assignment, solver.greedy(problem).assignment)
+
+    def test_multistart_keeps_the_best_start_whatever_the_workers(self):
+        courses = [CourseSpec(i, f"C{i}", i % 5, 10 + 3 * i, None, (1 << 8) - 1 if i % 3 else 0b1111) for i in range(30)]
+        problem = Problem(courses, [RoomSpec(i, 40 + 40 * i) for i in range(3)], [1 << s for s in range(8)],
+                          groups=[(0, 1, 2), (3, 4, 5), (6, 7)])
+        single = solver.improve(solver.greedy(problem), Weights())
+        solution = solver.multistart(problem, 4, Weights(), seed=1)
+        self.assertEqual(solution.stats['starts'], 4)
+        self.assertGreaterEqual(len(solution.assignment), len(single.assignment))
+        if len(solution.assignment) == len(single.assignment):
+            self.assertLessEqual(solution.stats['objective'], single.stats['objective'])
+        assert_feasible(self, problem, solution)
+        self.assertEqual(solver.multistart(problem, 4, Weights(), seed=1).assignment, solution.assignment)
+        # Which starts are given up depends on timing across processes, not the courses placed
+        parallel = solver.multistart(problem, 4, Weights(), seed=1, workers=2)
+        self.assertEqual(len(parallel.assignment), len(solution.assignment))
+        assert_feasible(self, problem, parallel)
+        self.assertEqual(parallel.stats['start_workers'], 2)
+
+    def test_starts_behind_the_best_score_are_given_up(self):
+        problem = grid_problem(40, 3, 10, lecturers=6)
+        start = solver.greedy(problem)
+        full = solver.improve(start, Weights())
+        self.assertFalse(full.stats['pruned'])
+        pruned = solver.improve(start, Weights(), bound=lambda: full.stats['objective_before'] - 1e9)
+        self.assertEqual((pruned.stats['pruned'], pruned.stats['improve_passes']), (True, 1))
+
+        solution = solver.multistart(problem, 6, Weights(), seed=1)
+        self.assertGreater(solution.stats['pruned_starts'], 0)
+
+    def test_over_capacity_reports_unscheduled(self):
+        problem = grid_problem(12, 1, 10, lecturers=12)
+        solution = solver.solve(problem, backend='greedy')
+        self.assertEqual(len(solution.unscheduled), 2)
+        assert_feasible(self, problem, solution)
+
+    def test_auto_falls_back_to_greedy_without_ortools(self):
+        problem = grid_problem(12, 1, 10, lecturers=12)
+        with mock.patch.object(solver, 'cp_model', None):
+            solution = solver.solve(problem, backend='auto')
+        self.assertEqual(solution.backend, 'greedy')
+
+    @skipIf(solver.cp_model is None, "OR-Tools is not installed")
+    def test_cpsat_backend_finds_feasible_solution(self):
+        problem = grid_problem(30, 3, 10, lecturers=4)
+        solution = solver.solve(problem, backend='cpsat', time_limit=5, workers=2)
+        self.assertTrue(solution.ok)
+        assert_feasible(self, problem, solution)
+
+
+class IncrementalScheduleTests(TestCase):
+    def setUp(self):
+        self.rooms = [Room.objects.create(name=f"Room {i}", capacity=50) for i in range(3)]
+        self.lecturers = [make_lecturer(f"L{i}") for i in range(4)]
+        for i in range(20):
+            Course.objects.create(code=f"C{i:03}", name=f"Course {i}", lecturer=self.lecturers[i % 4], students=20)
+        generate_timetable(backend='greedy')
+        self.before = {t.id: (t.course_id, t.day, t.start_time, t.room_id) for t in Timetable.objects.all()}
+
+    def test_regeneration_keeps_rows_and_attendance(self):
+        student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        session = Timetable.objects.first()
+        Attendance.objects.create(timetable=session, user=student, attended=True)
+
+        generate_timetable(backend='greedy')
+        self.assertEqual(set(Timetable.objects.values_list('id', flat=True)), set(self.before))
+        self.assertTrue(Attendance.objects.filter(timetable=session).exists())
+
+    def test_new_course_touches_one_row(self):
+        course = Course.objects.create(code="NEW", name="New", lecturer=self.lecturers[0], students=10)
+        result = reschedule_affected(courses=[course.id])
+
+        self.assertEqual(result.changed, [course.id])
+        after = {t.id: (t.course_id, t.day, t.start_time, t.room_id) for t in Timetable.objects.exclude(course=course)}
+        self.assertEqual(after, self.before)
+        self.assertTrue(Timetable.objects.filter(course=course).exists())
+
+    def test_shrunk_room_moves_only_its_sessions(self):
+        room = self.rooms[0]
+        room.capacity = 5
+        room.save()
+        in_room = set(Timetable.objects.filter(room=room).values_list('course_id', flat=True))
+
+        result = reschedule_affected(rooms=[room.id])
+        self.assertTrue(result.ok)
+        self.assertEqual(set(result.changed), in_room)
+        self.assertFalse(Timetable.objects.filter(room=room).exists())
+        for row_id, (course_id, day, start_time, room_id) in self.before.items():
+            if course_id not in in_room:
+                self.assertEqual(Timetable.objects.get(id=row_id).room_id, room_id)
+
+    def test_moved_session_keeps_its_row(self):
+        lecturer = self.lecturers[1]
+        session = Timetable.objects.filter(course__lecturer=lecturer).first()
+        other_days = [day for day in DAYS if day != session.day]
+        lecturer.available_days = ",".join(other_days)
+        lecturer.save()
+
+        reschedule_affected(lecturers=[lecturer.id])
+        session.refresh_from_db()
+        self.assertIn(session.day, other_days)
+        self.assertFalse(Timetable.objects.filter(course__lecturer=lecturer, day__in=[d for d in DAYS if d not in other_days]).exists())
+
+    def test_unplaceable_course_is_reported_and_keeps_row(self):
+        session = Timetable.objects.first()
+        Course.objects.filter(id=session.course_id).update(students=500)
+
+        result = reschedule_affected(courses=[session.course_id])
+        self.assertFalse(result.ok)
+        session.refresh_from_db()
+        self.assertIsNone(session.room)
+
+    def test_incremental_generation_keeps_valid_sessions(self):
+        result = generate_timetable(incremental=True)
+        self.assertEqual(result.changed, [])
+
+
+@override_settings(SCHEDULER_JOB_RUNNER='inline')
+class ScheduleJobTests(TestCase):
+    def setUp(self):
+        Room.objects.create(name="Room", capacity=50)
+        lecturer = make_lecturer("L0")
+        for i in range(5):
+            Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=lecturer)
+        self.client.force_login(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+
+    def test_generate_endpoint_returns_finished_job(self):
+        response = self.client.post('/api/generate-timetable/')
+        self.assertEqual(response.status_code, 202)
+        job = ScheduleJob.objects.get(id=response.data['id'])
+        self.assertEqual(job.status, 'done')
+        self.assertIsNone(job.active_lock)
+        self.assertEqual((job.placed, job.total), (5, 5))
+        self.assertEqual(Timetable.objects.count(), 5)
+
+        response = self.client.get(f'/api/generate-timetable/{job.id}/')
+        self.assertEqual(response.data['status'], 'done')
+
+    def test_generation_is_staff_only_and_post_only(self):
+        self.assertEqual(self.client.get('/api/generate-timetable/').status_code, 405)
+        job = ScheduleJob.objects.create(status='done')
+        self.client.logout()
+        self.assertEqual(self.client.post('/api/generate-timetable/').status_code, 403)
+        self.assertEqual(self.client.get(f'/api/generate-timetable/{job.id}/').status_code, 401)
+        self.assertFalse(ScheduleJob.objects.exclude(id=job.id).exists())
+
+    def test_admin_edits_reschedule_through_the_job_lock(self):
+        room = Room.objects.get()
+        generate_timetable()
+        Course.objects.update(students=10)
+        model_admin = RoomAdmin(Room, admin.site)
+        request = RequestFactory().post('/')
+        room.capacity = 5
+        with mock.patch.object(model_admin, 'message_user') as message:
+            model_admin.save_model(request, room, mock.Mock(changed_data=['capacity']), True)
+        job = ScheduleJob.objects.get()
+        self.assertEqual((job.status, job.affected, job.placed), ('done', {'rooms': [room.id]}, 0))
+        self.assertIn("need a room", message.call_args.args[1])
+        self.assertFalse(Timetable.objects.filter(room__isnull=False).exists())
+
+        # While a generation holds the lock the edit is saved but nothing is re-placed
+        with override_settings(SCHEDULER_JOB_RUNNER='worker'):
+            running, _ = submit_generation()
+        room.capacity = 50
+        with mock.patch.object(model_admin, 'message_user') as message:
+            model_admin.save_model(request, room, mock.Mock(changed_data=['capacity']), True)
+        self.assertEqual(ScheduleJob.objects.count(), 2)
+        self.assertIn(f"in progress (job {running.id})", message.call_args.args[1])
+        self.assertFalse(Timetable.objects.filter(room__isnull=False).exists())
+
+    @override_settings(SCHEDULER_JOB_RUNNER='worker')
+    def test_second_trigger_returns_the_active_job(self):
+        first, created = submit_generation()
+        self.assertTrue(created)
+        second, created = submit_generation()
+        self.assertFalse(created)
+        self.assertEqual(first.id, second.id)
+
+        response = self.client.post('/api/generate-timetable/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['id'], first.id)
+
+    @override_settings(SCHEDULER_JOB_RUNNER='worker')
+    def test_worker_runs_queued_job_and_releases_lock(self):
+        job, _ = submit_generation()
+        self.assertFalse(Timetable.objects.exists())
+        run_worker(once=True)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(Timetable.objects.count(), 5)
+        _, created = submit_generation()
+        self.assertTrue(created)
+
+    @override_settings(SCHEDULER_JOB_RUNNER='worker', SCHEDULER_JOB_TIMEOUT=60)
+    def test_stale_job_releases_lock(self):
+        job, _ = submit_generation()
+        ScheduleJob.objects.filter(id=job.id).update(status='running', updated_at=timezone.now() - timedelta(hours=1))
+
+        _, created = submit_generation()
+        self.assertTrue(created)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_failed_job_records_error(self):
+        with mock.patch('api.jobs.generate_timetable', side_effect=RuntimeError("boom")), \
+                self.assertLogs('api.jobs', level='ERROR'):
+            job, _ = submit_generation()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, "boom")
+        self.assertIsNone(job.active_lock)
+
+
+class TimetableViewTests(SessionLoginMixin, TestCase):
+    def setUp(self):
+        caches['timetable'].clear()
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.lecturer = make_lecturer("L0")
+        other = make_lecturer("L1")
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        for i in range(10):
+            course = Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=self.lecturer if i < 4 else other)
+            Timetable.objects.create(course=course, day="Monday", start_time=time(8 + i), end_time=time(9 + i), room=room)
+            if i % 2 == 0:
+                Enrolment.objects.create(user=self.student, course=course)
+
+    def test_payload_matches_serializer(self):
+        self.login(self.student)
+        response = self.client.get('/api/timetable/')
+        expected = TimetableSerializer(Timetable.objects.filter(course__enrolments__user=self.student).order_by('id'), many=True).data
+        self.assertEqual(response.json(), [dict(row) for row in expected])
+
+    def test_student_sees_only_enrolled_courses(self):
+        self.login(self.student)
+        response = self.client.get('/api/timetable/')
+        self.assertEqual([row['course'] for row in response.json()], [f"C{i} - Course {i}" for i in range(0, 10, 2)])
+
+        Enrolment.objects.create(user=self.student, course=Course.objects.get(code="C1"))
+        response = self.client.get('/api/timetable/')
+        self.assertEqual(len(response.json()), 6)
+
+    def test_lecturer_sees_own_sessions(self):
+        self.login(self.lecturer)
+        response = self.client.get('/api/timetable/')
+        self.assertEqual([row['course'] for row in response.json()], [f"C{i} - Course {i}" for i in range(4)])
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.login(self.student)
+        # session + role + version + one joined timetable query
+        with self.assertNumQueries(4):
+            self.client.get('/api/timetable/')
+        # rendered document and role are cached: session + version
+        with self.assertNumQueries(2):
+            self.client.get('/api/timetable/')
+
+    def test_matching_etag_returns_not_modified(self):
+        self.login(self.student)
+        first = self.client.get('/api/timetable/')
+        response = self.client.get('/api/timetable/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertNotEqual(first['ETag'], timetable_etag(current_version(), 'lecturer', self.lecturer.id))
+
+    def test_cancellation_bumps_version(self):
+        self.login(self.lecturer)
+        first = self.client.get('/api/timetable/')
+        session = Timetable.objects.filter(course__lecturer=self.lecturer).first()
+        self.client.post(f'/api/cancel-class/{session.id}/')
+
+        response = self.client.get('/api/timetable/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        rows = {row['id']: row for row in response.json()}
+        self.assertTrue(rows[session.id]['is_canceled'])
+
+    def test_changes_invalidate_document(self):
+        self.login(self.student)
+        self.client.get('/api/timetable/')
+        session = Timetable.objects.first()
+        session.is_canceled = True
+        session.save()
+        rows = {row['id']: row for row in self.client.get('/api/timetable/').json()}
+        self.assertTrue(rows[session.id]['is_canceled'])
+
+        Room.objects.filter(id=session.room_id).update(name="Renamed")  # bulk write, no signal
+        generate_timetable(backend='greedy')  # publishing bumps the version too
+        payload = self.client.get('/api/timetable/').json()
+        self.assertEqual(len(payload), 5)
+        self.assertEqual({row['room'] for row in payload}, {"Renamed"})
+
+
+class AsyncViewTests(SessionLoginMixin, TestCase):
+    def setUp(self):
+        caches['timetable'].clear()
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.lecturer = make_lecturer("L0")
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        for i in range(3):
+            course = Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=self.lecturer)
+            self.session = Timetable.objects.create(course=course, day="Monday", start_time=time(9 + i), end_time=time(10 + i), room=room)
+            Enrolment.objects.create(user=self.student, course=course)
+
+    async def test_timetable_matches_sync_view(self):
+        await sync_to_async(self.login)(self.student)
+        expected = await sync_to_async(self.client.get)('/api/timetable/')
+        response = await self.async_client.get('/api/async/timetable/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response['ETag'], expected['ETag'])
+
+        response = await self.async_client.get('/api/async/timetable/', headers={'If-None-Match': expected['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_timetable_requires_login(self):
+        response = await self.async_client.get('/api/async/timetable/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_checkin_is_idempotent(self):
+        await sync_to_async(self.login)(self.student)
+        for _ in range(2):
+            response = await self.async_client.post(f'/api/async/attendance/{self.session.id}/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Attendance.objects.acount(), 1)
+        response = await self.async_client.post('/api/async/attendance/9999/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_job_status(self):
+        job = await ScheduleJob.objects.acreate(status='done', placed=3, total=3)
+        response = await self.async_client.get(f'/api/async/generate-timetable/{job.id}/')
+        self.assertEqual(response.status_code, 401)
+        await sync_to_async(self.login)(self.lecturer)
+        response = await self.async_client.get(f'/api/async/generate-timetable/{job.id}/')
+        self.assertEqual(response.json()['status'], 'done')
+        response = await self.async_client.get('/api/async/generate-timetable/9999/')
+        self.assertEqual(response.status_code, 404)
+
+
+class AuthTests(SessionLoginMixin, TestCase):
+    def setUp(self):
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password=make_password('secret'))
+
+    def test_login_returns_working_token(self):
+        response = self.client.post('/api/login/', {'reg_no': 'S1', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+        self.assertEqual(self.client_class().get('/api/timetable.ics', {'token': response.data['feed_token']}).status_code, 200)
+
+        with self.assertNumQueries(2):  # version, document; no session or user lookup
+            response = self.client_class().get('/api/timetable/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client_class().get('/api/timetable/', headers={'Authorization': f'Bearer {token}x'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_expired_token_is_rejected(self):
+        token = issue_token(self.student)
+        with override_settings(AUTH_TOKEN_MAX_AGE=-1):
+            response = self.client.get('/api/timetable/', headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_session_role_is_cached_until_the_user_changes(self):
+        self.login(self.student)
+        self.client.get('/api/timetable/')
+        with self.assertNumQueries(2):  # session, version; role and document are cached
+            self.client.get('/api/timetable/')
+
+        self.student.delete()
+        response = self.client.get('/api/timetable/')
+        self.assertEqual(response.status_code, 401)
+
+    def test_login_rehashes_with_configured_iterations(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            response = self.client.post('/api/login/', {'reg_no': 'S1', 'password': 'secret'})
+            self.assertEqual(response.status_code, 200)
+            self.student.refresh_from_db()
+            self.assertTrue(self.student.password.startswith('pbkdf2_sha256$1000$'))
+
+            response = self.client.post('/api/login/', {'reg_no': 'S1', 'password': 'secret'})
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.post('/api/login/', {'reg_no': 'S1', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+
+
+class AttendanceTests(SessionLoginMixin, TestCase):
+    def setUp(self):
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.lecturer = make_lecturer("L0")
+        course = Course.objects.create(code="C0", name="Course", lecturer=self.lecturer)
+        self.session = Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12), room=room)
+        self.students = [User.objects.create(reg_no=f"S{i}", name=f"S{i}", role='student', password='x') for i in range(5)]
+
+    def test_repeated_tap_is_idempotent(self):
+        self.login(self.students[0])
+        for _ in range(2):
+            response = self.client.post(f'/api/attendance/{self.session.id}/')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Attendance.objects.count(), 1)
+
+    def test_unknown_session_is_not_found(self):
+        self.login(self.students[0])
+        response = self.client.post('/api/attendance/9999/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_bulk_endpoint_inserts_batch_and_reports_rejects(self):
+        self.login(self.lecturer)
+        records = [{"timetable_id": self.session.id, "user_id": s.id} for s in self.students]
+        records += records[:2] + [{"timetable_id": 9999, "user_id": self.students[0].id}]
+        response = self.client.post('/api/attendance/bulk/', {"records": records}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['accepted'], 5)
+        self.assertEqual(response.data['rejected'], [{"timetable_id": 9999, "user_id": self.students[0].id}])
+        self.assertEqual(Attendance.objects.count(), 5)
+
+    def test_bulk_endpoint_limits_students_to_themselves(self):
+        self.login(self.students[0])
+        own = {"records": [{"timetable_id": self.session.id}]}
+        response = self.client.post('/api/attendance/bulk/', own, content_type='application/json')
+        self.assertEqual(response.data['accepted'], 1)
+
+        other = {"records": [{"timetable_id": self.session.id, "user_id": self.students[1].id}]}
+        response = self.client.post('/api/attendance/bulk/', other, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_bulk_endpoint_limits_lecturers_to_their_courses(self):
+        other = Course.objects.create(code="C1", name="Other", lecturer=make_lecturer("L1"))
+        session = Timetable.objects.create(course=other, day="Tuesday", start_time=time(9), end_time=time(12))
+        self.login(self.lecturer)
+        records = [{"timetable_id": t, "user_id": self.students[0].id} for t in (self.session.id, session.id)]
+        response = self.client.post('/api/attendance/bulk/', {"records": records}, content_type='application/json')
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual(response.data['rejected'], [{"timetable_id": session.id, "user_id": self.students[0].id}])
+        self.assertFalse(Attendance.objects.filter(timetable=session).exists())
+
+    def test_bulk_endpoint_validates_records(self):
+        self.login(self.lecturer)
+        response = self.client.post('/api/attendance/bulk/', {"records": [{"user_id": 1}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_buffer_coalesces_checkins(self):
+        buffer = CheckinBuffer(size=100, interval=60)
+        with mock.patch('threading.Thread'):
+            for student in self.students + self.students:
+                buffer.add(self.session.id, student.id)
+            buffer.add(9999, self.students[0].id)
+            with self.assertNumQueries(12), self.assertLogs('api.attendance', level='WARNING'):
+                # timetable + user lookups, then in one savepoint the insert
+                # and the rollup refresh: session count + upsert, session
+                # order, the students' check-ins + upsert
+                self.assertEqual(buffer.flush(), 11)
+        self.assertEqual(Attendance.objects.count(), 5)
+
+    def test_buffer_keeps_a_batch_that_fails_to_write(self):
+        buffer = CheckinBuffer(size=100, interval=60)
+        with mock.patch('threading.Thread'), mock.patch('atexit.register') as register:
+            buffer.add(self.session.id, self.students[0].id)
+        register.assert_called_once_with(buffer._flush_at_exit)
+        with mock.patch('api.attendance.record_checkins', side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                buffer.flush()
+        buffer.add(self.session.id, self.students[1].id)
+        self.assertEqual(buffer.pending, [(self.session.id, self.students[0].id), (self.session.id, self.students[1].id)])
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(Attendance.objects.count(), 2)
+
+    @override_settings(ATTENDANCE_BUFFER_ENABLED=True)
+    def test_buffered_endpoint_accepts_immediately(self):
+        self.login(self.students[0])
+        with mock.patch('api.views.checkin_buffer') as buffer:
+            response = self.client.post(f'/api/attendance/{self.session.id}/')
+        self.assertEqual(response.status_code, 202)
+        buffer.add.assert_called_once_with(self.session.id, self.students[0].id)
+
+
+class AttendanceStatsTests(SessionLoginMixin, TestCase):
+    def setUp(self):
+        self.lecturer = make_lecturer("L0")
+        self.course = Course.objects.create(code="C0", name="Course", lecturer=self.lecturer)
+        self.sessions = [
+            Timetable.objects.create(course=self.course, day=day, start_time=time(9), end_time=time(12),
+                                     room=Room.objects.create(name=f"Room {day}", capacity=50))
+            for day in DAYS[:4]
+        ]
+        self.students = [User.objects.create(reg_no=f"S{i}", name=f"S{i}", role='student', password='x') for i in range(4)]
+        for student in self.students:
+            Enrolment.objects.create(user=student, course=self.course)
+
+    def check_in(self, student, *days):
+        self.login(student)
+        for day in days:
+            self.client.post(f'/api/attendance/{self.sessions[day].id}/')
+
+    def test_streaks(self):
+        self.assertEqual(streaks([]), (0, 0))
+        self.assertEqual(streaks([0, 1, 2, 5, 6]), (2, 3))
+        self.assertEqual(streaks([3, 1, 2]), (3, 3))
+
+    def test_checkins_update_rollups(self):
+        self.check_in(self.students[0], 0, 1, 2, 3)
+        self.check_in(self.students[1], 0, 2, 3)
+        self.check_in(self.students[1], 3)  # Retried tap
+
+        self.assertEqual(SessionAttendanceStats.objects.get(timetable=self.sessions[3]).attended, 2)
+        stats = StudentAttendanceStats.objects.get(user=self.students[1], course=self.course)
+        self.assertEqual((stats.attended, stats.current_streak, stats.best_streak), (3, 2, 2))
+        self.assertIsNotNone(stats.last_checkin)
+
+    def test_rebuild_matches_incremental(self):
+        self.check_in(self.students[0], 0, 1, 3)
+        self.check_in(self.students[2], 2)
+        fields = ('user_id', 'course_id', 'attended', 'current_streak', 'best_streak')
+        incremental = sorted(StudentAttendanceStats.objects.values_list(*fields))
+        sessions = sorted(SessionAttendanceStats.objects.values_list('timetable_id', 'attended'))
+
+        self.assertEqual(rebuild_rollups(), (4, 4))
+        self.assertEqual(sorted(StudentAttendanceStats.objects.values_list(*fields)), incremental)
+        self.assertEqual(sorted(SessionAttendanceStats.objects.values_list('timetable_id', 'attended')), sessions)
+
+    def test_course_and_student_endpoints(self):
+        self.check_in(self.students[0], 0, 1)
+        self.check_in(self.students[1], 0)
+
+        self.login(self.lecturer)
+        # session, role (cold cache), course, enrolled count, the live sessions and
+        # started terms for the occurrences held, per-session rollups
+        with self.assertNumQueries(7):
+            response = self.client.get(f'/api/attendance/stats/courses/{self.course.id}/')
+        self.assertEqual(response.data['attended'], 3)
+        self.assertEqual(response.data['rate'], round(3 / 16, 4))
+        self.assertEqual([s['attended'] for s in response.data['sessions']], [2, 1, 0, 0])
+
+        response = self.client.get(f'/api/attendance/stats/sessions/{self.sessions[0].id}/')
+        self.assertEqual(response.data['rate'], 0.5)
+
+        self.login(self.students[0])
+        response = self.client.get(f'/api/attendance/stats/students/{self.students[0].id}/')
+        self.assertEqual(response.data['rate'], 0.5)
+        self.assertEqual(response.data['courses'][0]['current_streak'], 2)
+        response = self.client.get(f'/api/attendance/stats/students/{self.students[1].id}/')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(f'/api/attendance/stats/courses/{self.course.id}/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_low_attendance_alerts(self):
+        self.check_in(self.students[0], 0, 1, 2, 3)
+        self.check_in(self.students[1], 0, 1, 2)
+        self.check_in(self.students[2], 0)
+
+        self.login(self.lecturer)
+        response = self.client.get('/api/attendance/alerts/', {'threshold': 0.75})
+        self.assertEqual([a['user_id'] for a in response.data['alerts']], [self.students[3].id, self.students[2].id])
+        self.assertEqual(response.data['alerts'][0]['rate'], 0.0)
+
+        for bad in ('nan', 'inf', '-1', '1.5', 'x'):
+            response = self.client.get('/api/attendance/alerts/', {'threshold': bad})
+            self.assertEqual(response.status_code, 400, bad)
+
+        other = make_lecturer("L1")
+        self.login(other)
+        response = self.client.get('/api/attendance/alerts/')
+        self.assertEqual(response.data['alerts'], [])
+
+
+def query_plans(queries):
+    # SQLite's EXPLAIN QUERY PLAN detail lines for every captured SELECT
+    with connection.cursor() as cursor:
+        for query in queries:
+            if query['sql'].startswith('SELECT'):
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                yield query['sql'], [row[-1] for row in cursor.fetchall()]
+
+
+@skipIf(connection.vendor != 'sqlite', "Plans are checked in SQLite's EXPLAIN QUERY PLAN format")
+class QueryPlanTests(SessionLoginMixin, TestCase):
+    """
+    Every endpoint runs a fixed number of queries, none of which reads a
+    whole table. A plan line like ``SCAN api_attendance`` (as opposed to
+    ``SEARCH ... USING INDEX`` or ``SCAN ... USING COVERING INDEX``) means a
+    lookup lost its index.
+    """
+
+    def setUp(self):
+        self.lecturer = make_lecturer("L0")
+        self.student = User.objects.create(reg_no="S0", name="S0", role='student', password=make_password('pw'))
+        self.course = Course.objects.create(code="C0", name="Course", lecturer=self.lecturer)
+        Enrolment.objects.create(user=self.student, course=self.course)
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.session = Timetable.objects.create(course=self.course, day="Monday", start_time=time(9), end_time=time(12), room=room)
+        Attendance.objects.create(timetable=self.session, user=self.student, attended=True)
+        self.job = ScheduleJob.objects.create(status='done')
+
+    def assertIndexed(self, queries, sorts=0):
+        # No full scans, and no sorts without an index but the ``sorts``
+        # expected of rows already narrowed to one user or a few sessions
+        sorted_queries = []
+        for sql, plan in query_plans(queries):
+            scans = [line for line in plan if line.startswith('SCAN ') and ' USING ' not in line]
+            self.assertEqual(scans, [], f"Full table scan in: {sql}")
+            if any('TEMP B-TREE' in line for line in plan):
+                sorted_queries.append(sql)
+        self.assertEqual(len(sorted_queries), sorts, "Sorted without an index:\n" + "\n".join(sorted_queries))
+
+    def check(self, user, method, url, expected_queries, sorts=0, **kwargs):
+        if user:
+            self.login(user)
+            cached_role(user.id)  # Counts are for a warm role cache
+        caches['timetable'].clear()
+        with CaptureQueriesContext(connection) as captured:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400, url)
+        self.assertIndexed(captured, sorts)
+        self.assertEqual(len(captured), expected_queries, "\n".join(q['sql'] for q in captured))
+
+    def test_login(self):
+        self.check(None, 'post', '/api/login/', 5, data={'reg_no': 'S0', 'password': 'pw'})
+
+    def test_timetable(self):
+        # Each user's sessions are found through their courses or enrolments, then put in id order
+        self.check(self.lecturer, 'get', '/api/timetable/', 3, sorts=1)
+        self.check(self.student, 'get', '/api/timetable/', 3, sorts=1)
+
+    def test_cancel_class(self):
+        # Session, row and update, then the version bump and change log entry in a savepoint
+        self.check(self.lecturer, 'post', f'/api/cancel-class/{self.session.id}/', 8)
+
+    def test_attendance(self):
+        # The term lookups: none is running, so no holidays or occurrences.
+        # The rollup refresh counts the touched sessions' rows and loads the
+        # occurrences held, sorting them in memory
+        self.check(self.student, 'post', f'/api/attendance/{self.session.id}/', 13)
+        records = {"records": [{"timetable_id": self.session.id, "user_id": self.student.id}]}
+        self.check(self.lecturer, 'post', '/api/attendance/bulk/', 13, data=records, content_type='application/json')
+
+    def test_attendance_stats(self):
+        # Each also loads the live sessions and started terms for the occurrences held
+        self.check(self.lecturer, 'get', f'/api/attendance/stats/courses/{self.course.id}/', 6)
+        self.check(self.lecturer, 'get', f'/api/attendance/stats/sessions/{self.session.id}/', 6)
+        self.check(self.student, 'get', f'/api/attendance/stats/students/{self.student.id}/', 4)
+        self.check(self.lecturer, 'get', '/api/attendance/alerts/', 5, sorts=1)  # Worst rate first: computed, so sorted
+
+    def test_job_status(self):
+        self.check(self.lecturer, 'get', f'/api/generate-timetable/{self.job.id}/', 2)
+
+    def test_hot_lookups(self):
+        # Lookups outside the endpoints: admin lists, the scheduler and the job queue
+        querysets = [
+            Attendance.objects.order_by('-timestamp')[:100],
+            Attendance.objects.filter(user=self.student).order_by('-timestamp'),
+            Timetable.objects.filter(week_start__lt=week_minute("Monday", time(12)), week_end__gt=week_minute("Monday", time(9))),
+            Timetable.objects.filter(room=self.session.room_id, week_start__lt=week_minute("Monday", time(12))),
+            Timetable.objects.filter(course__lecturer=self.lecturer),
+            Timetable.objects.order_by('week_start'),
+            User.objects.filter(role='lecturer').order_by('reg_no'),
+            ScheduleJob.objects.filter(status='queued').order_by('id')[:1],
+        ]
+        for queryset in querysets:
+            with CaptureQueriesContext(connection) as captured:
+                list(queryset)
+            self.assertIndexed(captured)
+
+
+@override_settings(IMPORT_PASSWORD_ITERATIONS=1000)
+class ImportTests(TestCase):
+    document = {
+        "rooms": [
+            {"room_name": "Room 101", "capacity": 50, "type": "Lecture Hall"},
+            {"room_name": "Lab 201", "capacity": 30, "type": "Computer Lab"},
+        ],
+        "lecturers": [
+            {"name": "Dr. Kimani", "preferred_days": ["Monday", "Wednesday"], "courses": ["AI 201"]},
+            {"name": "Mr. Omondi", "preferred_days": ["Tuesday"], "courses": ["CSC 101"]},
+        ],
+        "courses": [
+            {"course_code": "CSC 101", "course_name": "Introduction to CS", "lecturer": "Mr. Omondi", "students": 100, "duration": 3},
+            {"course_code": "AI 201", "course_name": "Artificial Intelligence", "lecturer": "Dr. Kimani", "students": 50, "duration": 2},
+        ],
+        "time_slots": {"Monday": ["08:00-11:00"]},
+    }
+
+    def students_csv(self, count, courses="CSC 101;AI 201"):
+        rows = ["reg_no,name,password,courses"]
+        rows += [f"S{i:05},Student {i},pw{i},{courses}" for i in range(count)]
+        return io.StringIO("\n".join(rows) + "\n")
+
+    def test_imports_scheduler_document(self):
+        report = import_stream(io.StringIO(json.dumps(self.document)), 'json')
+
+        self.assertEqual(report.errors, [])
+        self.assertEqual(dict(report.created), {'rooms': 2, 'lecturers': 2, 'courses': 2})
+        course = Course.objects.get(code="AI 201")
+        self.assertEqual((course.lecturer.name, course.session_minutes, course.students), ("Dr. Kimani", 120, 50))
+        self.assertEqual(course.lecturer.get_preferred_days(), ["Monday", "Wednesday"])
+        self.assertEqual(course.lecturer.get_available_days(), [])
+
+        report = import_stream(io.StringIO(json.dumps(self.document)), 'json')
+        self.assertEqual(dict(report.updated), {'rooms': 2, 'lecturers': 2, 'courses': 2})
+        self.assertEqual(Course.objects.count(), 2)
+
+    def test_students_csv_enrols_and_hashes(self):
+        import_stream(io.StringIO(json.dumps(self.document)), 'json')
+        report = import_stream(self.students_csv(30), 'csv', 'students', workers=0)
+
+        self.assertEqual((report.created['students'], report.created['enrolments']), (30, 60))
+        student = User.objects.get(reg_no="S00007")
+        self.assertTrue(check_password("pw7", student.password))
+        self.assertEqual(StudentAttendanceStats.objects.filter(user=student).count(), 2)
+
+        report = import_stream(self.students_csv(30), 'csv', 'students', workers=0)
+        self.assertEqual((report.updated['students'], report.created['enrolments']), (30, 0))
+
+    def test_queries_are_per_chunk_not_per_row(self):
+        import_stream(io.StringIO(json.dumps(self.document)), 'json')
+        with CaptureQueriesContext(connection) as captured:
+            import_stream(self.students_csv(400), 'csv', 'students', workers=0)
+        # Maps, then per chunk: existing users, inserts, new ids, enrolments and rollups in batches
+        self.assertLess(len(captured), 25)
+
+    def test_passwords_hash_in_a_process_pool(self):
+        import_stream(io.StringIO(json.dumps(self.document)), 'json')
+        import_stream(self.students_csv(70), 'csv', 'students', workers=2)
+        self.assertTrue(check_password("pw69", User.objects.get(reg_no="S00069").password))
+
+    def test_bad_records_are_reported_and_skipped(self):
+        lines = [
+            {"kind": "rooms", "name": "Hall", "capacity": "many"},
+            {"kind": "courses", "code": "X1", "name": "X", "lecturer": "Nobody"},
+            {"kind": "lecturers", "name": "Dr. A", "available_days": "Funday"},
+            {"kind": "rooms", "name": "Hall", "capacity": 80},
+            {"kind": "lecturers", "name": "Dr. B"},
+            {"kind": "courses", "code": "X2", "name": "X", "lecturer": "Dr. B", "session_minutes": 0},
+            {"kind": "courses", "code": "X3", "name": "X", "lecturer": "Dr. B", "session_minutes": -60},
+            {"kind": "courses", "code": "X4", "name": "X", "lecturer": "Dr. B", "duration": 4},
+            {"kind": "courses", "code": "X5", "name": "X", "lecturer": "Dr. B", "students": -1},
+            {"kind": "courses", "code": "X6", "name": "X", "lecturer": "Dr. B", "session_minutes": 60},
+        ]
+        stream = io.StringIO("\n".join(json.dumps(line) for line in lines) + "\n{not json\n")
+        report = import_stream(stream, 'jsonl')
+
+        self.assertEqual((report.created['rooms'], report.created['courses']), (1, 1))
+        self.assertEqual({(kind, line) for kind, line, _ in report.errors},
+                         {('rooms', 1), ('lecturers', 3), ('courses', 2), ('courses', 6), ('courses', 7), ('courses', 8),
+                          ('courses', 9), ('unknown', 11)})
+
+    def test_malformed_input_is_reported(self):
+        for document in ('[1, 2]', '"rooms"', '{"rooms": '):
+            with self.assertRaises(ValueError):
+                import_stream(io.StringIO(document), 'json')
+
+        document = {
+            "rooms": {"Room 1": 40},
+            "lecturers": [{"name": ["Dr. Kimani"]}, {"name": "Mr. Omondi", "preferred_days": ["Tuesday"]}],
+            "courses": [{"code": "C1", "name": "Course", "lecturer": {"reg_no": "Mr. Omondi"}}],
+        }
+        report = import_stream(io.StringIO(json.dumps(document)), 'json')
+        self.assertEqual(dict(report.created), {'lecturers': 1})
+        self.assertEqual([(kind, line) for kind, line, _ in report.errors], [('rooms', 1), ('lecturers', 1), ('courses', 1)])
+        self.assertIn("name must be a single value", report.errors[1][2])
+
+        rows = "name,capacity\nRoom 1,40\nRoom 2,30,extra\nRoom 3,\"" + "x" * (csv.field_size_limit() + 1) + "\"\nRoom 4,20\n"
+        report = import_stream(io.StringIO(rows), 'csv', 'rooms')
+        self.assertEqual(report.created['rooms'], 1)
+        self.assertEqual(report.errors[0], ('rooms', 3, "More fields than the header"))
+        self.assertIn("Malformed CSV", report.errors[1][2])
+
+        self.client.force_login(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        response = self.client.post('/api/import/', {'file': SimpleUploadedFile("data.json", b"[1, 2]")})
+        self.assertEqual(response.status_code, 400)
+        upload = SimpleUploadedFile("rooms.jsonl", b'{"kind": "rooms", "name": "Room 9", "capacity": [40]}\n')
+        response = self.client.post('/api/import/', {'file': upload})
+        self.assertEqual((response.status_code, response.data['skipped']), (200, {'rooms': 1}))
+
+    def test_endpoint_is_staff_only(self):
+        upload = SimpleUploadedFile("data.json", json.dumps(self.document).encode())
+        response = self.client.post('/api/import/', {'file': upload})
+        self.assertEqual(response.status_code, 403)
+
+        admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile("rooms.csv", b"name,capacity\nRoom 9,40\n")
+        response = self.client.post('/api/import/', {'file': upload, 'kind': 'rooms'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], {'rooms': 1})
+
+        # Passwords are hashed in the web process, however many there are
+        upload = SimpleUploadedFile("students.csv", self.students_csv(70, courses="").getvalue().encode())
+        with mock.patch('api.importer.ProcessPoolExecutor') as pool:
+            response = self.client.post('/api/import/', {'file': upload, 'kind': 'students'})
+        pool.assert_not_called()
+        self.assertEqual(response.data['created'], {'students': 70})
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        room = Room.objects.create(name="Room 1, East", capacity=50)
+        self.lecturer = make_lecturer("L0")
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        for i in range(6):
+            course = Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=self.lecturer)
+            session = Timetable.objects.create(course=course, day=DAYS[i % 5], start_time=time(9 + i // 5 * 4),
+                                               end_time=time(12 + i // 5 * 4),
+                                               room=room, is_canceled=i == 5)
+            if i % 2 == 0:
+                Enrolment.objects.create(user=self.student, course=course)
+                Attendance.objects.create(timetable=session, user=self.student, attended=True)
+        self.admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_timetable_jsonl_matches_serializer(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/export/timetable.jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in self.body(response).splitlines()]
+        self.assertEqual(rows, [dict(row) for row in TimetableSerializer(Timetable.objects.order_by('id'), many=True).data])
+
+    def test_timetable_csv(self):
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/export/timetable.csv', HTTP_ACCEPT='text/csv')
+        lines = self.body(response).splitlines()
+        self.assertEqual(lines[0], "id,course,day,start_time,end_time,week_start,week_end,room,is_canceled")
+        self.assertEqual(len(lines), 7)
+        self.assertIn('"Room 1, East"', lines[1])
+
+    def test_attendance_export(self):
+        self.client.force_login(self.admin)
+        rows = [json.loads(line) for line in self.body(self.client.get('/api/export/attendance.jsonl')).splitlines()]
+        self.assertEqual([(row['course'], row['reg_no'], row['attended']) for row in rows],
+                         [("C0", "S1", True), ("C2", "S1", True), ("C4", "S1", True)])
+
+    def test_exports_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/export/timetable.jsonl').status_code, 403)
+        response = self.client.get('/api/export/attendance.csv', HTTP_ACCEPT='text/csv')
+        self.assertEqual((response.status_code, response['Content-Type']), (403, 'application/json'))
+
+    def test_rows_are_written_in_chunks(self):
+        self.client.force_login(self.admin)
+        with mock.patch('api.exports.LINES_PER_WRITE', 2):
+            response = self.client.get('/api/export/timetable.jsonl')
+            chunks = list(response.streaming_content)
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [2, 2, 2])
+
+    def test_ical_feed_of_own_sessions(self):
+        response = self.client.get('/api/timetable.ics', {'token': issue_feed_token(self.student)},
+                                   HTTP_ACCEPT='text/calendar')
+        self.assertEqual(response.status_code, 200)
+        body = self.body(response)
+        self.assertTrue(body.startswith("BEGIN:VCALENDAR\r\n") and body.endswith("END:VCALENDAR\r\n"))
+        self.assertEqual(body.count("BEGIN:VEVENT"), 3)
+        self.assertIn("LOCATION:Room 1\\, East\r\n", body)
+        self.assertIn("RRULE:FREQ=WEEKLY\r\n", body)
+        self.assertRegex(body, r"DTSTART:\d{8}T090000\r\n")
+
+        lecturer_feed = self.body(self.client.get('/api/timetable.ics', HTTP_AUTHORIZATION=f"Bearer {issue_token(self.lecturer)}"))
+        self.assertEqual(lecturer_feed.count("BEGIN:VEVENT"), 6)
+        self.assertEqual(lecturer_feed.count("STATUS:CANCELLED"), 1)
+
+    def test_ical_feed_needs_a_valid_token(self):
+        self.assertEqual(self.client.get('/api/timetable.ics').status_code, 401)
+        self.assertEqual(self.client.get('/api/timetable.ics', {'token': 'forged'}).status_code, 401)
+        # The API login token does not open the feed, nor the feed token the API
+        self.assertEqual(self.client.get('/api/timetable.ics', {'token': issue_token(self.student)}).status_code, 401)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_feed_token(self.student)}"}
+        self.assertEqual(self.client.get('/api/timetable/', **auth).status_code, 401)
+        with override_settings(AUTH_TOKEN_MAX_AGE=-1):
+            response = self.client.get('/api/timetable.ics', {'token': issue_feed_token(self.student)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_long_ical_lines_are_folded(self):
+        folded = _ical_line("SUMMARY:" + "é" * 60)
+        lines = folded.split("\r\n")
+        self.assertTrue(all(len(line.encode()) <= 75 for line in lines))
+        self.assertEqual("".join(line[1:] if i else line for i, line in enumerate(lines)), "SUMMARY:" + "é" * 60)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class BenchmarkTests(TestCase):
+    sizes = {'rooms': 3, 'lecturers': 4, 'courses': 8, 'students': 30}
+
+    def university(self):
+        return (
+            sorted(Enrolment.objects.values_list('user__reg_no', 'course__code')),
+            sorted(User.objects.filter(role='lecturer').values_list('reg_no', 'available_days')),
+            sorted(Room.objects.values_list('name', 'capacity')),
+        )
+
+    def test_populate_is_reproducible(self):
+        counts = populate(**self.sizes, seed=7)
+        self.assertEqual(counts, {**self.sizes, 'enrolments': 120})
+        self.assertEqual(StudentAttendanceStats.objects.count(), 120)
+        first = self.university()
+
+        for model in (Enrolment, Course, User, Room):
+            model.objects.all().delete()
+        populate(**self.sizes, seed=7)
+        self.assertEqual(self.university(), first)
+
+        for model in (Enrolment, Course, User, Room):
+            model.objects.all().delete()
+        populate(**self.sizes, seed=8)
+        self.assertNotEqual(self.university(), first)
+
+    def test_tightness_limits_lecturer_days(self):
+        populate(**self.sizes, tightness=1)
+        self.assertEqual({len(lecturer.get_available_days()) for lecturer in User.objects.filter(role='lecturer')}, {2})
+        largest = max(Course.objects.values_list('students', flat=True))
+        self.assertEqual(max(Room.objects.values_list('capacity', flat=True)), largest)
+
+    def test_run_scale_records_time_queries_and_memory(self):
+        results = run_scale(**self.sizes, repeat=1, time_limit=5)
+        self.assertEqual(results['placed'], 8)
+        self.assertEqual(set(results['benchmarks']), {
+            'generate_timetable', 'timetable_cold', 'timetable_warm', 'login', 'attendance_batch', 'attendance_checkin',
+        })
+        for result in results['benchmarks'].values():
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_kb'], 0)
+        self.assertEqual(results['benchmarks']['attendance_batch']['rows'], 120)
+        self.assertEqual(Attendance.objects.count(), 1)
+
+    def test_compare_reports_regressions(self):
+        def document(seconds, queries, peak_kb):
+            return {'scales': {'tiny': {'benchmarks': {'login': {'median_s': seconds, 'queries': queries, 'peak_kb': peak_kb}}}}}
+
+        baseline = document(0.100, 5, 300)
+        self.assertEqual(compare(baseline, document(0.110, 5, 310)), [])
+        self.assertEqual(compare(baseline, document(0.200, 6, 1000)), [
+            "tiny/login: 100.0ms -> 200.0ms", "tiny/login: 5 -> 6 queries", "tiny/login: peak 300KB -> 1000KB",
+        ])
+        self.assertEqual(compare(document(0.001, 5, 300), document(0.003, 5, 300)), [])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape-me', METRICS_SLOW_QUERY_MS=1000)
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+        for target in ('api.metrics.registry', 'api.views.registry'):
+            patcher = mock.patch(target, self.registry)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        caches['timetable'].clear()
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        course = Course.objects.create(code="C1", name="Course 1", lecturer=make_lecturer("L0"), students=10)
+        Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12), room=room)
+        Enrolment.objects.create(user=self.student, course=course)
+        self.token = issue_token(self.student)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer scrape-me", HTTP_ACCEPT='text/plain')
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requests_are_counted_by_route(self):
+        self.client.get('/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.client.get('/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        key = ('api/timetable/', 'GET')
+        self.assertEqual(self.registry.requests[key + (200,)], 2)
+        self.assertEqual(self.registry.latency[key].count, 2)
+        self.assertEqual(self.registry.queries[key].sum, 3)  # Version and rows, then the version of a cached document
+
+        text = self.scrape()
+        self.assertIn('# TYPE smartdaro_request_seconds histogram', text)
+        self.assertIn('smartdaro_requests_total{endpoint="api/timetable/",method="GET",status="200"} 2', text)
+        self.assertIn('smartdaro_request_seconds_count{endpoint="api/timetable/",method="GET"} 2', text)
+        self.assertIn('smartdaro_request_queries_bucket{endpoint="api/timetable/",method="GET",le="+Inf"} 2', text)
+
+    def test_unknown_methods_share_one_label(self):
+        self.client.generic('BREW', '/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.client.generic('X-' + 'A' * 50, '/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+
+        self.assertEqual(self.registry.requests['api/timetable/', 'other', 405], 2)
+        self.assertIn('smartdaro_requests_total{endpoint="api/timetable/",method="other",status="405"} 2', self.scrape())
+
+    def test_async_views_are_measured(self):
+        # The async view's queries run on this thread's connection, which the
+        # middleware hooks when the (sync) client first loads it; a server
+        # hooks every connection as it opens
+        self.client.get('/metrics')
+
+        async def fetch():
+            return await self.async_client.get('/api/async/timetable/', headers={'Authorization': f"Bearer {self.token}"})
+
+        response = async_to_sync(fetch)()
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(self.registry.queries['api/async/timetable/', 'GET'].sum, 0)
+
+    def test_slow_queries_are_sampled(self):
+        with override_settings(METRICS_SLOW_QUERY_MS=0), self.assertLogs('api.metrics', 'WARNING') as logs:
+            self.client.get('/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        self.assertEqual(json.loads(logs.records[0].getMessage())['event'], 'slow_query')
+        samples = self.client.get('/api/metrics/slow-queries/', HTTP_AUTHORIZATION="Bearer scrape-me").json()['queries']
+        self.assertTrue(samples)
+        self.assertEqual({sample['endpoint'] for sample in samples}, {'api/timetable/'})
+        self.assertIn('smartdaro_slow_queries_total{endpoint="api/timetable/"}', self.scrape())
+
+    def test_scheduler_runs_are_recorded(self):
+        solution = generate_timetable(time_limit=5)
+        last = self.registry.solver_last['full']
+        self.assertEqual(self.registry.solver_runs['full', solution.backend], 1)
+        self.assertEqual((last['courses'], last['placed'], last['unplaced']), (1, 1, 0))
+        self.assertGreater(last['iterations'], 0)
+        self.assertLessEqual(last['first_feasible_s'], last['total_s'])
+        self.assertIn('smartdaro_solver_last{mode="full",stat="unplaced"} 0', self.scrape())
+
+    def test_metrics_need_staff_or_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.client.force_login(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled_metrics_cost_nothing(self):
+        self.client.get('/api/timetable/', HTTP_AUTHORIZATION=f"Bearer {self.token}")
+        generate_timetable(time_limit=5)
+        self.assertEqual((dict(self.registry.requests), self.registry.solver_runs), ({}, {}))
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION="Bearer scrape-me").status_code, 404)
+
+
+class ObjectiveTests(TestCase):
+    def test_delta_matches_a_full_recompute(self):
+        courses = [CourseSpec(i, f"C{i}", i % 3, 5 + 7 * i, None, 0b111111, 0b000111 if i % 3 else None) for i in range(8)]
+        problem = Problem(
+            courses, [RoomSpec(i, 30 + 20 * i) for i in range(3)], [1 << s for s in range(6)],
+            groups=[(0, 1, 2), (3, 4)], slot_times=[(day * MINUTES_PER_DAY + 540 + 180 * k, day * MINUTES_PER_DAY + 720 + 180 * k)
+                                                    for day in range(3) for k in range(2)],
+            lecturer_limits={0: 360}, group_sizes=[4, 9],
+        )
+        evaluator = Evaluator(problem, {c: (c % 6, c % 3) for c in range(8)})
+        for c, placement in [(0, (5, 2)), (3, (1, 0)), (4, None), (7, (0, 1)), (4, (2, 2))]:
+            expected = Evaluator(problem, {**evaluator.assignment, c: placement} if placement else
+                                 {k: v for k, v in evaluator.assignment.items() if k != c})
+            self.assertAlmostEqual(evaluator.delta(c, placement), expected.total() - evaluator.total())
+            evaluator.move(c, placement)
+            self.assertAlmostEqual(evaluator.total(), expected.total())
+            self.assertEqual(evaluator.breakdown(), expected.breakdown())
+
+    def test_terms(self):
+        # Two three-hour sessions of one lecturer (limit four hours) on Monday
+        # morning and afternoon, both taken by a group of three students
+        courses = [CourseSpec(i, f"C{i}", 0, 10, None, 0b11, 0b00) for i in range(2)]
+        problem = Problem(courses, [RoomSpec(0, 40)], [0b01, 0b10], groups=[(0, 1)],
+                          slot_times=[(480, 660), (840, 1020)], lecturer_limits={0: 240}, group_sizes=[3])
+        terms = Evaluator(problem, {0: (0, 0), 1: (1, 0)}).breakdown()['objectives']
+        self.assertEqual({name: term['value'] for name, term in terms.items()}, {
+            'wasted_seats': 60, 'overload': 2, 'balance': 36, 'preferred_days': 6, 'student_gaps': 9,
+        })
+        self.assertEqual(terms['overload']['weighted'], 100)
+
+    def test_improve_lowers_the_score_and_keeps_the_timetable_valid(self):
+        courses = [CourseSpec(i, f"C{i}", i % 4, 10 + 5 * i, None, (1 << 10) - 1, 0b1111100000 if i % 2 else None)
+                   for i in range(16)]
+        problem = Problem(courses, [RoomSpec(i, 30 + 30 * i) for i in range(3)], [1 << s for s in range(10)],
+                          groups=[(0, 1, 2, 3), (4, 5, 6, 7)])
+        solution = solver.greedy(problem)
+        improved = solver.improve(solution, Weights())
+        self.assertLess(improved.stats['objective'], improved.stats['objective_before'])
+        self.assertEqual(set(improved.assignment), set(solution.assignment))
+        self.assertEqual(solver.violations(problem, improved.assignment), [])
+        assert_feasible(self, problem, improved)
+        self.assertEqual(solver.improve(solution, Weights()).assignment, improved.assignment)
+
+    def test_violations(self):
+        courses = [CourseSpec(0, "C0", 0, 10, None, 0b01), CourseSpec(1, "C1", 0, 60, None, 0b11)]
+        problem = Problem(courses, [RoomSpec(0, 50)], [0b01, 0b10])
+        self.assertEqual(solver.violations(problem, {0: (1, 0), 1: (1, 0)}), [
+            (0, "lecturer not available"), (1, "room too small"), (1, "room taken"), (1, "lecturer double-booked"),
+        ])
+
+    def test_generation_follows_preferred_days(self):
+        room = Room.objects.create(name="Room 1", capacity=50)
+        lecturer = make_lecturer("L0")
+        lecturer.preferred_days = "Thursday"
+        lecturer.save()
+        Course.objects.create(code="C1", name="Course 1", lecturer=lecturer, room=room)
+        with override_settings(SCHEDULER_WEIGHTS=None):
+            generate_timetable(time_limit=5)
+        self.assertEqual(Timetable.objects.get().day, "Monday")
+        generate_timetable(time_limit=5)
+        self.assertEqual(Timetable.objects.get().day, "Thursday")
+
+    def test_evaluate_endpoint(self):
+        rooms = [Room.objects.create(name=f"Room {i}", capacity=capacity) for i, capacity in enumerate((20, 100))]
+        lecturer = make_lecturer("L0")
+        course = Course.objects.create(code="C1", name="Course 1", lecturer=lecturer, students=20)
+        other = Course.objects.create(code="C2", name="Course 2", lecturer=make_lecturer("L1"), students=20)
+        session = Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12), room=rooms[0])
+        Timetable.objects.create(course=other, day="Tuesday", start_time=time(9), end_time=time(12), room=rooms[0])
+        student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+
+        url = '/api/timetable/evaluate/'
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION=f"Bearer {issue_token(student)}").status_code, 403)
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(lecturer)}"}
+        current = self.client.get(url, **auth).json()
+        self.assertEqual(current['current']['objectives']['wasted_seats']['value'], 0)
+        self.assertEqual(current['violations'], [])
+
+        move = {"timetable_id": session.id, "day": "Tuesday", "start_time": "09:00"}
+        body = self.client.post(url, {"moves": [move], "weights": {"balance": 0}}, content_type='application/json', **auth).json()
+        self.assertEqual(body['weights']['balance'], 0)
+        self.assertEqual(body['delta'], 0)
+        self.assertEqual(body['violations'], [{'course': "C2", 'error': "room taken"}])
+
+        move['room_id'] = rooms[1].id
+        body = self.client.post(url, {"moves": [move]}, content_type='application/json', **auth).json()
+        self.assertEqual(body['proposed']['objectives']['wasted_seats']['value'], 80)
+        self.assertEqual(body['violations'], [])
+
+        for bad in ({**move, "start_time": "09:30"}, {**move, "timetable_id": 0}):
+            response = self.client.post(url, {"moves": [bad]}, content_type='application/json', **auth)
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {"weights": {"beauty": 1}}, content_type='application/json', **auth)
+        self.assertEqual(response.status_code, 400)
+
+
+class ScenarioTests(TestCase):
+    def setUp(self):
+        clear_snapshot()
+        self.small, self.big = Room.objects.create(name="Small", capacity=20), Room.objects.create(name="Big", capacity=60)
+        self.lecturer = make_lecturer("L0")
+        self.courses = [
+            Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=self.lecturer, students=15) for i in range(3)
+        ]
+        Timetable.objects.create(course=self.courses[0], day="Monday", start_time=time(9), end_time=time(12), room=self.small)
+        Timetable.objects.create(course=self.courses[1], day="Tuesday", start_time=time(9), end_time=time(12), room=self.small)
+        Timetable.objects.create(course=self.courses[2], day="Wednesday", start_time=time(9), end_time=time(12), room=self.big)
+        self.live = list(Timetable.objects.order_by('id').values_list('day', 'start_time', 'room_id'))
+        self.admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+
+    def test_scenarios_run_in_memory_on_one_snapshot(self):
+        report, sessions, version = run_scenario([{"op": "close_rooms", "rooms": [self.small.id]}])
+        self.assertEqual(version, current_version())
+        self.assertEqual(report['unscheduled'], [])
+        self.assertEqual({change['course'] for change in report['changed']}, {"C0", "C1"})
+        self.assertEqual({room_id for *_, room_id in sessions}, {self.big.id})
+        self.assertEqual(list(Timetable.objects.order_by('id').values_list('day', 'start_time', 'room_id')), self.live)
+
+        with self.assertNumQueries(1):  # The version; the snapshot is reused
+            report, _, _ = run_scenario([{"op": "resize_course", "course": self.courses[0].id, "students": 40}])
+        self.assertEqual(report['broken'], [{'course': "C0", 'error': "room too small"}])
+        self.assertEqual(report['changed'][0]['to']['room'], "Big")
+
+        report, _, _ = run_scenario([{"op": "resize_course", "course": self.courses[0].id, "students": 40}], mode='evaluate')
+        self.assertEqual((report['changed'], len(report['broken'])), ([], 1))
+
+    def test_lecturer_edits_expire_the_snapshot(self):
+        run_scenario([])
+        self.lecturer.available_days = "Friday"
+        self.lecturer.save()
+        report, _, _ = run_scenario([], mode='evaluate')
+        self.assertEqual({entry['course'] for entry in report['broken']}, {"C0", "C1", "C2"})
+
+    def test_bad_changes_are_refused(self):
+        for changes in ([{"op": "demolish"}], [{"op": "close_rooms", "rooms": [0]}], [{"op": "resize_course"}],
+                        [{"op": "lecturer_days", "lecturer": self.lecturer.id, "available_days": ["Someday"]}]):
+            with self.assertRaises(ValueError):
+                run_scenario(changes)
+
+    def test_promote_writes_data_and_sessions_at_once(self):
+        # A new lecturer who only teaches on Fridays takes over C1
+        scenario = create_scenario("New hire", [{
+            "op": "add_lecturer", "reg_no": "L9", "name": "New hire", "courses": [self.courses[1].id],
+            "available_days": ["Friday"],
+        }])
+        self.assertEqual(scenario.report['changed'][0]['to']['day'], "Friday")
+        self.assertFalse(User.objects.filter(reg_no="L9").exists())
+
+        self.client.force_login(self.admin)
+        response = self.client.post(f'/api/scenarios/{scenario.id}/promote/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['changed'], 1)
+        course = Course.objects.select_related('lecturer').get(id=self.courses[1].id)
+        self.assertEqual((course.lecturer.reg_no, course.lecturer.available_days), ("L9", "Friday"))
+        self.assertEqual(Timetable.objects.get(course=course).day, "Friday")
+        self.assertEqual(self.client.post(f'/api/scenarios/{scenario.id}/promote/').status_code, 400)
+
+    def test_stale_scenarios_are_not_promoted(self):
+        scenario = create_scenario("Close", [{"op": "close_rooms", "rooms": [self.small.id]}])
+        Timetable.objects.filter(course=self.courses[2]).update(day="Thursday", week_start=week_minute("Thursday", time(9)),
+                                                                  week_end=week_minute("Thursday", time(12)))
+        bump_version()
+        with self.assertRaises(StaleScenario):
+            promote_scenario(scenario)
+        self.assertEqual(Timetable.objects.filter(room=self.small).count(), 2)
+
+    def test_scenario_api(self):
+        body = {"name": "Grow C0", "changes": [{"op": "resize_course", "course": self.courses[0].id, "students": 40}]}
+        self.assertEqual(self.client.post('/api/scenarios/', body, content_type='application/json').status_code, 403)
+        self.client.force_login(self.admin)
+        response = self.client.post('/api/scenarios/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        scenario = response.json()
+        self.assertEqual(scenario['report']['changed'][0]['course'], "C0")
+        self.assertEqual(self.client.get(f"/api/scenarios/{scenario['id']}/").json()['name'], "Grow C0")
+        self.assertEqual([row['id'] for row in self.client.get('/api/scenarios/').json()['scenarios']], [scenario['id']])
+        body['changes'] = [{"op": "resize_course", "course": 0, "students": 40}]
+        self.assertEqual(self.client.post('/api/scenarios/', body, content_type='application/json').status_code, 400)
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(name="Room 1", capacity=50)
+        self.lecturer = make_lecturer("L0")
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        self.other = User.objects.create(reg_no="S2", name="S2", role='student', password='x')
+        self.courses = [Course.objects.create(code=f"C{i}", name=f"Course {i}", lecturer=self.lecturer) for i in range(2)]
+        Enrolment.objects.create(user=self.student, course=self.courses[0])
+        Enrolment.objects.create(user=self.other, course=self.courses[1])
+
+    def changes(self, user, since):
+        response = self.client.get(f'/api/timetable/changes/?since={since}', HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_every_session_write_is_logged_in_order(self):
+        generate_timetable(time_limit=5)
+        session = Timetable.objects.get(course=self.courses[0])
+        self.client.post(f'/api/cancel-class/{session.id}/', HTTP_AUTHORIZATION=f"Bearer {issue_token(self.lecturer)}")
+        first, second = (course.id for course in self.courses)
+        self.courses[1].delete()
+
+        log = list(TimetableChange.objects.order_by('seq').values_list('course_id', 'action'))
+        self.assertEqual(sorted(log[:2]), [(first, 'created'), (second, 'created')])
+        self.assertEqual(log[2:], [(first, 'canceled'), (second, 'deleted')])
+
+        body = self.changes(self.student, 0)
+        self.assertEqual([change['action'] for change in body['changes']], ['created', 'canceled', 'deleted'])
+        self.assertIsNone(body['changes'][2]['session'])
+        self.assertEqual(body['changes'][1]['session'], TimetableSerializer(session).data | {'is_canceled': True})
+        self.assertEqual(body['seq'], TimetableChange.objects.latest('seq').seq)
+        self.assertEqual(self.changes(self.student, body['seq'])['changes'], [])
+        # The deleted course's earlier changes went with it
+        self.assertEqual([change['action'] for change in self.changes(self.lecturer, 0)['changes']],
+                         ['created', 'canceled', 'deleted'])
+
+    def test_moves_are_logged_as_updates(self):
+        generate_timetable(time_limit=5)
+        seq = self.changes(self.student, 0)['seq']
+        session = Timetable.objects.get(course=self.courses[0])
+        Room.objects.create(name="Room 0", capacity=20)  # Smaller, so the course moves there
+        generate_timetable(time_limit=5)
+        changes = self.changes(self.student, seq)['changes']
+        self.assertEqual([(change['timetable_id'], change['action']) for change in changes], [(session.id, 'updated')])
+        self.assertEqual(changes[0]['session']['room'], "Room 0")
+
+    def test_no_since_gives_the_latest_seq(self):
+        Timetable.objects.create(course=self.courses[1], day="Monday", start_time=time(9), end_time=time(12), room=self.room)
+        body = self.changes(self.student, '')
+        self.assertEqual((body['seq'], body['changes']), (TimetableChange.objects.get().seq, []))
+        response = self.client.get('/api/timetable/changes/?since=x', HTTP_AUTHORIZATION=f"Bearer {issue_token(self.student)}")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/api/timetable/changes/').status_code, 401)
+
+    def test_broker_wakes_waiting_streams(self):
+        async def wait():
+            waiter = broker.subscribe()
+            try:
+                threading.Timer(0.05, broker.notify).start()
+                return await broker.wait(waiter, 5), await broker.wait(waiter, 0.05)
+            finally:
+                broker.unsubscribe(waiter)
+
+        self.assertEqual(async_to_sync(wait)(), (True, False))
+        self.assertEqual(broker.waiters, set())
+
+    @override_settings(TIMETABLE_STREAM_SECONDS=0)
+    def test_stream_sends_changes_as_events(self):
+        Timetable.objects.create(course=self.courses[0], day="Monday", start_time=time(9), end_time=time(12), room=self.room)
+        Timetable.objects.create(course=self.courses[1], day="Tuesday", start_time=time(9), end_time=time(12), room=self.room)
+        token = issue_token(self.student)
+
+        async def read():
+            response = await self.async_client.get('/api/async/timetable/changes/', headers={
+                'Authorization': f"Bearer {token}", 'Last-Event-ID': '0',
+            })
+            return response, b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        response, body = async_to_sync(read)()
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [block for block in body.split('\n\n') if 'data:' in block]
+        self.assertEqual(len(events), 1)
+        lines = dict(line.split(': ', 1) for line in events[0].splitlines())
+        self.assertEqual(lines['event'], 'created')
+        self.assertEqual(json.loads(lines['data'])['session']['course'], "C0 - Course 0")
+
+
+class OccupancyTests(TestCase):
+    def test_index_finds_free_rooms_smallest_first(self):
+        monday = week_minute("Monday", time(0))
+        rooms = [(1, "A", 100), (2, "B", 30), (3, "C", 80), (4, "D", 80)]
+        sessions = [(1, monday + 540, monday + 720), (3, monday + 600, monday + 660), (2, monday + 840, monday + 1020)]
+        index = OccupancyIndex(rooms, sessions)
+
+        def free(spans, capacity=0):
+            return [room.name for room in index.free_rooms(spans, capacity)]
+
+        self.assertEqual(free([(monday + 540, monday + 720)]), ["B", "D"])
+        self.assertEqual(free([(monday + 540, monday + 720)], 50), ["D"])
+        self.assertEqual(free([(monday + 720, monday + 840)], 80), ["C", "D", "A"])  # Touching is not overlapping
+        self.assertEqual(free([(monday + 659, monday + 661)]), ["B", "D"])
+        self.assertEqual(free([(monday + 660, monday + 661)]), ["B", "C", "D"])
+        self.assertEqual(free([(monday + 480, monday + 1080)]), ["D"])
+        self.assertEqual(free([(monday + 540, monday + 600), (monday + 900, monday + 960)]), ["C", "D"])
+        self.assertEqual(index.count_free([(monday + 540, monday + 720)]), 2)
+        self.assertEqual([room.name for room in index.free_rooms([(0, 60)], limit=2)], ["B", "C"])
+
+    def test_free_room_search(self):
+        rooms = [Room.objects.create(name=f"Room {i}", capacity=capacity) for i, capacity in enumerate((40, 90, 120))]
+        course = Course.objects.create(code="C1", name="Course 1", lecturer=make_lecturer("L0"))
+        Timetable.objects.create(course=course, day="Thursday", start_time=time(13), end_time=time(16), room=rooms[1])
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(course.lecturer)}"}
+        clear_occupancy()
+
+        body = self.client.get('/api/rooms/free/?day=Thursday&start_time=14:00&end_time=17:00&capacity=80', **auth).json()
+        self.assertEqual(body['version'], current_version())
+        self.assertEqual((body['free'], [room['name'] for room in body['rooms']]), (1, ["Room 2"]))
+        query = '/api/rooms/free/?slot=Thursday 16:00-17:00&slot=Friday 09:00-12:00&capacity=80'
+        self.assertEqual([room['id'] for room in self.client.get(query, **auth).json()['rooms']], [rooms[1].id, rooms[2].id])
+
+        # A new session is seen on the next lookup
+        Timetable.objects.create(course=course, day="Friday", start_time=time(9), end_time=time(12), room=rooms[2])
+        self.assertEqual([room['name'] for room in self.client.get(query, **auth).json()['rooms']], ["Room 1"])
+
+        for bad in ('?day=Thursday', '?slot=Thursday 17:00-14:00', '?slot=Someday 09:00-10:00', '?slot=9-5', ''):
+            self.assertEqual(self.client.get(f'/api/rooms/free/{bad}', **auth).status_code, 400, bad)
+        student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        response = self.client.get(query, HTTP_AUTHORIZATION=f"Bearer {issue_token(student)}")
+        self.assertEqual(response.status_code, 403)
+
+
+class TermCalendarTests(TestCase):
+    def setUp(self):
+        self.term = Term.objects.create(name="Autumn", start=date(2026, 9, 7), end=date(2026, 10, 2))  # Four weeks
+        Holiday.objects.create(name="Founders", start=date(2026, 9, 14), end=date(2026, 9, 15))
+        self.lecturer = make_lecturer("L0")
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        course = Course.objects.create(code="C1", name="Course 1", lecturer=self.lecturer)
+        Enrolment.objects.create(user=self.student, course=course)
+        self.monday = Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12))
+        self.tuesday = Timetable.objects.create(course=course, day="Tuesday", start_time=time(13), end_time=time(16))
+
+    def test_patterns_expand_over_terms_outside_holidays(self):
+        calendar = TermCalendar(
+            [(date(2026, 9, 7), date(2026, 9, 18)), (date(2026, 9, 19), date(2026, 9, 25))],
+            [(date(2026, 9, 14), date(2026, 9, 15), "Founders")],
+        )
+        self.assertEqual(calendar.terms, [(date(2026, 9, 7), date(2026, 9, 25))])  # Back-to-back terms merge
+        self.assertFalse(calendar.holds(self.monday.week_start, date(2026, 9, 14)))
+        self.assertTrue(calendar.holds(self.monday.week_start, date(2026, 9, 21)))
+        self.assertFalse(calendar.holds(self.monday.week_start, date(2026, 9, 22)))  # A Tuesday
+        sessions = [{'id': 1, 'course': "C1", 'week_start': self.monday.week_start, 'start_time': "09:00:00",
+                     'end_time': "12:00:00", 'room': None, 'is_canceled': False}]
+        held = expand(sessions, date(2026, 9, 1), date(2026, 10, 31), calendar, {(1, date(2026, 9, 21)): True})
+        self.assertEqual([(row['date'], row['is_canceled']) for row in held],
+                         [("2026-09-07", False), ("2026-09-21", True)])
+
+    def test_calendar_and_single_week_cancellation(self):
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(self.lecturer)}"}
+        response = self.client.post(f'/api/cancel-class/{self.monday.id}/', {'date': "2026-09-21"}, **auth)
+        self.assertEqual(response.status_code, 200)
+        for day in ("2026-09-14", "2026-09-22", "2026-10-05"):  # Holiday, wrong weekday, after the term
+            response = self.client.post(f'/api/cancel-class/{self.monday.id}/', {'date': day}, **auth)
+            self.assertEqual(response.status_code, 400, day)
+        self.assertEqual(SessionOccurrence.objects.count(), 1)
+        self.assertFalse(Timetable.objects.get(id=self.monday.id).is_canceled)
+
+        student = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(self.student)}"}
+        body = self.client.get('/api/calendar/?start=2026-09-01&end=2026-10-31', **student).json()
+        held = [(row['date'], row['timetable_id'], row['is_canceled']) for row in body['occurrences']]
+        self.assertEqual(len(held), 6)  # Four weeks of two sessions, less the holiday's two
+        self.assertIn(("2026-09-21", self.monday.id, True), held)
+        self.assertIn(("2026-09-28", self.monday.id, False), held)
+        self.assertEqual(body['holidays'], [{'name': "Founders", 'start': "2026-09-14", 'end': "2026-09-15"}])
+        for bad in ('?start=2026-10-31&end=2026-09-01', '?start=2026-01-01&end=2027-06-01', '?start=soon'):
+            self.assertEqual(self.client.get(f'/api/calendar/{bad}', **student).status_code, 400, bad)
+
+    def test_single_week_cancellation_reaches_the_change_feed(self):
+        student = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(self.student)}"}
+        since = self.client.get('/api/timetable/changes/', **student).json()['seq']
+        version = current_version()
+        auth = {'HTTP_AUTHORIZATION': f"Bearer {issue_token(self.lecturer)}"}
+        self.client.post(f'/api/cancel-class/{self.monday.id}/', {'date': "2026-09-21"}, **auth)
+
+        self.assertGreater(current_version(), version)
+        changes = self.client.get(f'/api/timetable/changes/?since={since}', **student).json()['changes']
+        self.assertEqual([(change['timetable_id'], change['action']) for change in changes], [(self.monday.id, 'updated')])
+        self.assertFalse(changes[0]['session']['is_canceled'])  # The other weeks go ahead
+        self.assertEqual(changes[0]['session']['occurrence'], {'date': "2026-09-21", 'is_canceled': True})
+
+    def test_checkins_are_kept_per_occurrence(self):
+        for day in (date(2026, 9, 7), date(2026, 9, 7), date(2026, 9, 21)):
+            accepted, _ = record_checkins([(self.monday.id, self.student.id)], on=day)
+            self.assertEqual(len(accepted), 1)
+        record_checkins([(self.monday.id, self.student.id)], on=date(2026, 10, 5))  # Outside the term
+        self.assertEqual(
+            sorted(Attendance.objects.values_list('occurrence__date', flat=True), key=str),
+            [date(2026, 9, 7), date(2026, 9, 21), None],
+        )
+        # Rollups count every week attended; the student's only those held in the term
+        self.assertEqual(SessionAttendanceStats.objects.get(timetable=self.monday).attended, 3)
+        self.assertEqual(StudentAttendanceStats.objects.get(user=self.student).attended, 2)
+
+    def test_rates_divide_by_the_occurrences_held(self):
+        for day in (date(2026, 9, 7), date(2026, 9, 21)):
+            record_checkins([(self.monday.id, self.student.id)], on=day)
+        cancel_occurrence(self.tuesday, date(2026, 9, 29))
+
+        # Three Mondays and three Tuesdays outside the holiday, less the canceled week
+        stats = student_stats(self.student.id)['courses'][0]
+        self.assertEqual((stats['sessions'], stats['attended'], stats['rate']), (5, 2, 0.4))
+        self.assertEqual((stats['current_streak'], stats['best_streak']), (1, 1))  # The Tuesday between was missed
+        self.assertEqual([alert['user_id'] for alert in low_attendance(0.5)], [self.student.id])
+        self.assertEqual(low_attendance(0.4), [])
+
+
+class ValidationTests(TestCase):
+    def setUp(self):
+        self.small = Room.objects.create(name="Small", capacity=20)
+        self.big = Room.objects.create(name="Big", capacity=100)
+        part_timer = make_lecturer("L0")
+        part_timer.available_days = "Monday,Tuesday,Thursday"
+        part_timer.save()
+        lecturer = make_lecturer("L1")
+        self.courses = [
+            Course.objects.create(code="A", name="A", lecturer=part_timer, students=10),
+            Course.objects.create(code="B", name="B", lecturer=lecturer, students=10),
+            Course.objects.create(code="C", name="C", lecturer=lecturer, students=60),
+        ]
+        student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        for course in self.courses[:2]:
+            Enrolment.objects.create(user=student, course=course)
+        self.a, self.b, self.c = (
+            Timetable.objects.create(course=course, day=day, start_time=time(9), end_time=time(12), room=room)
+            for course, day, room in zip(self.courses, ("Monday", "Tuesday", "Wednesday"), (self.small, self.small, self.big))
+        )
+
+    def test_a_batch_reports_every_hard_conflict_once(self):
+        self.assertEqual(validate_timetable(), [])
+        a, b, c = self.a.id, self.b.id, self.c.id
+        edits = [
+            {'timetable_id': b, 'day': "Monday", 'start_time': time(10), 'end_time': time(13)},
+            {'timetable_id': c, 'room_id': self.small.id},
+            {'course_id': self.courses[0].id, 'day': "Friday", 'start_time': time(9), 'end_time': time(10), 'room_id': self.big.id},
+            {'course_id': self.courses[1].id, 'day': "Monday", 'start_time': time(11), 'end_time': time(12)},
+            {'course_id': self.courses[2].id, 'day': "Thursday", 'start_time': time(12), 'end_time': time(11)},
+        ]
+        conflicts = validate_edits(edits)
+        self.assertEqual([(conflict.edit, conflict.kind, conflict.other_id, conflict.other_edit) for conflict in conflicts], [
+            (0, 'room_clash', a, None), (0, 'student_clash', a, None),
+            (1, 'over_capacity', None, None),
+            (2, 'lecturer_unavailable', None, None),
+            (3, 'lecturer_clash', b, 0), (3, 'student_clash', a, None),
+            (4, 'bad_time', None, None),
+        ])
+        self.assertEqual(conflicts[0].message, "Small is already taken by A on Monday at 09:00:00.")
+        self.assertEqual(validate_edits(edits[:1], deleted=[a]), [])
+        with self.assertRaises(ValueError):
+            validate_edits([{'timetable_id': 999}])
+        with self.assertRaises(ValueError):
+            validate_edits([{'course_id': self.courses[0].id, 'day': "Monday"}])
+
+    def test_validate_endpoint_is_staff_only(self):
+        self.client.force_login(get_user_model().objects.create_user('admin', password='x', is_staff=True))
+        self.assertEqual(self.client.get('/api/timetable/validate/').json(), {'ok': True, 'conflicts': []})
+        edits = {'edits': [{'timetable_id': self.b.id, 'day': "Monday"}]}
+        body = self.client.post('/api/timetable/validate/', edits, content_type='application/json').json()
+        self.assertEqual([conflict['kind'] for conflict in body['conflicts']], ['room_clash', 'student_clash'])
+        self.assertFalse(body['ok'])
+        response = self.client.post('/api/timetable/validate/', {'edits': [{'timetable_id': 999}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/timetable/validate/').status_code, 403)
+
+    def test_admin_checks_an_edit_and_change_list_rows_together(self):
+        data = {'course': self.courses[1].id, 'day': "Monday", 'start_time': "10:00", 'end_time': "13:00", 'room': self.big.id}
+        form = TimetableAdminForm(data, instance=self.b)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.non_field_errors(), ["Students of B also have A on Monday at 09:00:00."])
+
+        # Each move is fine on its own; together they clash for the shared student
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.create_user('admin', password='x', is_staff=True, is_superuser=True)
+        formset_class = TimetableAdmin(Timetable, admin.site).get_changelist_formset(request)
+        data = {'form-TOTAL_FORMS': 2, 'form-INITIAL_FORMS': 2}
+        for i, (session, start, room) in enumerate(((self.a, "09:00", self.small), (self.b, "10:00", self.big))):
+            data.update({f'form-{i}-id': session.id, f'form-{i}-day': "Thursday", f'form-{i}-start_time': start,
+                         f'form-{i}-end_time': "12:00", f'form-{i}-room': room.id})
+        formset = formset_class(data, queryset=Timetable.objects.filter(id__in=[self.a.id, self.b.id]).order_by('id'))
+        self.assertFalse(formset.is_valid())
+        self.assertEqual([form.non_field_errors() for form in formset.forms],
+                         [[], ["Students of B also have A on Thursday at 09:00:00."]])
+
+    def test_generated_timetables_pass_the_output_check(self):
+        Timetable.objects.all().delete()
+        solution = generate_timetable()
+        self.assertTrue(solution.ok)
+        self.assertEqual((solution.stats['conflicts'], validate_timetable()), (0, []))
+
+
+@override_settings(DATABASE_READ_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not a TestCase: SQLite cannot back up a database with a write open
+    databases = '__all__'  # The replica too, once setUpClass has registered it
+
+    @classmethod
+    def setUpClass(cls):
+        # A file replica, refreshed from the primary by each test
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings['replica'] = connections.configure_settings({
+            'default': connections.settings['default'],
+            'replica': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.directory.name, 'replica.sqlite3'),
+                        'OPTIONS': {'init_command': 'PRAGMA query_only = ON'}},
+        })['replica']
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.directory.cleanup()
+
+    def setUp(self):
+        caches['timetable'].clear()
+        caches['default'].clear()
+        room = Room.objects.create(name="Room 1", capacity=50)
+        self.student = User.objects.create(reg_no="S1", name="S1", role='student', password='x')
+        course = Course.objects.create(code="C1", name="Course 1", lecturer=make_lecturer("L0"))
+        self.session = Timetable.objects.create(course=course, day="Monday", start_time=time(9), end_time=time(12), room=room)
+        Enrolment.objects.create(user=self.student, course=course)
+        self.admin = get_user_model().objects.create_user('admin', password='x', is_staff=True)
+        sync_replica('replica')
+
+        self.session.start_time, self.session.end_time = time(14), time(16)
+        self.session.save()  # Not on the replica yet
+
+    def test_reads_come_from_the_replica_until_the_user_writes(self):
+        auth = {'headers': {'Authorization': f"Bearer {issue_token(self.student)}"}}
+        self.assertEqual(self.client.get('/api/timetable/', **auth).json()[0]['start_time'], "09:00:00")
+        self.assertEqual(async_to_sync(self.async_client.get)('/api/async/timetable/', **auth).json()[0]['start_time'], "09:00:00")
+
+        self.assertEqual(self.client.post(f'/api/attendance/{self.session.id}/', **auth).status_code, 200)
+        self.assertEqual(self.client.get('/api/timetable/', **auth).json()[0]['start_time'], "14:00:00")
+
+        sync_replica('replica')
+        caches['default'].clear()  # The pin expires
+        self.assertEqual(self.client.get(f'/api/attendance/stats/students/{self.student.id}/', **auth).json()['courses'][0]['attended'], 1)
+
+    def test_streamed_exports_read_the_replica(self):
+        self.client.force_login(self.admin)
+        rows = [json.loads(line) for line in b''.join(self.client.get('/api/export/timetable.jsonl').streaming_content).splitlines()]
+        self.assertEqual([row['start_time'] for row in rows], ["09:00:00"])
+
+    def test_replicas_refuse_writes(self):
+        with self.assertRaises(Exception):
+            Room.objects.using('replica').create(name="Room 2", capacity=10)
+        self.assertEqual(Room.objects.using('replica').count(), 1)
@@ -0,0 +1,94 @@
+import json
+
+from django.core.cache import caches
+from django.db.models import F
+
+from .models import Timetable, TimetableVersion
+
+# Rendered documents are keyed by version, so they never go stale; the
+# 'timetable' cache only needs to evict the least recently used ones.
+DOCUMENT_CACHE = 'timetable'
+
+
+TIMETABLE_FIELDS = (
+    'id', 'course__code', 'course__name', 'day', 'start_time', 'end_time', 'week_start', 'week_end',
+    'room__name', 'is_canceled',
+)
+
+
+def timetable_row(row_id, code, name, day, start_time, end_time, week_start, week_end, room, is_canceled):
+    # Same shape as TimetableSerializer
+    return {
+        'id': row_id,
+        'course': f"{code} - {name}",
+        'day': day,
+        'start_time': start_time.isoformat(),
+        'end_time': end_time.isoformat(),
+        'week_start': week_start,
+        'week_end': week_end,
+        'room': room,
+        'is_canceled': is_canceled,
+    }
+
+
+def timetable_rows(queryset):
+    # Serializer output built from one joined values query
+    rows = queryset.order_by('id').values_list(*TIMETABLE_FIELDS)
+    return [timetable_row(*row) for row in rows.iterator(chunk_size=2000)]
+
+
+def current_version():
+    return TimetableVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+async def acurrent_version():
+    return await TimetableVersion.objects.filter(pk=1).values_list('version', flat=True).afirst() or 0
+
+
+def bump_version():
+    # Called inside the writing transaction, so the new version commits (or
+    # rolls back) together with the change it describes
+    if not TimetableVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        TimetableVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+def invalidate_timetable():
+    bump_version()
+
+
+def user_timetable(role, user_id):
+    # A lecturer's taught sessions, or the sessions of a student's enrolled courses
+    if role == 'lecturer':
+        return Timetable.objects.filter(course__lecturer_id=user_id)
+    return Timetable.objects.filter(course__enrolments__user_id=user_id)
+
+
+def timetable_etag(version, role, user_id):
+    return f'"{version}-{role}-{user_id}"'
+
+
+def timetable_document(version, role, user_id):
+    """Rendered JSON of a user's own timetable at ``version``."""
+    cache = caches[DOCUMENT_CACHE]
+    key = f"timetable:{version}:{role}:{user_id}"
+    body = cache.get(key)
+    if body is None:
+        body = _render(timetable_rows(user_timetable(role, user_id)))
+        cache.set(key, body)
+    return body
+
+
+async def atimetable_document(version, role, user_id):
+    """``timetable_document`` for async views, rows read with async iteration."""
+    cache = caches[DOCUMENT_CACHE]
+    key = f"timetable:{version}:{role}:{user_id}"
+    body = await cache.aget(key)
+    if body is None:
+        rows = user_timetable(role, user_id).order_by('id').values_list(*TIMETABLE_FIELDS)
+        body = _render([timetable_row(*row) async for row in rows])
+        await cache.aset(key, body)
+    return body
+
+
+def _render(rows):
+    return json.dumps(rows, separators=(',', ':')).encode()
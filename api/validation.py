@@ -0,0 +1,247 @@
+"""
+Hard-constraint checks of timetable edits, a whole batch in one pass.
+
+``Validator`` indexes the sessions edits are checked against by room and by
+lecturer, each an ``IntervalIndex`` of week minutes, and by course; students
+clash when two courses they share overlap, so a session is compared with the
+few sessions of the courses its students also take. Checking a session costs
+a few bisects however big the timetable is. A batch is checked
+in order against the sessions it leaves untouched and the edits before it,
+so a clash within the batch is reported once; ``validate_timetable`` checks
+every live session that way, against an empty week.
+
+The constraints are the scheduler's: no room, lecturer or student in two
+places at once, rooms big enough for the class, sessions on the lecturer's
+available days. They are checked on any times, not only the slot grid's, so
+they hold for hand edits too. Conflicts are reported rather than raised;
+callers decide whether they block.
+"""
+import itertools
+from collections import defaultdict, namedtuple
+
+from .models import Course, Enrolment, Room, Timetable, User
+from .slots import MINUTES_PER_DAY, WEEK, IntervalIndex, day_and_time, week_minute
+from .solver import bits
+
+CONFLICT_KINDS = ('bad_time', 'room_clash', 'lecturer_clash', 'student_clash', 'over_capacity', 'lecturer_unavailable')
+
+# A session as checked; a None timetable_id is a session still to be created
+Session = namedtuple('Session', 'timetable_id course_id week_start week_end room_id')
+# days: the weekday numbers the lecturer teaches on, None for any day
+CourseInfo = namedtuple('CourseInfo', 'code lecturer_id size days')
+# edit and other_edit are positions in the checked batch; other_edit is None
+# when the other session is one the batch leaves untouched
+Conflict = namedtuple('Conflict', 'edit timetable_id kind other_id other_edit message')
+
+SESSION_FIELDS = ('id', 'course_id', 'week_start', 'week_end', 'room_id')
+
+
+class Validator:
+    def __init__(self, courses, rooms, neighbours, sessions=()):
+        """
+        ``courses``: course id -> ``CourseInfo``; ``rooms``: room id ->
+        ``(name, capacity)``; ``neighbours``: course id -> the ids of the
+        other courses sharing a student with it; ``sessions``: the
+        ``Session`` rows edits are checked against.
+        """
+        self.courses = courses
+        self.rooms = rooms
+        self.neighbours = neighbours
+        self.sessions = {}  # timetable id -> Session
+        self.taken = defaultdict(IntervalIndex)  # ('room'|'lecturer', id) -> (timetable id, edit)
+        self.by_course = defaultdict(list)  # course id -> (start, end, (timetable id, edit))
+        for session in sessions:
+            self.sessions[session.timetable_id] = session
+            self._add(session, None)
+
+    def check(self, edits, deleted=()):
+        """
+        Conflicts of the ``Session`` rows of ``edits`` once they replace the
+        rows of the same id, and the ``deleted`` ids are gone. The validator
+        is left as it was. Raises ValueError for an unknown course or room.
+        """
+        for session in edits:
+            if session.course_id not in self.courses:
+                raise ValueError(f"No course {session.course_id}")
+            if session.room_id is not None and session.room_id not in self.rooms:
+                raise ValueError(f"No room {session.room_id}")
+        replaced = [
+            self.sessions[timetable_id] for timetable_id in
+            dict.fromkeys(itertools.chain((session.timetable_id for session in edits), deleted))
+            if timetable_id in self.sessions
+        ]
+        for session in replaced:
+            self._remove(session)
+        added = []
+        try:
+            conflicts = []
+            for edit, session in enumerate(edits):
+                conflicts += self._conflicts(edit, session, edits)
+                if session.week_start < session.week_end:
+                    self._add(session, edit)
+                    added.append((session, edit))
+        finally:
+            for session, edit in added:
+                self._remove(session, edit)
+            for session in replaced:
+                self._add(session, None)
+        return conflicts
+
+    def _resources(self, session):
+        resources = [('lecturer', self.courses[session.course_id].lecturer_id)]
+        if session.room_id is not None:
+            resources.append(('room', session.room_id))
+        return resources
+
+    def _add(self, session, edit):
+        key = (session.timetable_id, edit)
+        for resource in self._resources(session):
+            self.taken[resource].add(session.week_start, session.week_end, key)
+        self.by_course[session.course_id].append((session.week_start, session.week_end, key))
+
+    def _remove(self, session, edit=None):
+        key = (session.timetable_id, edit)
+        for resource in self._resources(session):
+            self.taken[resource].remove(session.week_start, session.week_end, key)
+        self.by_course[session.course_id].remove((session.week_start, session.week_end, key))
+
+    def _describe(self, session):
+        day, start = day_and_time(session.week_start)
+        return f"{self.courses[session.course_id].code} on {day} at {start}"
+
+    def _conflicts(self, edit, session, edits):
+        course = self.courses[session.course_id]
+        found = []
+
+        def conflict(kind, message, other=(None, None)):
+            found.append(Conflict(edit, session.timetable_id, kind, other[0], other[1], message))
+
+        start, end = session.week_start, session.week_end
+        if end <= start or (end - 1) // MINUTES_PER_DAY != start // MINUTES_PER_DAY:
+            conflict('bad_time', f"{self._describe(session)} must end after it starts, on the same day.")
+            return found
+        if course.days is not None and start // MINUTES_PER_DAY not in course.days:
+            conflict('lecturer_unavailable', f"The lecturer of {course.code} does not teach on {WEEK[start // MINUTES_PER_DAY]}.")
+        if session.room_id is not None:
+            name, capacity = self.rooms[session.room_id]
+            if capacity < course.size:
+                conflict('over_capacity', f"{name} seats {capacity}, too few for the {course.size} students of {course.code}.")
+
+        def other_session(key):
+            timetable_id, other_edit = key
+            return edits[other_edit] if other_edit is not None else self.sessions[timetable_id]
+
+        clashes = [('room_clash', ('room', session.room_id)), ('lecturer_clash', ('lecturer', course.lecturer_id))]
+        for kind, resource in clashes:
+            if resource[1] is None:
+                continue
+            for key in self.taken[resource].overlapping(start, end):
+                what = self.rooms[session.room_id][0] if kind == 'room_clash' else "The lecturer"
+                conflict(kind, f"{what} is already taken by {self._describe(other_session(key))}.", key)
+        for other in self.neighbours.get(session.course_id, ()):
+            for other_start, other_end, key in self.by_course.get(other, ()):
+                if other_start < end and start < other_end:
+                    conflict('student_clash', f"Students of {course.code} also have {self._describe(other_session(key))}.", key)
+        return found
+
+
+def _weekdays(days):
+    return frozenset(WEEK.index(day) for day in days if day in WEEK) or None
+
+
+def _neighbours(groups):
+    # Course id -> the other courses of every group (course ids taken together) it is in
+    found = defaultdict(set)
+    for group in groups:
+        for course_id in group:
+            found[course_id].update(group)
+    return {course_id: tuple(others - {course_id}) for course_id, others in found.items()}
+
+
+def load_validator(sessions=True):
+    """A validator of the live data, holding the live sessions unless ``sessions`` is false."""
+    rooms = {room_id: (name, capacity) for room_id, name, capacity in Room.objects.values_list('id', 'name', 'capacity')}
+    days = {
+        lecturer.id: _weekdays(lecturer.get_available_days())
+        for lecturer in User.objects.filter(role='lecturer').exclude(available_days='').only('id', 'available_days')
+    }
+    enrolled = defaultdict(int)
+    groups = set()  # The sets of courses students take together
+    for _, rows in itertools.groupby(
+        Enrolment.objects.order_by('user_id').values_list('user_id', 'course_id').iterator(chunk_size=5000),
+        key=lambda row: row[0],
+    ):
+        taken = tuple(sorted(course_id for _, course_id in rows))
+        for course_id in taken:
+            enrolled[course_id] += 1
+        if len(taken) > 1:
+            groups.add(taken)
+    courses = {
+        course_id: CourseInfo(code, lecturer_id, max(students, enrolled[course_id]), days.get(lecturer_id))
+        for course_id, code, lecturer_id, students in Course.objects.values_list('id', 'code', 'lecturer_id', 'students')
+    }
+    live = [Session(*row) for row in Timetable.objects.values_list(*SESSION_FIELDS).iterator(chunk_size=5000)] if sessions else []
+    return Validator(courses, rooms, _neighbours(groups), live)
+
+
+def problem_validator(problem, sessions=()):
+    """A validator from the scheduler's ``Problem``, for checking its output."""
+    courses = {}
+    for course in problem.courses:
+        days = frozenset(problem.slot_times[slot][0] // MINUTES_PER_DAY for slot in bits(course.slots))
+        courses[course.id] = CourseInfo(course.code, course.lecturer_id, course.size, days)
+    rooms = {room.id: (f"Room {room.id}", room.capacity) for room in problem.rooms}
+    neighbours = _neighbours([problem.courses[c].id for c in group] for group in problem.groups)
+    return Validator(courses, rooms, neighbours, [session for session in sessions if session.course_id in courses])
+
+
+def check_published(problem, timetable_ids):
+    """Conflicts of the sessions the scheduler just wrote, ``timetable_ids``, with the whole timetable."""
+    sessions = [Session(*row) for row in Timetable.objects.order_by('id').values_list(*SESSION_FIELDS)]
+    validator = problem_validator(problem, [session for session in sessions if session.timetable_id not in timetable_ids])
+    return validator.check([session for session in sessions if session.timetable_id in timetable_ids])
+
+
+def resolve_edits(validator, records):
+    """
+    ``Session`` rows from edit records: dicts with an optional
+    ``timetable_id`` and any of ``course_id``, ``day``, ``start_time``,
+    ``end_time`` and ``room_id``. Fields an edit of an existing session
+    leaves out keep their value; a new session needs all but the room.
+    Raises ValueError for an unknown session or a new one missing fields.
+    """
+    sessions = []
+    for record in records:
+        timetable_id = record.get('timetable_id')
+        if timetable_id is not None:
+            current = validator.sessions.get(timetable_id)
+            if current is None:
+                raise ValueError(f"No session {timetable_id}")
+            day, start_time = day_and_time(current.week_start)
+            end_time = day_and_time(current.week_end)[1]
+            fields = {'course_id': current.course_id, 'day': day, 'start_time': start_time, 'end_time': end_time,
+                      'room_id': current.room_id}
+        else:
+            fields = {'room_id': None}
+        fields.update((name, value) for name, value in record.items() if name != 'timetable_id')
+        missing = [name for name in ('course_id', 'day', 'start_time', 'end_time') if fields.get(name) is None]
+        if missing:
+            raise ValueError(f"A new session needs {', '.join(missing)}")
+        sessions.append(Session(
+            timetable_id, fields['course_id'], week_minute(fields['day'], fields['start_time']),
+            week_minute(fields['day'], fields['end_time']), fields['room_id'],
+        ))
+    return sessions
+
+
+def validate_edits(records, deleted=()):
+    """Conflicts of a batch of edit records (see ``resolve_edits``) with the live timetable."""
+    validator = load_validator()
+    return validator.check(resolve_edits(validator, records), deleted)
+
+
+def validate_timetable():
+    """Every conflict of the live timetable."""
+    validator = load_validator(sessions=False)
+    sessions = [Session(*row) for row in Timetable.objects.order_by('week_start', 'id').values_list(*SESSION_FIELDS)]
+    return validator.check(sessions)
@@ -1,11 +1,38 @@
-from django.shortcuts import render
+import hmac
+import io
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
+from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.contrib.auth.hashers import check_password
-from .models import User, Timetable, Attendance
-from .serializers import LoginSerializer, TimetableSerializer, AttendanceSerializer
-from .ai_scheduler import generate_timetable
+from django.contrib.auth.hashers import check_password, make_password
+from .models import User, Course, Timetable, Attendance, ScheduleJob, Scenario
+from .auth import issue_feed_token, issue_token, load_feed_token, session_user
+from .serializers import (LoginSerializer, BulkAttendanceSerializer, CalendarSerializer, CancelClassSerializer,
+                          EvaluateSerializer, FreeRoomSearchSerializer, NewScenarioSerializer, ScenarioSerializer,
+                          ScheduleJobSerializer, ValidateTimetableSerializer)
+from .attendance import checkin_buffer, record_checkins
+from .analytics import course_stats, low_attendance, session_stats, student_stats
+from .timetable_cache import current_version, timetable_document, timetable_etag, user_timetable
+from .jobs import submit_generation
+from .ai_scheduler import evaluate_timetable, scheduler_weights
+from .objectives import Weights
+from .scenarios import StaleScenario, create_scenario, promote_scenario
+from .changes import PAGE_SIZE, changes_since, latest_seq
+from .occupancy import occupancy
+from .occurrences import cancel_occurrence, user_occurrences
+from .validation import validate_edits, validate_timetable
+from .importer import KINDS, detect_format, import_stream
+from .exports import FORMATS, ICAL_TYPE, attendance_export, ical_feed, timetable_export
+from .metrics import registry
+from .routing import ReplicaReadsMixin, read_db
 
 # Create your views here.
 
@@ -15,63 +42,430 @@ class LoginView(APIView):
         if serializer.is_valid():
             reg_no = serializer.validated_data['reg_no']
             password = serializer.validated_data['password']
-            try:
-                user = User.objects.get(reg_no=reg_no)
-                if check_password(password, user.password):
-                    request.session['user_id'] = user.id  # Store user in session
-                    return Response({"role": user.role}, status=status.HTTP_200_OK)
-                return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
-            except User.DoesNotExist:
+            user = User.objects.filter(reg_no=reg_no).only('id', 'role', 'password').first()
+            if user is None:
                 return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+            def rehash(raw_password):
+                # Hash made with other hasher settings; store it the current way
+                User.objects.filter(id=user.id).update(password=make_password(raw_password))
+
+            if check_password(password, user.password, setter=rehash):
+                request.session['user_id'] = user.id  # Store user in session
+                return Response({"role": user.role, "token": issue_token(user), "feed_token": issue_feed_token(user)},
+                                status=status.HTTP_200_OK)
+            return Response({"error": "Invalid credentials"}, status=status.HTTP_401_UNAUTHORIZED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class TimetableView(APIView):
+class TimetableView(ReplicaReadsMixin, APIView):
     def get(self, request):
-        user_id = request.session.get('user_id')
-        if not user_id:
+        user = session_user(request)
+        if user is None:
             return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id, role = user
+
+        # The timetable only changes on generation, cancellation and admin
+        # edits; clients that already hold this version get an empty 304.
+        version = current_version()
+        etag = timetable_etag(version, role, user_id)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(timetable_document(version, role, user_id), content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
-        user = User.objects.get(id=user_id)
-        if user.role == 'lecturer':
-            timetables = Timetable.objects.filter(course__lecturer=user)
-        else:  # student
-            timetables = Timetable.objects.all()  #assume all courses for students
-        serializer = TimetableSerializer(timetables, many=True)
-        return Response(serializer.data)
+class TimetableChangesView(APIView):
+    # Changes to the caller's sessions after ?since=<seq>; without since, just
+    # the latest seq. Clients read seq, load /api/timetable/, then poll here
+    # (or stream) from that seq, upserting sessions and dropping deleted ones
+    def get(self, request):
+        user = session_user(request)
+        if user is None:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id, role = user
+        latest = latest_seq()
+        since = request.query_params.get('since')
+        if not since:
+            return Response({"seq": latest, "changes": [], "more": False})
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"error": "since must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        changes = changes_since(role, user_id, since)
+        more = len(changes) == PAGE_SIZE
+        # Every change up to latest was committed before the query above, so
+        # a client with no more pages can skip straight to it
+        seq = changes[-1]['seq'] if more else max(since, latest)
+        return Response({"seq": seq, "changes": changes, "more": more})
 
 class CancelClassView(APIView):
     def post(self, request, timetable_id):
-        user_id = request.session.get('user_id')
-        if not user_id or User.objects.get(id=user_id).role != 'lecturer':
+        user = session_user(request)
+        if user is None or user.role != 'lecturer':
             return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        serializer = CancelClassSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        day = serializer.validated_data['date']
 
         try:
             timetable = Timetable.objects.get(id=timetable_id)
-            timetable.is_canceled = True
-            timetable.save()
-            return Response({"message": "Class canceled"})
         except Timetable.DoesNotExist:
             return Response({"error": "Timetable not found"}, status=status.HTTP_404_NOT_FOUND)
+        if day is not None:
+            try:
+                cancel_occurrence(timetable, day)
+            except ValueError as error:
+                return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"message": f"Class canceled on {day.isoformat()}"})
+        timetable.is_canceled = True
+        timetable.save()
+        return Response({"message": "Class canceled"})
 
 class AttendanceView(APIView):
     def post(self, request, timetable_id):
-        user_id = request.session.get('user_id')
-        if not user_id:
+        user = session_user(request)
+        if user is None:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id = user.id
+
+        if settings.ATTENDANCE_BUFFER_ENABLED:
+            # Written with the next batch; unknown sessions are dropped then
+            checkin_buffer.add(timetable_id, user_id)
+            return Response({"message": "Attendance queued"}, status=status.HTTP_202_ACCEPTED)
+
+        # Repeated taps are accepted again rather than tripping the unique constraint
+        accepted, _ = record_checkins([(timetable_id, user_id)])
+        if not accepted:
+            return Response({"error": "Timetable not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"message": "Attendance marked"})
+
+class BulkAttendanceView(APIView):
+    def post(self, request):
+        user = session_user(request)
+        if user is None:
             return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id, role = user
+
+        serializer = BulkAttendanceSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        records = serializer.validated_data['records']
+        day = serializer.validated_data['date']
 
+        # Students may only check themselves in, today; lecturers submit for
+        # their own classes, and records for anyone else's come back rejected
+        lecturer_id = user_id if role == 'lecturer' else None
+        if role != 'lecturer':
+            records = [(timetable, user or user_id) for timetable, user in records]
+            if any(user != user_id for _, user in records):
+                return Response({"error": "Students can only mark their own attendance"}, status=status.HTTP_403_FORBIDDEN)
+            if day is not None:
+                return Response({"error": "Only lecturers can mark attendance for another date"}, status=status.HTTP_403_FORBIDDEN)
+        elif any(user is None for _, user in records):
+            return Response({"error": "user_id is required for every record"}, status=status.HTTP_400_BAD_REQUEST)
+
+        accepted, rejected = record_checkins(records, on=day, lecturer_id=lecturer_id)
+        return Response({
+            "accepted": len(accepted),
+            "rejected": [{"timetable_id": t, "user_id": u} for t, u in rejected],
+        })
+
+def session_role(request):
+    # (user_id, role) of the logged-in user, or (None, None)
+    return session_user(request) or (None, None)
+
+class CourseAttendanceStatsView(ReplicaReadsMixin, APIView):
+    def get(self, request, course_id):
+        user_id, role = session_role(request)
+        if role != 'lecturer':
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
         try:
-            timetable = Timetable.objects.get(id=timetable_id)
-            Attendance.objects.create(
-                timetable=timetable,
-                user_id=user_id,
-                attended=True
-            )
-            return Response({"message": "Attendance marked"})
+            course = Course.objects.get(id=course_id, lecturer_id=user_id)
+        except Course.DoesNotExist:
+            return Response({"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(course_stats(course))
+
+class SessionAttendanceStatsView(ReplicaReadsMixin, APIView):
+    def get(self, request, timetable_id):
+        user_id, role = session_role(request)
+        if role != 'lecturer':
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            timetable = Timetable.objects.select_related('course').get(id=timetable_id, course__lecturer_id=user_id)
         except Timetable.DoesNotExist:
             return Response({"error": "Timetable not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(session_stats(timetable))
+
+class StudentAttendanceStatsView(ReplicaReadsMixin, APIView):
+    def get(self, request, student_id):
+        user_id, role = session_role(request)
+        if not user_id:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        if role != 'lecturer' and student_id != user_id:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(student_stats(student_id))
+
+class AttendanceAlertsView(ReplicaReadsMixin, APIView):
+    # Students below ?threshold= (default 0.75) in the lecturer's courses
+    def get(self, request):
+        user_id, role = session_role(request)
+        if role != 'lecturer':
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            threshold = float(request.query_params.get('threshold', 0.75))
+            if not (math.isfinite(threshold) and 0 <= threshold <= 1):
+                raise ValueError(threshold)
+            course_id = request.query_params.get('course')
+            course_id = int(course_id) if course_id else None
+        except ValueError:
+            return Response({"error": "Invalid threshold or course"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"threshold": threshold, "alerts": low_attendance(threshold, lecturer_id=user_id, course_id=course_id)})
 
 class GenerateTimetableView(APIView):
+    # Staff only; generation runs as a background job, poll its status
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        incremental = str(request.data.get('incremental', request.query_params.get('incremental', ''))).lower()
+        job, created = submit_generation(incremental=incremental in ('1', 'true'))
+        data = ScheduleJobSerializer(job).data
+        if not created:
+            data['message'] = "A timetable generation job is already running"
+            return Response(data, status=status.HTTP_409_CONFLICT)
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+class EvaluateTimetableView(APIView):
+    # Staff and lecturers: soft-objective scores of the live timetable (GET),
+    # or of it after the proposed moves (POST {"moves": [...], "weights": {...}})
+    def get(self, request):
+        return self.post(request)
+
+    def post(self, request):
+        _, role = session_role(request)
+        if role != 'lecturer' and not request.user.is_staff:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        serializer = EvaluateSerializer(data=request.data if request.method == 'POST' else {})
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        weights = (scheduler_weights() or Weights())._replace(**serializer.validated_data['weights'])
+        moves = [(move['timetable_id'], move['day'], move['start_time'], move['room_id'])
+                 for move in serializer.validated_data['moves']]
+        try:
+            return Response(evaluate_timetable(moves, weights))
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+class FreeRoomsView(APIView):
+    # Staff and lecturers: rooms of at least ?capacity= seats free in the
+    # given span(s), smallest first, from the in-memory occupancy index
+    def get(self, request):
+        _, role = session_role(request)
+        if role != 'lecturer' and not request.user.is_staff:
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        serializer = FreeRoomSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        query = serializer.validated_data
+        index = occupancy()
+        rooms = index.free_rooms(query['spans'], query['capacity'], query['limit'])
+        return Response({
+            "version": index.version,
+            "free": index.count_free(query['spans'], query['capacity']),
+            "rooms": [room._asdict() for room in rooms],
+        })
+
+class CalendarView(ReplicaReadsMixin, APIView):
+    # The user's dated sessions from ?start= to ?end=, expanded from the
+    # weekly timetable over the term calendar
+    def get(self, request):
+        user = session_user(request)
+        if user is None:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        user_id, role = user
+        serializer = CalendarSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        start = serializer.validated_data.get('start') or timezone.localdate()
+        end = serializer.validated_data.get('end') or start + timedelta(days=6)
+        try:
+            return Response(user_occurrences(role, user_id, start, end))
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+class ImportView(APIView):
+    # Staff only (Django admin users): upload a CSV, JSON Lines or JSON file
+    # as "file", with "kind" for CSV and "format" when the name lacks one
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "file is required"}, status=status.HTTP_400_BAD_REQUEST)
+        kind = request.data.get('kind') or None
+        fmt = request.data.get('format') or detect_format(upload.name)
+        if kind is not None and kind not in KINDS:
+            return Response({"error": f"kind must be one of {', '.join(KINDS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        if fmt is None or (fmt == 'csv' and kind is None):
+            return Response({"error": "Give the format (csv, jsonl, json) and, for CSV, the kind"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Large uploads are spooled to disk by Django; read them line by line
+        stream = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            report = import_stream(stream, fmt, kind)
+        except ValueError as exc:  # Unreadable JSON document, or not an object
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
+
+class AnyMediaRenderer(JSONRenderer):
+    # Streaming views send their own content type; accept any Accept header
+    # (text/csv, text/calendar) and keep error bodies JSON
+    media_type = '*/*'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context['response']['Content-Type'] = JSONRenderer.media_type
+        return super().render(data, accepted_media_type, renderer_context)
+
+def export_response(chunks, content_type, filename):
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+class TimetableExportView(ReplicaReadsMixin, APIView):
+    # Staff only: every session as JSON Lines or CSV, streamed
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer, AnyMediaRenderer]
+
+    def get(self, request, fmt):
+        return export_response(timetable_export(Timetable.objects.using(read_db()), fmt), FORMATS[fmt], f"timetable.{fmt}")
+
+class AttendanceExportView(ReplicaReadsMixin, APIView):
+    # Staff only: every attendance record as JSON Lines or CSV, streamed
+    permission_classes = [IsAdminUser]
+    renderer_classes = [JSONRenderer, AnyMediaRenderer]
+
+    def get(self, request, fmt):
+        return export_response(attendance_export(fmt, Attendance.objects.using(read_db())), FORMATS[fmt], f"attendance.{fmt}")
+
+class TimetableFeedView(ReplicaReadsMixin, APIView):
+    # The caller's own sessions as iCalendar. Calendar apps cannot send an
+    # Authorization header, so the feed token from login may come as ?token=
+    renderer_classes = [JSONRenderer, AnyMediaRenderer]
+
+    def get(self, request):
+        user = session_user(request)
+        if user is None and request.query_params.get('token'):
+            user = load_feed_token(request.query_params['token'])
+        if user is None:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        feed = ical_feed(user_timetable(user.role, user.id).using(read_db()), request.get_host())
+        response = StreamingHttpResponse(feed, content_type=ICAL_TYPE)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+def metrics_allowed(request):
+    # Staff users, or a scraper presenting METRICS_TOKEN
+    if request.user.is_staff:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token, settings.METRICS_TOKEN)
+
+class MetricsView(APIView):
+    # Prometheus scrape target
+    renderer_classes = [JSONRenderer, AnyMediaRenderer]
+
+    def get(self, request):
+        if not settings.METRICS_ENABLED:
+            return Response({"error": "Metrics are disabled"}, status=status.HTTP_404_NOT_FOUND)
+        if not metrics_allowed(request):
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class SlowQueriesView(APIView):
+    # The latest queries slower than METRICS_SLOW_QUERY_MS, oldest first
     def get(self, request):
-        # Admin-only endpoint
-        generate_timetable()
-        return Response({"message": "Timetable generated successfully"})
\ No newline at end of file
+        if not settings.METRICS_ENABLED:
+            return Response({"error": "Metrics are disabled"}, status=status.HTTP_404_NOT_FOUND)
+        if not metrics_allowed(request):
+            return Response({"error": "Unauthorized"}, status=status.HTTP_403_FORBIDDEN)
+        return Response({"threshold_ms": settings.METRICS_SLOW_QUERY_MS, "queries": registry.samples()})
+
+class ScheduleJobView(APIView):
+    # Any logged-in user: the staff user who started the job, or an API user
+    def get(self, request, job_id):
+        if session_user(request) is None and not request.user.is_staff:
+            return Response({"error": "Not authenticated"}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            job = ScheduleJob.objects.get(id=job_id)
+        except ScheduleJob.DoesNotExist:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ScheduleJobSerializer(job).data)
+
+class ValidateTimetableView(APIView):
+    # Staff only: hard-constraint conflicts of the live timetable (GET), or of
+    # it after a batch of edits and deletions (POST {"edits": [...], "delete": [...]})
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return self.post(request)
+
+    def post(self, request):
+        serializer = ValidateTimetableSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        edits, deleted = serializer.validated_data['edits'], serializer.validated_data['delete']
+        try:
+            conflicts = validate_edits(edits, deleted) if edits or deleted else validate_timetable()
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"ok": not conflicts, "conflicts": [conflict._asdict() for conflict in conflicts]})
+
+class ScenarioListView(APIView):
+    # Staff only: the latest what-if scenarios (GET), or run and save a new
+    # one (POST {"name": ..., "changes": [...], "mode": "reschedule"})
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        scenarios = Scenario.objects.order_by('-id').values(
+            'id', 'name', 'mode', 'base_version', 'created_at', 'promoted_at'
+        )[:100]
+        return Response({"version": current_version(), "scenarios": list(scenarios)})
+
+    def post(self, request):
+        serializer = NewScenarioSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            scenario = create_scenario(**serializer.validated_data)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ScenarioSerializer(scenario).data, status=status.HTTP_201_CREATED)
+
+class ScenarioView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, scenario_id):
+        try:
+            scenario = Scenario.objects.get(id=scenario_id)
+        except Scenario.DoesNotExist:
+            return Response({"error": "Scenario not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(ScenarioSerializer(scenario).data)
+
+class PromoteScenarioView(APIView):
+    # Staff only: make a scenario's data changes and sessions live, all at once
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, scenario_id):
+        try:
+            scenario = Scenario.objects.get(id=scenario_id)
+        except Scenario.DoesNotExist:
+            return Response({"error": "Scenario not found"}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            solution = promote_scenario(scenario)
+        except StaleScenario as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"version": current_version(), "changed": len(solution.changed)})
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',  # First, so it times everything below
+    'api.routing.ReplicaPinMiddleware',  # Outside the session middleware, so it sees sessions saved
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -73,18 +76,70 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'smartdaro.wsgi.application'
+ASGI_APPLICATION = 'smartdaro.asgi.application'  # Serves the async views under api/async/
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# The primary ("default") takes every write. DATABASE_REPLICAS lists read
+# replicas as comma-separated SQLite files: copies of the primary kept by a
+# replication tool, or refreshed with `manage.py sync_replicas` to try them
+# locally. Replicas are opened read-only; which views read from them, and how
+# a user who just wrote is kept on the primary for
+# DATABASE_REPLICA_PIN_SECONDS, is in api/routing.py.
+# Connections stay open for DATABASE_CONN_MAX_AGE seconds (0: one per request,
+# "none": for good) and are checked before reuse. SQLITE_WAL=1 puts the
+# primary in write-ahead-log mode, so readers do not wait for the writer;
+# that rewrites the database file's header once.
+
+DATABASE_CONN_MAX_AGE = os.environ.get('DATABASE_CONN_MAX_AGE', '60')
+DATABASE_CONN_MAX_AGE = None if DATABASE_CONN_MAX_AGE.lower() == 'none' else int(DATABASE_CONN_MAX_AGE)
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': 'PRAGMA journal_mode=WAL'} if os.environ.get('SQLITE_WAL') == '1' else {},
     }
 }
 
+DATABASE_READ_REPLICAS = []
+for number, path in enumerate(filter(None, os.environ.get('DATABASE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path.strip(),
+        'CONN_MAX_AGE': DATABASE_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': 'PRAGMA query_only = ON'},
+        'TEST': {'MIRROR': 'default'},  # Tests read what they wrote
+    }
+    DATABASE_READ_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['api.routing.ReplicaRouter']
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The 'timetable' cache holds rendered timetable documents keyed by timetable
+# version. Entries never go stale, so a per-process local-memory cache is safe;
+# it evicts the least recently used documents past MAX_ENTRIES.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'timetable': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'timetable',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 10000},  # Roughly one document per active user
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -126,3 +181,117 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Timetable scheduler
+# Backend is "auto" (greedy, then OR-Tools CP-SAT if installed and courses are
+# left unplaced), "greedy" or "cpsat". The time limit is in seconds of wall-clock
+# time; SCHEDULER_WORKERS (CP-SAT's search threads) defaults to the number of
+# CPUs.
+# A full generation runs SCHEDULER_STARTS seeded searches and keeps the best.
+# They run one after another in the generating process unless
+# SCHEDULER_START_WORKERS names a number of processes to spread them over;
+# such a pool is forked from whatever runs the job, the web process included
+# with the "thread" runner below. Starts share the best score so far and give
+# up once they fall behind it, so to turn multistart on, raise
+# SCHEDULER_STARTS (8 is a good start) and, with the "worker" runner, set
+# SCHEDULER_START_WORKERS to that machine's CPUs. In one process the timetable
+# depends only on the number of starts and the seed, so pin both to reproduce
+# one.
+
+SCHEDULER_BACKEND = 'auto'
+SCHEDULER_TIME_LIMIT = 30
+SCHEDULER_WORKERS = None
+SCHEDULER_STARTS = 1
+SCHEDULER_START_WORKERS = None
+SCHEDULER_SEED = 0
+
+# Weights of the soft objectives a full generation then minimises (see
+# api/objectives.py): empty seats, hours over a lecturer's max_hours_per_week,
+# uneven daily loads, hours outside preferred days, idle hours in students'
+# days. None places sessions without optimising them.
+SCHEDULER_WEIGHTS = {
+    'wasted_seats': 1.0,
+    'overload': 50.0,
+    'balance': 1.0,
+    'preferred_days': 5.0,
+    'student_gaps': 2.0,
+}
+
+# How generation jobs run: "thread" (background thread of the web process),
+# "worker" (picked up by `manage.py run_schedule_worker`) or "inline".
+# A job that stops reporting progress for SCHEDULER_JOB_TIMEOUT seconds
+# releases its lock so new jobs can start.
+
+SCHEDULER_JOB_RUNNER = 'thread'
+SCHEDULER_JOB_TIMEOUT = 3600
+
+
+# Attendance ingestion
+# With the buffer enabled, single check-ins are queued in memory and written
+# in batches of up to ATTENDANCE_BUFFER_SIZE at least every
+# ATTENDANCE_FLUSH_INTERVAL seconds; the endpoint then answers 202.
+
+ATTENDANCE_BUFFER_ENABLED = False
+ATTENDANCE_BUFFER_SIZE = 500
+ATTENDANCE_FLUSH_INTERVAL = 0.5
+
+
+# Timetable change feed
+# Server-sent event streams of timetable changes send a keep-alive every
+# TIMETABLE_STREAM_HEARTBEAT seconds and close after TIMETABLE_STREAM_SECONDS;
+# clients reconnect with Last-Event-ID and miss nothing. Serve them from ASGI.
+
+TIMETABLE_STREAM_HEARTBEAT = 15
+TIMETABLE_STREAM_SECONDS = 300
+
+
+# Authentication
+# Logins get a session and a signed bearer token valid for AUTH_TOKEN_MAX_AGE
+# seconds. A session user's role is cached per process for
+# AUTH_USER_CACHE_TTL seconds. PASSWORD_HASH_ITERATIONS sets the PBKDF2 work
+# factor (None for Django's default); stored hashes are rewritten with it on
+# the next successful login.
+
+AUTH_TOKEN_MAX_AGE = 7 * 24 * 3600
+AUTH_USER_CACHE_TTL = 60
+PASSWORD_HASH_ITERATIONS = None
+
+# Work factor for passwords set by `manage.py import_data` and api/import/
+# (None: PASSWORD_HASH_ITERATIONS). A lower value makes term-start imports
+# fast; each hash is upgraded on the user's first login.
+IMPORT_PASSWORD_ITERATIONS = None
+
+PASSWORD_HASHERS = [
+    'api.hashers.TunablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+
+# Metrics
+# With METRICS_ENABLED, requests are timed and their queries counted per
+# endpoint, scheduler runs are recorded, and /metrics serves it all in the
+# Prometheus text format to staff users or to "Authorization: Bearer
+# METRICS_TOKEN". Queries slower than METRICS_SLOW_QUERY_MS are sampled (see
+# /api/metrics/slow-queries/) and logged. METRICS_LOG_REQUESTS also logs every
+# request and scheduler run as a JSON line on the "api.metrics" logger.
+
+METRICS_ENABLED = False
+METRICS_TOKEN = None
+METRICS_SLOW_QUERY_MS = 100
+METRICS_LOG_REQUESTS = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.metrics': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
@@ -15,8 +15,15 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path
-from api.views import LoginView, TimetableView, CancelClassView, AttendanceView, GenerateTimetableView
+from django.urls import path, re_path
+from api import async_views
+from api.views import (LoginView, TimetableView, CancelClassView, AttendanceView, BulkAttendanceView,
+                       GenerateTimetableView, ScheduleJobView, CourseAttendanceStatsView, SessionAttendanceStatsView,
+                       StudentAttendanceStatsView, AttendanceAlertsView, ImportView,
+                       TimetableExportView, AttendanceExportView, TimetableFeedView,
+                       MetricsView, SlowQueriesView, EvaluateTimetableView,
+                       ScenarioListView, ScenarioView, PromoteScenarioView, TimetableChangesView,
+                       FreeRoomsView, CalendarView, ValidateTimetableView)
 
 
 urlpatterns = [
@@ -25,7 +32,32 @@ urlpatterns = [
     path('api/timetable/', TimetableView.as_view(), name='timetable'),
     path('api/cancel-class/<int:timetable_id>/', CancelClassView.as_view(), name='cancel_class'),
     path('api/attendance/<int:timetable_id>/', AttendanceView.as_view(), name='attendance'),
+    path('api/attendance/bulk/', BulkAttendanceView.as_view(), name='attendance_bulk'),
+    path('api/attendance/stats/courses/<int:course_id>/', CourseAttendanceStatsView.as_view(), name='course_attendance_stats'),
+    path('api/attendance/stats/sessions/<int:timetable_id>/', SessionAttendanceStatsView.as_view(), name='session_attendance_stats'),
+    path('api/attendance/stats/students/<int:student_id>/', StudentAttendanceStatsView.as_view(), name='student_attendance_stats'),
+    path('api/attendance/alerts/', AttendanceAlertsView.as_view(), name='attendance_alerts'),
+    path('api/calendar/', CalendarView.as_view(), name='calendar'),
+    path('api/timetable/changes/', TimetableChangesView.as_view(), name='timetable_changes'),
+    path('api/timetable/evaluate/', EvaluateTimetableView.as_view(), name='evaluate_timetable'),
+    path('api/timetable/validate/', ValidateTimetableView.as_view(), name='validate_timetable'),
+    path('api/timetable.ics', TimetableFeedView.as_view(), name='timetable_feed'),
+    re_path(r'^api/export/timetable\.(?P<fmt>jsonl|csv)$', TimetableExportView.as_view(), name='timetable_export'),
+    re_path(r'^api/export/attendance\.(?P<fmt>jsonl|csv)$', AttendanceExportView.as_view(), name='attendance_export'),
+    path('api/rooms/free/', FreeRoomsView.as_view(), name='free_rooms'),
+    path('api/import/', ImportView.as_view(), name='import'),
     path('api/generate-timetable/', GenerateTimetableView.as_view(), name='generate_timetable'),
+    path('api/generate-timetable/<int:job_id>/', ScheduleJobView.as_view(), name='schedule_job'),
+    path('api/scenarios/', ScenarioListView.as_view(), name='scenarios'),
+    path('api/scenarios/<int:scenario_id>/', ScenarioView.as_view(), name='scenario'),
+    path('api/scenarios/<int:scenario_id>/promote/', PromoteScenarioView.as_view(), name='promote_scenario'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('api/metrics/slow-queries/', SlowQueriesView.as_view(), name='slow_queries'),
+    # Async read and check-in path, for ASGI deployments
+    path('api/async/timetable/', async_views.timetable, name='async_timetable'),
+    path('api/async/timetable/changes/', async_views.timetable_changes, name='async_timetable_changes'),
+    path('api/async/attendance/<int:timetable_id>/', async_views.attendance, name='async_attendance'),
+    path('api/async/generate-timetable/<int:job_id>/', async_views.schedule_job, name='async_schedule_job'),
 ]
 
 